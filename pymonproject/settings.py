@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -42,6 +43,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'safarank.metricas.MetricasMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -55,7 +57,8 @@ ROOT_URLCONF = 'pymonproject.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # igual que DjangoTemplates pero mide el tiempo de pintado (metricas.py)
+        'BACKEND': 'safarank.metricas.PlantillasMedidas',
         'DIRS': [BASE_DIR / 'templates']
         ,
         'APP_DIRS': True,
@@ -75,16 +78,21 @@ WSGI_APPLICATION = 'pymonproject.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/6.0/ref/settings/#databases
 
+# Los nombres se pueden cambiar por entorno, p.ej. para lanzar los benchmarks
+# contra bases de datos aparte (el benchmark se niega si el nombre de mongo no
+# acaba en _bench):
+#   SAFARANK_MONGO_DB=safarank_bench SAFARANK_SQLITE=bench.sqlite3 python manage.py benchmark
+
 DATABASES = {
 
     'mongodb': {
         'ENGINE': 'django_mongodb_backend',
         'HOST': 'mongodb://localhost:27017/',
-        'NAME': 'safarank'
+        'NAME': os.environ.get('SAFARANK_MONGO_DB', 'safarank')
     },
     'default':{
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',}
+        'NAME': BASE_DIR / os.environ.get('SAFARANK_SQLITE', 'db.sqlite3'),}
 
 }
 
@@ -130,5 +138,81 @@ STATICFILES_DIRS = [
     BASE_DIR / "static",
 ]
 
+# Miniaturas de las fotos de los móviles (safarank/miniaturas.py). Los nombres
+# llevan el hash del contenido, así que se sirven con caché de un año
+SAFARANK_MINIATURAS_DIR = os.environ.get('SAFARANK_MINIATURAS_DIR', BASE_DIR / 'media' / 'miniaturas')
+
+# Vistas async de detalle_movil y ver_ranking (safarank/vistas_async.py). Solo
+# tienen sentido por ASGI (asgi.py lo activa); por WSGI cada petición async
+# abriría su propio bucle de eventos y su propio cliente de mongo
+SAFARANK_VISTAS_ASYNC = os.environ.get('SAFARANK_VISTAS_ASYNC') == '1'
+
 
 AUTH_USER_MODEL = 'safarank.Usuario'
+
+# El usuario de cada petición sale de la caché 'sesiones' si la hay (ver más abajo)
+AUTHENTICATION_BACKENDS = ['safarank.autenticacion.BackendCacheado']
+
+
+# Caché
+# El catálogo se cachea en su propio alias ('catalogo'). En producción con
+# varios procesos conviene un backend compartido (Redis/Memcached) para que
+# todos vean la misma versión del catálogo.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'catalogo': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'catalogo',
+        'TIMEOUT': 600,
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+}
+
+# Sesiones y usuario de la sesión (safarank/autenticacion.py). Con varios
+# procesos su caché tiene que ser compartida: en LocMem cada proceso tendría su
+# copia y un cambio de rol, una baja o un logout tardarían en verse en los
+# demás. Por eso solo se cachean si hay Redis (SAFARANK_REDIS_URL); si no, las
+# sesiones se leen de SQLite y el usuario también
+SAFARANK_REDIS_URL = os.environ.get('SAFARANK_REDIS_URL')
+if SAFARANK_REDIS_URL:
+    CACHES['sesiones'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': SAFARANK_REDIS_URL,
+        'KEY_PREFIX': 'safarank',
+    }
+    # se leen de la caché y solo se escriben en SQLite cuando cambian (login,
+    # logout...). Si la caché se pierde se recuperan de la base de datos
+    SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+    SESSION_CACHE_ALIAS = 'sesiones'
+    SAFARANK_CACHE_USUARIOS = 'sesiones'
+else:
+    SESSION_ENGINE = 'django.contrib.sessions.backends.db'
+    SAFARANK_CACHE_USUARIOS = None
+SAFARANK_USUARIO_TTL = 300
+
+
+SAFARANK_CACHE_CATALOGO = 'catalogo'
+SAFARANK_CACHE_STATS_TTL = 60
+
+# Clasificación: votos ficticios con la media global que se suman a cada
+# móvil (media bayesiana) y tamaño de las listas top-k precalculadas
+SAFARANK_BAYES_PESO = 10
+SAFARANK_TOP_K = 10
+
+# Recomendaciones: vecinos que se guardan por móvil y cuántos usuarios en
+# común hacen falta para que la similitud cuente la mitad
+SAFARANK_RECOMENDACIONES_N = 10
+SAFARANK_RECOMENDACIONES_ENCOGIMIENTO = 5
+
+# Tier list de la comunidad: en cuántas listas tiene que estar un móvil para salir
+SAFARANK_CONSENSO_MIN_LISTAS = 2
+
+# Exportación: documentos que se piden a mongo en cada lote del cursor
+SAFARANK_EXPORT_LOTE = 2000
+
+# Métricas: a partir de cuántas consultas (mongo + sqlite) por petición se
+# avisa en el log
+SAFARANK_PRESUPUESTO_CONSULTAS = 20
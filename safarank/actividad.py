@@ -0,0 +1,107 @@
+from django.db.models import Count
+from pymongo import ReturnDocument
+
+from .ids import CONTADORES
+from .models import Usuario, Valoracion, RankingPersonal
+from .mongo import coleccion
+
+#contadores de actividad por usuario, para las estadísticas de usuarios sin
+#recorrer las valoraciones ni los rankings:
+#{'_id': email, 'valoraciones': n, 'rankings': n}
+#y en 'contadores' un documento con cuántos usuarios tienen alguna de cada:
+#{'_id': 'actividad_usuarios', 'con_valoraciones': n, 'con_rankings': n, 'con_actividad': n}
+#Al sumar o restar solo se toca el total si el usuario pasa de 0 a 1 o de 1 a 0
+
+ACTIVIDAD = 'actividad_usuarios'
+CAMPOS = ('valoraciones', 'rankings')
+
+
+def _actividad():
+    return coleccion(ACTIVIDAD)
+
+
+def _sumar(email, campo, n):
+    doc = _actividad().find_one_and_update(
+        {'_id': email}, {'$inc': {campo: n}}, upsert=True, return_document=ReturnDocument.AFTER,
+    )
+    despues = doc.get(campo, 0)
+    antes = despues - n
+    otro = doc.get(next(c for c in CAMPOS if c != campo), 0)
+    if antes <= 0 < despues:
+        signo = 1
+    elif despues <= 0 < antes:
+        signo = -1
+    else:
+        return
+    inc = {f'con_{campo}': signo}
+    if otro <= 0:
+        inc['con_actividad'] = signo
+    coleccion(CONTADORES).update_one({'_id': ACTIVIDAD}, {'$inc': inc}, upsert=True)
+
+
+def registrar_valoracion(email, n=1):
+    #solo para valoraciones nuevas, editar una no cambia nada
+    _sumar(email, 'valoraciones', n)
+
+
+def registrar_ranking(email, n=1):
+    _sumar(email, 'rankings', n)
+
+
+def totales():
+    doc = coleccion(CONTADORES).find_one({'_id': ACTIVIDAD}) or {}
+    return {c: doc.get(c, 0) for c in ('con_valoraciones', 'con_rankings', 'con_actividad')}
+
+
+def de_usuarios(emails):
+    #valoraciones y rankings de una página de usuarios, en una sola consulta
+    docs = _actividad().find({'_id': {'$in': list(emails)}})
+    return {d['_id']: {c: d.get(c, 0) for c in CAMPOS} for d in docs}
+
+
+def stats_usuarios():
+    #cuántos usuarios hay por rol y activos/inactivos (un GROUP BY en SQLite)
+    #más los totales de actividad que ya están contados en mongo
+    nombres = dict(Usuario.ROLES)
+    por_rol, activos, inactivos = {}, 0, 0
+    for fila in Usuario.objects.values('rol', 'is_active').annotate(n=Count('pk')).order_by():
+        rol = nombres.get(fila['rol'], fila['rol'])
+        por_rol[rol] = por_rol.get(rol, 0) + fila['n']
+        if fila['is_active']:
+            activos += fila['n']
+        else:
+            inactivos += fila['n']
+    return {
+        'total': activos + inactivos,
+        'por_rol': sorted(por_rol.items()),
+        'activos': activos,
+        'inactivos': inactivos,
+        **totales(),
+    }
+
+
+def reconstruir():
+    #recalcula los contadores desde cero a partir de valoraciones y rankings
+    coleccion(Valoracion).aggregate([
+        {'$group': {'_id': '$user_email', 'valoraciones': {'$sum': 1}}},
+        {'$unionWith': {'coll': RankingPersonal._meta.db_table, 'pipeline': [
+            {'$group': {'_id': '$user_email', 'rankings': {'$sum': 1}}},
+        ]}},
+        {'$group': {'_id': '$_id', **{c: {'$sum': {'$ifNull': [f'${c}', 0]}} for c in CAMPOS}}},
+        {'$out': ACTIVIDAD},
+    ])
+    filas = list(_actividad().aggregate([
+        {'$group': {
+            '_id': None,
+            'con_valoraciones': {'$sum': {'$cond': [{'$gt': ['$valoraciones', 0]}, 1, 0]}},
+            'con_rankings': {'$sum': {'$cond': [{'$gt': ['$rankings', 0]}, 1, 0]}},
+            'con_actividad': {'$sum': 1},
+        }},
+    ]))
+    total = filas[0] if filas else {}
+    coleccion(CONTADORES).replace_one(
+        {'_id': ACTIVIDAD},
+        {c: total.get(c, 0) for c in ('con_valoraciones', 'con_rankings', 'con_actividad')},
+        upsert=True,
+    )
+    return total.get('con_actividad', 0)
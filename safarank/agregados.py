@@ -0,0 +1,68 @@
+from pymongo import ReturnDocument
+
+from .models import Valoracion
+from .mongo import coleccion
+
+#un documento pequeño por móvil con el resumen de sus votos:
+#{'_id': movil_id, 'votos': n, 'suma': n, 'estrellas': {'1': n, ..., '5': n}}
+#se actualiza con $inc cada vez que alguien vota, así las estadísticas
+#no tienen que recorrer todas las valoraciones
+
+RESUMEN = 'resumen_valoraciones'
+ESTRELLAS = ('1', '2', '3', '4', '5')
+
+
+def _resumen():
+    return coleccion(RESUMEN)
+
+
+def registrar_voto(movil_id, puntuacion, anterior=None):
+    #anterior es la puntuación que tenía la valoración si se está editando.
+    #Devuelve el resumen ya actualizado (None si no ha cambiado nada)
+    if anterior is None:
+        inc = {'votos': 1, 'suma': puntuacion, f'estrellas.{puntuacion}': 1}
+    elif anterior != puntuacion:
+        inc = {'suma': puntuacion - anterior, f'estrellas.{puntuacion}': 1, f'estrellas.{anterior}': -1}
+    else:
+        return None
+    return _resumen().find_one_and_update(
+        {'_id': movil_id}, {'$inc': inc}, upsert=True, return_document=ReturnDocument.AFTER,
+    )
+
+
+def resumen_movil(movil_id):
+    doc = _resumen().find_one({'_id': movil_id}) or {}
+    votos = doc.get('votos', 0)
+    suma = doc.get('suma', 0)
+    estrellas = doc.get('estrellas', {})
+    return {
+        'votos': votos,
+        'suma': suma,
+        'media': round(suma / votos, 1) if votos else 0,
+        'estrellas': {e: estrellas.get(e, 0) for e in ESTRELLAS},
+    }
+
+
+def totales():
+    res = list(_resumen().aggregate([
+        {'$group': {'_id': None, 'votos': {'$sum': '$votos'}, 'suma': {'$sum': '$suma'}}},
+    ]))
+    if not res:
+        return 0, 0
+    return res[0]['votos'], res[0]['suma']
+
+
+def reconstruir():
+    #recalcula todos los resúmenes desde cero a partir de las valoraciones
+    #($out sustituye la colección de golpe cuando termina). Se pierde la
+    #puntuación 'bayes': después hay que llamar a clasificacion.reconstruir()
+    estrellas = {
+        e: {'$sum': {'$cond': [{'$eq': ['$puntuacion', int(e)]}, 1, 0]}} for e in ESTRELLAS
+    }
+    coleccion(Valoracion).aggregate([
+        {'$group': {'_id': '$movil_id', 'votos': {'$sum': 1}, 'suma': {'$sum': '$puntuacion'},
+                    **{f'e{e}': v for e, v in estrellas.items()}}},
+        {'$project': {'votos': 1, 'suma': 1, 'estrellas': {e: f'$e{e}' for e in ESTRELLAS}}},
+        {'$out': RESUMEN},
+    ])
+    return _resumen().count_documents({})
@@ -0,0 +1,127 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from . import cache_catalogo
+from .models import MovilXiaomi
+from .mongo import coleccion, columna_pk
+
+#"parecidos a este pero más baratos": vecinos más cercanos por specs. Cada
+#proceso tiene en memoria una matriz float32 contigua con cada campo
+#normalizado (media 0, desviación 1), guardada por campos (CAMPOS x móviles)
+#para que el producto con el móvil de consulta recorra memoria seguida.
+#Las columnas van ordenadas por precio, así "precio máximo" o "más barato"
+#se quedan en un prefijo (searchsorted) en vez de una máscara. La matriz se
+#rehace en segundo plano cuando cambia la versión compartida del catálogo
+#(cache_catalogo.version_compartida, la sube invalidar en cualquier proceso);
+#mientras tanto las peticiones siguen usando la anterior
+
+CAMPOS = ('price', 'ram', 'storage', 'camera', 'battery', 'ratings', 'android_version')
+LOTE_LECTURA = 10000
+#cada cuántos segundos se mira si ha cambiado la versión
+COMPROBAR_CADA = 5
+
+_lock = threading.Lock()
+_datos = None
+_comprobado = 0.0
+_rehaciendo = False
+_segundo_plano = ThreadPoolExecutor(1, thread_name_prefix='alternativas')
+
+
+class _Matriz:
+
+    def __init__(self, version, ids, valores):
+        orden = np.lexsort((ids, valores[:, CAMPOS.index('price')]))
+        ids, valores = ids[orden], valores[orden]
+        self.version = version
+        self.ids = ids
+        self.posicion = {int(m): i for i, m in enumerate(ids)}
+        self.precio = valores[:, CAMPOS.index('price')].copy()
+        self.ram = valores[:, CAMPOS.index('ram')].copy()
+        media = valores.mean(axis=0) if len(valores) else 0
+        desviacion = valores.std(axis=0) if len(valores) else 1
+        desviacion = np.where(desviacion > 0, desviacion, 1)
+        self.campos = np.ascontiguousarray(((valores - media) / desviacion).T, dtype=np.float32)
+        #|x|^2 de cada móvil: |x - q|^2 = |x|^2 - 2 x·q + |q|^2
+        self.normas = np.einsum('ij,ij->j', self.campos, self.campos)
+
+
+def _leer(version, moviles):
+    pk = columna_pk(MovilXiaomi)
+    cursor = moviles.find({}, {pk: 1, **{c: 1 for c in CAMPOS}}, batch_size=LOTE_LECTURA)
+    ids, filas = [], []
+    for doc in cursor:
+        ids.append(doc[pk])
+        filas.append([float(doc.get(c) or 0) for c in CAMPOS])
+    valores = np.array(filas, dtype=np.float64).reshape(len(filas), len(CAMPOS))
+    return _Matriz(version, np.array(ids, dtype=np.int64), valores)
+
+
+_VACIA = _Matriz(None, np.empty(0, dtype=np.int64), np.empty((0, len(CAMPOS))))
+
+
+def rehacer(version=None):
+    #lanza la reconstrucción en segundo plano (solo una a la vez). Devuelve el
+    #future, o None si ya se estaba haciendo
+    global _rehaciendo
+    with _lock:
+        if _rehaciendo:
+            return None
+        _rehaciendo = True
+    #la colección se saca aquí: el hilo no debe abrir conexiones de django
+    moviles = coleccion(MovilXiaomi)
+    if version is None:
+        version = cache_catalogo.version_compartida()
+
+    def tarea():
+        global _datos, _rehaciendo
+        try:
+            _datos = _leer(version, moviles)
+        finally:
+            with _lock:
+                _rehaciendo = False
+
+    return _segundo_plano.submit(tarea)
+
+
+def matriz():
+    #nunca espera a leer el catálogo: hasta que esté la primera se usa una vacía
+    global _comprobado
+    ahora = time.monotonic()
+    if _datos is None or ahora - _comprobado >= COMPROBAR_CADA:
+        _comprobado = ahora
+        version = cache_catalogo.version_compartida()
+        if _datos is None or _datos.version != version:
+            rehacer(version)
+    return _datos if _datos is not None else _VACIA
+
+
+def buscar(movil_id, n=5, precio_max=None, ram_min=None, mas_barato=False, datos=None):
+    #ids de los n móviles más parecidos a movil_id que cumplen las condiciones,
+    #del más parecido al menos. mas_barato: solo los que cuestan menos que él
+    datos = datos or matriz()
+    fila = datos.posicion.get(movil_id)
+    if fila is None or n <= 0:
+        return []
+    limite = len(datos.ids)
+    if mas_barato:
+        limite = np.searchsorted(datos.precio, datos.precio[fila], 'left')
+    if precio_max is not None:
+        limite = min(limite, np.searchsorted(datos.precio, precio_max, 'right'))
+
+    distancia = datos.campos[:, fila] @ datos.campos[:, :limite]
+    distancia *= -2
+    distancia += datos.normas[:limite]
+    if fila < limite:
+        distancia[fila] = np.inf
+    if ram_min is not None:
+        np.putmask(distancia, datos.ram[:limite] < ram_min, np.inf)
+
+    n = min(n, limite)
+    if n == 0:
+        return []
+    cercanos = np.argpartition(distancia, n - 1)[:n] if n < limite else np.arange(n)
+    cercanos = cercanos[np.argsort(distancia[cercanos], kind='stable')]
+    return [int(datos.ids[i]) for i in cercanos if np.isfinite(distancia[i])]
@@ -3,3 +3,20 @@ from django.apps import AppConfig
 
 class PollsConfig(AppConfig):
     name = 'safarank'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_delete, post_save
+        from pymongo import monitoring
+
+        from .autenticacion import invalidar_al_guardar
+        from .metricas import EscuchaMongo, instalar_en_conexion
+        from .models import Usuario
+
+        #el listener tiene que estar antes de que se cree el cliente de mongo
+        monitoring.register(EscuchaMongo())
+        connection_created.connect(instalar_en_conexion)
+
+        #un cambio de nombre, rol o contraseña tiene que verse en la siguiente petición
+        post_save.connect(invalidar_al_guardar, sender=Usuario)
+        post_delete.connect(invalidar_al_guardar, sender=Usuario)
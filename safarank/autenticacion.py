@@ -0,0 +1,54 @@
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import caches
+
+#el usuario de la sesión se guarda en caché por id, así las vistas que solo
+#miran request.user.email o .rol no tocan SQLite. Se invalida al guardar o
+#borrar el Usuario (señales en apps.py); un queryset.update() no lanza
+#señales, así que quien lo use tiene que llamar a invalidar(). Solo se cachea
+#si SAFARANK_CACHE_USUARIOS apunta a una caché compartida por todos los
+#procesos (ver settings); con None es el ModelBackend de siempre
+
+
+def _cache():
+    alias = settings.SAFARANK_CACHE_USUARIOS
+    return caches[alias] if alias else None
+
+
+def _clave(user_id):
+    return f'usuario:{user_id}'
+
+
+def invalidar(user_id):
+    cache = _cache()
+    if cache is not None:
+        cache.delete(_clave(user_id))
+
+
+def invalidar_al_guardar(sender, instance, **kwargs):
+    invalidar(instance.pk)
+
+
+class BackendCacheado(ModelBackend):
+
+    def get_user(self, user_id):
+        cache = _cache()
+        if cache is None:
+            return super().get_user(user_id)
+        usuario = cache.get(_clave(user_id))
+        if usuario is None:
+            usuario = super().get_user(user_id)
+            if usuario is not None:
+                cache.set(_clave(user_id), usuario, settings.SAFARANK_USUARIO_TTL)
+        return usuario
+
+    async def aget_user(self, user_id):
+        cache = _cache()
+        if cache is None:
+            return await super().aget_user(user_id)
+        usuario = await cache.aget(_clave(user_id))
+        if usuario is None:
+            usuario = await super().aget_user(user_id)
+            if usuario is not None:
+                await cache.aset(_clave(user_id), usuario, settings.SAFARANK_USUARIO_TTL)
+        return usuario
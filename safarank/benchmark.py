@@ -0,0 +1,151 @@
+import csv
+import io
+import json
+import random
+import statistics
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from .generador import EMAIL_ADMIN
+from .models import MovilXiaomi, RankingPersonal
+
+#benchmark de los flujos principales: varios clientes concurrentes (cada uno
+#con su usuario) lanzan peticiones contra cada endpoint y se mide
+#throughput, percentiles de latencia y pico de memoria. El resultado es un
+#JSON pensado para guardarlo y compararlo entre versiones
+
+#cargar_datos sustituye el catálogo entero, por eso va el último
+ENDPOINTS = ('catalogo', 'detalle_movil', 'ver_ranking', 'guardar_orden_ranking',
+             'estadisticas_globales', 'cargar_datos')
+SOLO_ADMIN = ('estadisticas_globales', 'cargar_datos')
+
+
+class _Cliente:
+    def __init__(self, usuario, num_moviles, semilla):
+        self.client = Client()
+        self.client.force_login(usuario)
+        self.rnd = random.Random(semilla)
+        self.num_moviles = num_moviles
+        self.ranking = RankingPersonal.objects.using('mongodb').filter(user_email=usuario.email).first()
+
+    def movimiento(self):
+        #un móvil cambia de sitio dentro de su misma tier, así siempre es válido;
+        #se pone delante de otro cualquiera de la tier o al final
+        for tier, movil_ids in self.ranking.elementos.items():
+            if len(movil_ids) > 1:
+                movil_id = self.rnd.choice(movil_ids)
+                antes_de = self.rnd.choice([m for m in movil_ids if m != movil_id] + [None])
+                return {'movil_id': movil_id, 'desde': tier, 'hasta': tier, 'antes_de': antes_de}
+        return None
+
+
+def _csv(filas, rnd):
+    texto = io.StringIO()
+    escritor = csv.writer(texto)
+    escritor.writerow(['name', 'imgURL', 'price', 'ratings', 'ram', 'storage', 'camera', 'battery'])
+    for i in range(filas):
+        escritor.writerow([f'Xiaomi CSV {i}', '', rnd.randint(9000, 90000), 4.2, 8, 256, 50, 5000])
+    return texto.getvalue().encode('utf-8')
+
+
+def _peticion(endpoint, cliente, csv_bytes):
+    c, rnd = cliente.client, cliente.rnd
+    if endpoint == 'catalogo':
+        return c.get(reverse('catalogo'))
+    if endpoint == 'detalle_movil':
+        return c.get(reverse('detalle_movil', args=[rnd.randint(1, cliente.num_moviles)]))
+    if endpoint == 'ver_ranking':
+        return c.get(reverse('ver_ranking', args=[cliente.ranking.id]))
+    if endpoint == 'guardar_orden_ranking':
+        movimiento = cliente.movimiento()
+        #sin nada que mover se guarda el orden completo tal cual
+        cuerpo = ({'ranking_id': cliente.ranking.id, 'mover': movimiento} if movimiento else
+                  {'ranking_id': cliente.ranking.id, 'tiers': cliente.ranking.elementos})
+        return c.post(reverse('guardar_orden_ranking'), json.dumps(cuerpo), content_type='application/json')
+    if endpoint == 'estadisticas_globales':
+        return c.get(reverse('estadisticas_globales'))
+    if endpoint == 'cargar_datos':
+        return c.post(reverse('cargar_datos'), {'csvFile': SimpleUploadedFile('bench.csv', csv_bytes)})
+    raise ValueError(endpoint)
+
+
+def _percentil(ordenadas, p):
+    return round(ordenadas[min(len(ordenadas) - 1, int(len(ordenadas) * p / 100))], 2)
+
+
+def _medir(endpoint, clientes, peticiones, concurrencia, csv_bytes):
+    errores = []
+    lock = threading.Lock()
+
+    def una(i):
+        cliente = clientes[i % len(clientes)]
+        inicio = time.perf_counter()
+        respuesta = _peticion(endpoint, cliente, csv_bytes)
+        ms = (time.perf_counter() - inicio) * 1000
+        if respuesta.status_code >= 300:
+            with lock:
+                errores.append(respuesta.status_code)
+        return ms
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(concurrencia) as pool:
+        latencias = sorted(pool.map(una, range(peticiones)))
+    duracion = time.perf_counter() - inicio
+    return {
+        'peticiones': peticiones,
+        'errores': len(errores),
+        'concurrencia': concurrencia,
+        'rps': round(peticiones / duracion, 2),
+        'p50_ms': _percentil(latencias, 50),
+        'p95_ms': _percentil(latencias, 95),
+        'p99_ms': _percentil(latencias, 99),
+        'media_ms': round(statistics.mean(latencias), 2),
+    }
+
+
+def _pico_memoria(endpoint, cliente, csv_bytes, repeticiones=3):
+    #pasada aparte con tracemalloc (ralentiza mucho, no se mezcla con las latencias)
+    tracemalloc.start()
+    try:
+        for _ in range(repeticiones):
+            _peticion(endpoint, cliente, csv_bytes)
+        return round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+    finally:
+        tracemalloc.stop()
+
+
+def ejecutar(peticiones=200, concurrencia=8, endpoints=ENDPOINTS, filas_csv=1000, semilla=0, salida=None):
+    avisar = salida or (lambda texto: None)
+    Usuario = get_user_model()
+    num_moviles = MovilXiaomi.objects.using('mongodb').count()
+    #los primeros usuarios sintéticos son los que tienen ranking (ver generador._rankings)
+    usuarios = list(Usuario.objects.filter(email__endswith='@bench.local', rol='cliente').order_by('pk')[:concurrencia])
+    admin = Usuario.objects.get(email=EMAIL_ADMIN)
+    clientes = [_Cliente(u, num_moviles, semilla + i) for i, u in enumerate(usuarios)]
+    if not clientes or any(c.ranking is None for c in clientes):
+        raise ValueError('Faltan usuarios o rankings sintéticos, hay que sembrar antes.')
+    cliente_admin = _Cliente(admin, num_moviles, semilla)
+    csv_bytes = _csv(filas_csv, random.Random(semilla))
+
+    resultado = {'fecha': timezone.now().isoformat(), 'endpoints': {}}
+    for endpoint in endpoints:
+        avisar(f'Midiendo {endpoint}...')
+        admin_solo = endpoint in SOLO_ADMIN
+        #las cargas de CSV se pisan entre ellas, no tiene sentido lanzarlas a la vez
+        n = max(1, peticiones // 20) if endpoint == 'cargar_datos' else peticiones
+        resultado['endpoints'][endpoint] = _medir(
+            endpoint, [cliente_admin] if admin_solo else clientes, n,
+            1 if endpoint == 'cargar_datos' else concurrencia, csv_bytes,
+        )
+        resultado['endpoints'][endpoint]['pico_memoria_kb'] = _pico_memoria(
+            endpoint, cliente_admin if admin_solo else clientes[0], csv_bytes,
+        )
+    return resultado
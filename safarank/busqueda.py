@@ -0,0 +1,170 @@
+import re
+
+from django.core.exceptions import ValidationError
+
+from .models import MovilXiaomi
+from .mongo import coleccion, columna_pk
+
+#filtros, orden y facetas del catálogo. Los criterios se leen una vez de la
+#querystring y se traducen tanto a filtros del ORM (para la página) como a un
+#$match de mongo (para las facetas). El texto se busca siempre literal
+
+#parámetro -> (campo, lookup)
+RANGOS = {
+    'precio_min': ('price', 'gte'),
+    'precio_max': ('price', 'lte'),
+    'bateria_min': ('battery', 'gte'),
+    'camara_min': ('camera', 'gte'),
+    'nota_min': ('ratings', 'gte'),
+}
+#parámetros que admiten varios valores (?ram=8&ram=12)
+VALORES = {
+    'ram': 'ram',
+    'almacenaje': 'storage',
+}
+
+ORDENES = {
+    '': ('id', False),
+    'precio': ('price', False),
+    '-precio': ('price', True),
+    '-nota': ('ratings', True),
+    '-bateria': ('battery', True),
+    'nombre': ('name', False),
+}
+
+TRAMOS_PRECIO = [0, 150, 250, 400, 600, 900]
+TRAMOS_NOTA = [0, 3, 4, 4.5]
+
+_MONGO_OP = {'gte': '$gte', 'lte': '$lte'}
+
+#faceta -> parámetros de su propia dimensión, que no se aplican al contarla
+#(con ?ram=8 la faceta de RAM sigue enseñando cuántos hay de 12)
+FACETAS = {
+    'ram': ('ram',),
+    'almacenaje': ('almacenaje',),
+    'precio': ('precio_min', 'precio_max'),
+    'nota': ('nota_min',),
+}
+
+
+def _convertir(campo, valor):
+    return MovilXiaomi._meta.get_field(campo).to_python(valor)
+
+
+def parsear(params):
+    #devuelve los criterios limpios; lo que no se entiende se ignora
+    criterios = {'rangos': {}, 'valores': {}, 'q': params.get('q', '').strip(), 'orden': ''}
+    for param, (campo, lookup) in RANGOS.items():
+        try:
+            if params.get(param):
+                criterios['rangos'][param] = (campo, lookup, _convertir(campo, params[param]))
+        except ValidationError:
+            pass
+    for param, campo in VALORES.items():
+        try:
+            valores = sorted({_convertir(campo, v) for v in params.getlist(param) if v})
+        except ValidationError:
+            continue
+        if valores:
+            criterios['valores'][param] = (campo, valores)
+    if params.get('orden') in ORDENES:
+        criterios['orden'] = params['orden']
+    return criterios
+
+
+def hay_filtros(criterios):
+    return bool(criterios['rangos'] or criterios['valores'] or criterios['q'])
+
+
+def clave(criterios):
+    #texto estable para usarlo en claves de caché
+    partes = [f'{p}={v[2]}' for p, v in sorted(criterios['rangos'].items())]
+    partes += [f'{p}={",".join(map(str, v[1]))}' for p, v in sorted(criterios['valores'].items())]
+    return '&'.join(partes + [f"q={criterios['q']}", f"orden={criterios['orden']}"])
+
+
+def filtrar(qs, criterios):
+    filtros = {f'{campo}__{lookup}': valor for campo, lookup, valor in criterios['rangos'].values()}
+    filtros.update({f'{campo}__in': valores for campo, valores in criterios['valores'].values()})
+    if criterios['q']:
+        filtros['name__icontains'] = criterios['q']
+    return qs.filter(**filtros)
+
+
+def orden(criterios):
+    #(campo, descendente, desempate) para pagina_keyset
+    campo, descendente = ORDENES[criterios['orden']]
+    return campo, descendente, (None if campo == 'id' else 'id')
+
+
+def cursor_a_texto(cursor):
+    if isinstance(cursor, tuple):
+        return f'{cursor[0]}:{cursor[1]}'
+    return str(cursor)
+
+
+def texto_a_cursor(texto, criterios):
+    campo, _, desempate = orden(criterios)
+    try:
+        if desempate:
+            valor, id_ = texto.rsplit(':', 1)
+            return _convertir(campo, valor), int(id_)
+        return _convertir(campo, texto)
+    except (ValueError, ValidationError):
+        return None
+
+
+def _match(criterios, ids=None, excluir=()):
+    match = {}
+    for param, (campo, lookup, valor) in criterios['rangos'].items():
+        if param not in excluir:
+            match.setdefault(campo, {})[_MONGO_OP[lookup]] = valor
+    for param, (campo, valores) in criterios['valores'].items():
+        if param not in excluir:
+            match[campo] = {'$in': valores}
+    if criterios['q']:
+        #texto literal, igual que el icontains del ORM
+        match['name'] = {'$regex': re.escape(criterios['q']), '$options': 'i'}
+    if ids is not None:
+        match[columna_pk(MovilXiaomi)] = {'$in': list(ids)}
+    return match
+
+
+def _solo(criterios, params):
+    #los criterios de estos parámetros y nada más (sin texto)
+    return {
+        'rangos': {p: v for p, v in criterios['rangos'].items() if p in params},
+        'valores': {p: v for p, v in criterios['valores'].items() if p in params},
+        'q': '',
+    }
+
+
+def facetas(criterios, ids=None):
+    #todos los recuentos en una sola agregación ($facet). Lo común se filtra una
+    #vez arriba; cada faceta aplica además los filtros de las otras dimensiones
+    de_facetas = {p for params in FACETAS.values() for p in params}
+
+    def faceta(nombre, etapas):
+        otros = de_facetas.difference(FACETAS[nombre]) if nombre in FACETAS else de_facetas
+        match = _match(_solo(criterios, otros))
+        return ([{'$match': match}] if match else []) + etapas
+
+    res = list(coleccion(MovilXiaomi).aggregate([
+        {'$match': _match(criterios, ids, excluir=de_facetas)},
+        {'$facet': {
+            'total': faceta('total', [{'$count': 'n'}]),
+            'ram': faceta('ram', [{'$group': {'_id': '$ram', 'n': {'$sum': 1}}}, {'$sort': {'_id': 1}}]),
+            'almacenaje': faceta('almacenaje', [{'$group': {'_id': '$storage', 'n': {'$sum': 1}}}, {'$sort': {'_id': 1}}]),
+            'precio': faceta('precio', [{'$bucket': {'groupBy': '$price', 'boundaries': TRAMOS_PRECIO, 'default': 'mas',
+                                                     'output': {'n': {'$sum': 1}}}}]),
+            'nota': faceta('nota', [{'$bucket': {'groupBy': '$ratings', 'boundaries': TRAMOS_NOTA + [6],
+                                                 'default': 'otros', 'output': {'n': {'$sum': 1}}}}]),
+        }},
+    ]))[0]
+    return {
+        'total': res['total'][0]['n'] if res['total'] else 0,
+        'ram': [(f['_id'], f['n']) for f in res['ram']],
+        'almacenaje': [(f['_id'], f['n']) for f in res['almacenaje']],
+        'precio': [(f['_id'], f['n']) for f in res['precio']],
+        'nota': [(f['_id'], f['n']) for f in res['nota']],
+    }
@@ -0,0 +1,126 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .ids import CONTADORES
+from .models import MovilXiaomi, Categoria
+from .mongo import coleccion
+
+#caché de lectura para los móviles y las categorías. Todas las claves llevan
+#la versión del catálogo delante, así que cuando el admin cambia algo basta
+#con subir la versión (invalidar()) y lo viejo deja de usarse y caduca solo.
+#El backend, el TTL y el tamaño máximo se configuran en CACHES (settings)
+
+CLAVE_VERSION = 'catalogo:version'
+#además hay una versión compartida por todos los procesos, en mongo, para lo
+#que cada proceso tiene en memoria y cuesta rehacer (la matriz de alternativas.py)
+CONTADOR_VERSION = 'catalogo'
+
+_NADA = object()
+_lock = threading.Lock()
+_contadores = {'aciertos': 0, 'fallos': 0}
+
+
+def _cache():
+    return caches[getattr(settings, 'SAFARANK_CACHE_CATALOGO', 'default')]
+
+
+def _contar(tipo, n=1):
+    with _lock:
+        _contadores[tipo] += n
+
+
+def contadores():
+    with _lock:
+        return dict(_contadores)
+
+
+def version():
+    cache = _cache()
+    v = cache.get(CLAVE_VERSION)
+    if v is None:
+        #si la clave se ha perdido (reinicio, desalojo...) se empieza en un
+        #número que no puede coincidir con una versión anterior
+        cache.add(CLAVE_VERSION, time.time_ns(), timeout=None)
+        v = cache.get(CLAVE_VERSION)
+    return v
+
+
+def version_compartida():
+    doc = coleccion(CONTADORES).find_one({'_id': CONTADOR_VERSION})
+    return doc['valor'] if doc else 0
+
+
+def invalidar(contadores=None):
+    #desde otros hilos hay que pasar la colección: no deben abrir conexiones de django
+    cache = _cache()
+    try:
+        cache.incr(CLAVE_VERSION)
+    except ValueError:
+        cache.add(CLAVE_VERSION, time.time_ns(), timeout=None)
+    if contadores is None:
+        contadores = coleccion(CONTADORES)
+    contadores.update_one({'_id': CONTADOR_VERSION}, {'$inc': {'valor': 1}}, upsert=True)
+
+
+def olvidar_movil(movil_id):
+    #quita de la caché solo ese móvil (las listas y páginas siguen como estaban)
+    _cache().delete(_clave(f'movil:{movil_id}'))
+
+
+def _clave(clave, v=None):
+    return f'catalogo:{v or version()}:{clave}'
+
+
+def obtener(clave, calcular, timeout=None):
+    #timeout None = el TIMEOUT del backend
+    cache = _cache()
+    clave = _clave(clave)
+    valor = cache.get(clave, _NADA)
+    if valor is not _NADA:
+        _contar('aciertos')
+        return valor
+    _contar('fallos')
+    valor = calcular()
+    if timeout is None:
+        cache.set(clave, valor)
+    else:
+        cache.set(clave, valor, timeout)
+    return valor
+
+
+def categorias():
+    #sin el array de móviles: para pintarlas basta con num_moviles
+    return obtener('categorias', lambda: list(Categoria.objects.using('mongodb').defer('moviles')))
+
+
+def categoria(cat_id):
+    return next((c for c in categorias() if c.id == cat_id), None)
+
+
+def moviles():
+    return obtener('moviles', lambda: list(MovilXiaomi.objects.using('mongodb').all()))
+
+
+def movil(movil_id):
+    return obtener(f'movil:{movil_id}', lambda: MovilXiaomi.objects.using('mongodb').filter(id=movil_id).first())
+
+
+def moviles_por_id(ids):
+    #como in_bulk, pero mirando primero en la caché y pidiendo a mongo solo lo que falta
+    cache = _cache()
+    v = version()
+    claves = {_clave(f'movil:{i}', v): i for i in set(ids)}
+    encontrados = cache.get_many(list(claves))
+    _contar('aciertos', len(encontrados))
+    resultado = {claves[k]: m for k, m in encontrados.items() if m is not None}
+
+    faltan = [i for k, i in claves.items() if k not in encontrados]
+    if faltan:
+        _contar('fallos', len(faltan))
+        nuevos = MovilXiaomi.objects.using('mongodb').in_bulk(faltan)
+        cache.set_many({_clave(f'movil:{i}', v): nuevos.get(i) for i in faltan})
+        resultado.update(nuevos)
+    return resultado
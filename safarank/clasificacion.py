@@ -0,0 +1,177 @@
+from functools import partial
+
+from django.conf import settings
+from pymongo import DESCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from . import agregados, cache_catalogo, indice_categorias
+from .agregados import RESUMEN
+from .mongo import coleccion
+
+#clasificación con media bayesiana: cada móvil se "rellena" con PESO votos
+#ficticios de la media global, así un 5 con un solo voto no gana a un 4.8 con
+#500 votos:  puntuacion = (PESO * media_global + suma) / (PESO + votos)
+#
+#La puntuación de cada móvil se guarda en su resumen (campo 'bayes', con
+#índice) y el top-k global y el de cada categoría se guardan ya hechos en
+#'clasificaciones', así leer una clasificación cuesta O(k). Cada voto solo
+#toca las listas en las que está ese móvil. Las listas guardan solo ids; los
+#nombres se ponen al leerlas desde cache_catalogo, así un cambio de nombre se
+#ve enseguida
+
+CLASIFICACIONES = 'clasificaciones'
+GLOBAL = 'global'
+
+
+def _peso():
+    return getattr(settings, 'SAFARANK_BAYES_PESO', 10)
+
+
+def _k():
+    return getattr(settings, 'SAFARANK_TOP_K', 10)
+
+
+def _clasificaciones():
+    return coleccion(CLASIFICACIONES)
+
+
+def clave_categoria(cat_id):
+    return f'cat:{cat_id}'
+
+
+def _prior():
+    doc = _clasificaciones().find_one({'_id': 'prior'})
+    if doc is None:
+        #primera vez (aún no se ha lanzado reconstruir): se calcula y se guarda,
+        #así el $group sobre todos los resúmenes no se repite en cada voto
+        votos, suma = agregados.totales()
+        doc = _clasificaciones().find_one_and_update(
+            {'_id': 'prior'},
+            {'$setOnInsert': {'media': suma / votos if votos else 0, 'peso': _peso()}},
+            upsert=True, return_document=ReturnDocument.AFTER,
+        )
+    return doc['media'], doc['peso']
+
+
+def puntuacion(votos, suma, media, peso):
+    return (peso * media + suma) / (peso + votos)
+
+
+def _entrada(movil_id, votos, suma, bayes):
+    return {'movil_id': movil_id, 'votos': votos,
+            'media': round(suma / votos, 1) if votos else 0, 'puntuacion': bayes}
+
+
+def _ordenar(top):
+    top.sort(key=lambda e: (-e['puntuacion'], e['movil_id']))
+    return top
+
+
+def _calcular_lista(movil_ids=None):
+    #top-k desde cero usando el índice de 'bayes' (global o de unos móviles)
+    filtro = {'votos': {'$gt': 0}, 'bayes': {'$exists': True}}
+    if movil_ids is not None:
+        filtro['_id'] = {'$in': list(movil_ids)}
+    docs = list(coleccion(RESUMEN).find(filtro).sort([('bayes', DESCENDING), ('_id', 1)]).limit(_k()))
+    moviles = cache_catalogo.moviles_por_id([d['_id'] for d in docs])
+    return [
+        _entrada(d['_id'], d['votos'], d['suma'], d['bayes'])
+        for d in docs if d['_id'] in moviles
+    ]
+
+
+def _guardar_lista(clave, top, version):
+    #escritura optimista: si otro proceso la ha cambiado mientras, devuelve False
+    if version is None:
+        try:
+            _clasificaciones().insert_one({'_id': clave, 'top': top, 'version': 0})
+            return True
+        except DuplicateKeyError:
+            return False
+    res = _clasificaciones().update_one(
+        {'_id': clave, 'version': version},
+        {'$set': {'top': top}, '$inc': {'version': 1}},
+    )
+    return res.matched_count == 1
+
+
+def _actualizar_lista(clave, entrada, miembros=None):
+    #miembros: función que devuelve los ids de la lista (None = todos). Solo se
+    #llama si hay que recalcular la lista desde cero, que es lo raro
+    k = _k()
+
+    def calcular():
+        return _calcular_lista(miembros() if miembros else None)
+
+    for _ in range(3):
+        doc = _clasificaciones().find_one({'_id': clave})
+        if doc is None:
+            #lista que aún no existe: se calcula entera una vez
+            if _guardar_lista(clave, calcular(), None):
+                return
+            continue
+        top = [e for e in doc['top'] if e['movil_id'] != entrada['movil_id']]
+        estaba = len(top) < len(doc['top'])
+        top = _ordenar(top + [entrada])
+        if estaba and len(doc['top']) >= k and top[-1] is entrada:
+            #ha bajado al último puesto: puede que alguien de fuera le adelante
+            top = calcular()
+        if _guardar_lista(clave, top[:k], doc['version']):
+            return
+
+
+def actualizar_movil(movil_id, resumen):
+    #llamar después de agregados.registrar_voto con el resumen que devuelve
+    if not resumen:
+        return
+    media, peso = _prior()
+    bayes = puntuacion(resumen['votos'], resumen['suma'], media, peso)
+    coleccion(RESUMEN).update_one({'_id': movil_id}, {'$set': {'bayes': bayes}})
+
+    if cache_catalogo.movil(movil_id) is None:
+        return
+    entrada = _entrada(movil_id, resumen['votos'], resumen['suma'], bayes)
+    _actualizar_lista(GLOBAL, entrada)
+    for cat_id in indice_categorias.categorias_de(movil_id):
+        _actualizar_lista(clave_categoria(cat_id), entrada, partial(indice_categorias.moviles_de, cat_id))
+
+
+def _con_nombres(listas):
+    #pone el nombre actual a cada entrada y quita los móviles que ya no existen
+    moviles = cache_catalogo.moviles_por_id({e['movil_id'] for lista in listas for e in lista})
+    return [
+        [{**e, 'nombre': moviles[e['movil_id']].name} for e in lista if e['movil_id'] in moviles]
+        for lista in listas
+    ]
+
+
+def top(clave=GLOBAL, n=None):
+    doc = _clasificaciones().find_one({'_id': clave}, {'top': 1}) or {}
+    return _con_nombres([doc.get('top', [])])[0][:n]
+
+
+def tops_categorias(cat_ids):
+    docs = list(_clasificaciones().find({'_id': {'$in': [clave_categoria(c) for c in cat_ids]}}, {'top': 1}))
+    return dict(zip((d['_id'] for d in docs), _con_nombres([d.get('top', []) for d in docs])))
+
+
+def reconstruir():
+    #recalcula la media global, la puntuación de todos los móviles y todas
+    #las listas. Conviene lanzarlo de vez en cuando porque la media global
+    #se mueve con los votos y las actualizaciones incrementales no la tocan
+    votos, suma = agregados.totales()
+    media, peso = (suma / votos if votos else 0), _peso()
+    resumenes = coleccion(RESUMEN)
+    resumenes.update_many({'votos': {'$gt': 0}}, [{'$set': {'bayes': {
+        '$divide': [{'$add': [peso * media, '$suma']}, {'$add': [peso, '$votos']}],
+    }}}])
+    resumenes.create_index([('bayes', DESCENDING), ('_id', 1)])
+
+    clasificaciones = _clasificaciones()
+    clasificaciones.delete_many({})
+    clasificaciones.insert_one({'_id': 'prior', 'media': media, 'peso': peso})
+    listas = [(GLOBAL, _calcular_lista())]
+    for cat in cache_catalogo.categorias():
+        listas.append((clave_categoria(cat.id), _calcular_lista(indice_categorias.moviles_de(cat.id))))
+    clasificaciones.insert_many([{'_id': clave, 'top': t, 'version': 0} for clave, t in listas])
+    return len(listas)
@@ -0,0 +1,115 @@
+from collections import defaultdict
+
+from django.conf import settings
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+
+from .models import RankingPersonal
+from .mongo import coleccion
+
+#tier list de la comunidad: por cada móvil, cuántas listas lo tienen en cada
+#tier: {'_id': movil_id, 'S': n, 'A': n, ..., 'total': n, 'media': x, 'tier': 'A'}
+#Cada cambio de un ranking aplica solo la diferencia (un móvil que pasa de B a
+#S es -1 en B y +1 en S) y el mismo update recalcula la media y la tier, así
+#que leer la tier list cuesta lo mismo haya diez rankings o un millón.
+#'unranked' no cuenta: solo las tiers que el usuario ha decidido
+
+CONSENSO = 'consenso_tiers'
+PUNTOS = {'S': 5, 'A': 4, 'B': 3, 'C': 2, 'D': 1}
+TIERS = tuple(PUNTOS)
+#media mínima para caer en cada tier (por debajo de todas, D)
+CORTES = (('S', 4.5), ('A', 3.5), ('B', 2.5), ('C', 1.5))
+
+
+def _consenso():
+    return coleccion(CONSENSO)
+
+
+def _min_listas():
+    return getattr(settings, 'SAFARANK_CONSENSO_MIN_LISTAS', 2)
+
+
+def crear_indice():
+    _consenso().create_index([('tier', ASCENDING), ('media', DESCENDING), ('_id', ASCENDING)])
+
+
+def tiers_de(elementos):
+    #movil_id -> tier (solo S..D) de unos elementos de ranking; las listas antiguas no tienen tiers
+    if not isinstance(elementos, dict):
+        return {}
+    return {m: t for t in TIERS for m in elementos.get(t, [])}
+
+
+def diferencia(antes, despues):
+    #{movil_id: {tier: +-1}} para pasar de unos elementos a otros
+    antes, despues = tiers_de(antes), tiers_de(despues)
+    cambios = defaultdict(dict)
+    for m, t in antes.items():
+        if despues.get(m) != t:
+            cambios[m][t] = -1
+    for m, t in despues.items():
+        if antes.get(m) != t:
+            cambios[m][t] = 1
+    return dict(cambios)
+
+
+def _actualizacion(deltas):
+    #update con pipeline: suma los contadores y recalcula media y tier de una vez
+    total = {'$add': [f'${t}' for t in TIERS]}
+    puntos = {'$add': [{'$multiply': [f'${t}', p]} for t, p in PUNTOS.items()]}
+    media = {'$cond': [{'$gt': ['$total', 0]}, {'$divide': [puntos, '$total']}, 0]}
+    return [
+        {'$set': {t: {'$add': [{'$ifNull': [f'${t}', 0]}, deltas.get(t, 0)]} for t in TIERS}},
+        {'$set': {'total': total}},
+        {'$set': {'media': media}},
+        {'$set': {'tier': {'$switch': {
+            'branches': [{'case': {'$gte': ['$media', corte]}, 'then': t} for t, corte in CORTES],
+            'default': 'D',
+        }}}},
+    ]
+
+
+def aplicar(cambios):
+    if not cambios:
+        return
+    _consenso().bulk_write(
+        [UpdateOne({'_id': m}, _actualizacion(deltas), upsert=True) for m, deltas in cambios.items()],
+        ordered=False,
+    )
+
+
+def registrar(antes, despues):
+    aplicar(diferencia(antes, despues))
+
+
+def tier_list(por_tier=24):
+    #{tier: [{'movil_id', 'media', 'total'}, ...]} con los mejores de cada tier
+    resultado = {}
+    for t in TIERS:
+        docs = _consenso().find(
+            {'tier': t, 'total': {'$gte': _min_listas()}}, {'media': 1, 'total': 1},
+        ).sort([('media', DESCENDING), ('_id', ASCENDING)]).limit(por_tier)
+        resultado[t] = [{'movil_id': d['_id'], 'media': round(d['media'], 2), 'total': d['total']} for d in docs]
+    return resultado
+
+
+def quitar_moviles(movil_ids):
+    _consenso().delete_many({'_id': {'$in': list(movil_ids)}})
+
+
+def reconstruir():
+    #recalcula todos los contadores recorriendo los rankings (una vez, por lotes)
+    coleccion(RankingPersonal).aggregate([
+        {'$match': {'elementos': {'$type': 'object'}}},
+        {'$project': {'par': {'$concatArrays': [
+            {'$map': {'input': {'$ifNull': [f'$elementos.{t}', []]}, 'in': {'m': '$$this', 't': t}}}
+            for t in TIERS
+        ]}}},
+        {'$unwind': '$par'},
+        {'$group': {'_id': '$par.m', **{
+            t: {'$sum': {'$cond': [{'$eq': ['$par.t', t]}, 1, 0]}} for t in TIERS
+        }}},
+        {'$out': CONSENSO},
+    ])
+    _consenso().update_many({}, _actualizacion({}))
+    crear_indice()
+    return _consenso().count_documents({})
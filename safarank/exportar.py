@@ -0,0 +1,146 @@
+import csv
+import io
+import json
+import zlib
+from datetime import date, datetime, time
+
+from bson import ObjectId
+from django.conf import settings
+from django.utils import timezone
+
+from .models import MovilXiaomi, Valoracion, RankingPersonal
+from .mongo import coleccion, columna_pk
+from .tierlist import TIERS
+
+#exportación en streaming: se recorre la colección con un cursor de pymongo
+#(lotes de SAFARANK_EXPORT_LOTE documentos) y se va escribiendo CSV o NDJSON
+#en trozos, opcionalmente comprimidos con gzip sobre la marcha. Nunca hay en
+#memoria más que un lote, así que cuesta lo mismo exportar mil que millones
+
+TABLAS = {
+    'moviles': MovilXiaomi,
+    'valoraciones': Valoracion,
+    'rankings': RankingPersonal,
+}
+FORMATOS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+#campo de fecha por el que se filtra con ?desde= y ?hasta= (None: no tiene)
+CAMPO_FECHA = {MovilXiaomi: None, Valoracion: 'fecha', RankingPersonal: 'fecha_creacion'}
+
+#los trozos que se mandan al cliente se juntan hasta este tamaño
+TAM_TROZO = 64 * 1024
+
+
+def _lote():
+    return getattr(settings, 'SAFARANK_EXPORT_LOTE', 2000)
+
+
+def columnas(modelo):
+    return [f.column for f in modelo._meta.concrete_fields]
+
+
+def _fecha(texto, fin=False):
+    #'2024-05-01' -> inicio (o final, con fin=True) de ese día en la zona horaria actual
+    dia = date.fromisoformat(texto)
+    return timezone.make_aware(datetime.combine(dia, time.max if fin else time.min))
+
+
+def filtro(modelo, desde=None, hasta=None, movil=None):
+    #filtro de mongo para los parámetros de la URL; ValueError si no valen
+    consulta = {}
+    if desde or hasta:
+        campo = CAMPO_FECHA[modelo]
+        if campo is None:
+            raise ValueError("Esta tabla no se puede filtrar por fecha")
+        rango = {}
+        if desde:
+            rango['$gte'] = _fecha(desde)
+        if hasta:
+            rango['$lte'] = _fecha(hasta, fin=True)
+        consulta[campo] = rango
+    if movil:
+        movil = int(movil)
+        if modelo is MovilXiaomi:
+            consulta[columna_pk(MovilXiaomi)] = movil
+        elif modelo is Valoracion:
+            consulta['movil_id'] = movil
+        else:
+            consulta['$or'] = [{f'elementos.{t}': movil} for t in TIERS]
+    return consulta
+
+
+def documentos(modelo, consulta):
+    cols = columnas(modelo)
+    proyeccion = {c: 1 for c in cols}
+    if '_id' not in proyeccion:
+        proyeccion['_id'] = 0
+    return coleccion(modelo).find(consulta, proyeccion, batch_size=_lote())
+
+
+def _valor(v):
+    if isinstance(v, ObjectId):
+        return str(v)
+    if isinstance(v, datetime):
+        return v.isoformat()
+    raise TypeError(f"{type(v).__name__} no se puede exportar")
+
+
+def _celda(v):
+    if isinstance(v, (dict, list)):
+        return json.dumps(v, default=_valor)
+    if isinstance(v, (ObjectId, datetime)):
+        return _valor(v)
+    return v
+
+
+def lineas_csv(modelo, docs):
+    cols = columnas(modelo)
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    escritor.writerow(cols)
+    for doc in docs:
+        escritor.writerow([_celda(doc.get(c)) for c in cols])
+        if buffer.tell() >= TAM_TROZO:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def lineas_ndjson(modelo, docs):
+    cols = columnas(modelo)
+    trozo, tam = [], 0
+    for doc in docs:
+        linea = json.dumps({c: doc.get(c) for c in cols}, default=_valor, ensure_ascii=False) + '\n'
+        trozo.append(linea)
+        tam += len(linea)
+        if tam >= TAM_TROZO:
+            yield ''.join(trozo)
+            trozo, tam = [], 0
+    yield ''.join(trozo)
+
+
+def gzip_al_vuelo(trozos):
+    #wbits=31: formato gzip (cabecera y crc), no zlib a secas
+    compresor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for trozo in trozos:
+        datos = compresor.compress(trozo.encode('utf-8'))
+        if datos:
+            yield datos
+    yield compresor.flush()
+
+
+def exportar(tabla, formato, comprimir=False, desde=None, hasta=None, movil=None):
+    #devuelve (iterador de bytes, content_type, nombre de fichero)
+    if tabla not in TABLAS or formato not in FORMATOS:
+        raise ValueError("Tabla o formato no válido")
+    modelo = TABLAS[tabla]
+    docs = documentos(modelo, filtro(modelo, desde, hasta, movil))
+    lineas = (lineas_csv if formato == 'csv' else lineas_ndjson)(modelo, docs)
+    nombre = f'{tabla}.{formato}'
+    if comprimir:
+        return gzip_al_vuelo(lineas), 'application/gzip', f'{nombre}.gz'
+    return (l.encode('utf-8') for l in lineas), FORMATOS[formato], nombre
@@ -0,0 +1,216 @@
+import random
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate, islice
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import connections
+
+from . import (actividad, agregados, cache_catalogo, clasificacion, consenso, ids, indice_categorias, indices,
+               migracion_rankings, recomendaciones, tierlist)
+from .models import MovilXiaomi, Categoria, Valoracion, RankingPersonal
+from .mongo import ALIAS, coleccion, columna_pk, documento
+
+#datos sintéticos para pruebas de carga. Borra lo que haya en las colecciones,
+#así que solo se debe usar contra una base de datos de pruebas.
+#La popularidad de los móviles y la actividad de los usuarios siguen una Zipf
+#(unos pocos concentran casi todo) y las valoraciones y rankings se generan
+#por bloques en un pool de hilos. Cada bloque tiene su propia semilla, así que
+#con la misma semilla sale lo mismo sea cual sea el número de hilos
+
+LOTE = 10000
+PASSWORD = 'bench1234'
+EMAIL_ADMIN = 'admin@bench.local'
+ESCALA_DEFECTO = {'usuarios': 1000, 'moviles': 5000, 'categorias': 8, 'valoraciones': 100000, 'rankings': 5000}
+#el benchmark solo se lanza contra una base de datos de mongo cuyo nombre acabe así
+SUFIJO_BENCH = '_bench'
+#las fechas se cuentan hacia atrás desde aquí y no desde ahora, así la misma
+#semilla da exactamente los mismos datos cualquier día
+EPOCA = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+#exponente de la Zipf de popularidad de móviles; la de usuarios es más suave
+ZIPF_MOVILES = 1.1
+ZIPF_USUARIOS = 0.8
+USUARIOS_POR_BLOQUE = 1000
+RANKINGS_POR_BLOQUE = 5000
+HILOS = 4
+
+#nadie valora más de esta fracción del catálogo
+MAX_FRACCION_VALORADA = 0.1
+PESOS_PUNTUACION = [5, 7, 15, 33, 40]
+PESOS_TIER = [1, 3, 4, 3, 1, 2]
+
+
+def base_de_datos():
+    #nombre de la base de datos de mongo contra la que se va a trabajar
+    return connections[ALIAS].settings_dict['NAME']
+
+
+def email_usuario(i):
+    return f'bench{i}@bench.local'
+
+
+def _rnd(semilla, tabla, bloque=0):
+    return random.Random(f'{semilla}:{tabla}:{bloque}')
+
+
+class Zipf:
+    #elige elementos de la población con peso 1/rango^s; la población se
+    #baraja antes para que los populares no sean siempre los ids más bajos
+    def __init__(self, poblacion, s, rnd):
+        self.poblacion = list(poblacion)
+        rnd.shuffle(self.poblacion)
+        self.acumulados = list(accumulate(1 / k ** s for k in range(1, len(self.poblacion) + 1)))
+
+    def elegir(self, rnd, k):
+        return rnd.choices(self.poblacion, cum_weights=self.acumulados, k=k)
+
+    def distintos(self, rnd, k):
+        #k elementos sin repetir, en el orden en que salen
+        k = min(k, len(self.poblacion))
+        elegidos = {}
+        while len(elegidos) < k:
+            for x in self.elegir(rnd, k - len(elegidos)):
+                elegidos.setdefault(x)
+        return list(elegidos)[:k]
+
+
+def _reparto(total, zipf, tope):
+    #cuántas valoraciones hace cada usuario: proporcional a su peso Zipf,
+    #sin pasar del tope, y lo que sobra se reparte empezando por los más activos
+    peso_total = zipf.acumulados[-1]
+    anterior, cuentas = 0, []
+    for acumulado in zipf.acumulados:
+        cuentas.append(min(tope, int(total * acumulado / peso_total) - int(total * anterior / peso_total)))
+        anterior = acumulado
+    resto = total - sum(cuentas)
+    while resto > 0 and any(c < tope for c in cuentas):
+        for i, c in enumerate(cuentas):
+            if resto == 0:
+                break
+            if c < tope:
+                cuentas[i] += 1
+                resto -= 1
+    return cuentas
+
+
+def _insertar(destino, docs):
+    total = 0
+    for lote in iter(lambda: list(islice(docs, LOTE)), []):
+        destino.insert_many(lote, ordered=False)
+        total += len(lote)
+    return total
+
+
+def _usuarios(n):
+    Usuario = get_user_model()
+    Usuario.objects.filter(email__endswith='@bench.local').delete()
+    password = make_password(PASSWORD)
+    usuarios = (Usuario(email=email_usuario(i), nombre=f'Bench {i}', rol='cliente', password=password)
+                for i in range(1, n + 1))
+    for lote in iter(lambda: list(islice(usuarios, LOTE)), []):
+        Usuario.objects.bulk_create(lote)
+    Usuario.objects.create(email=EMAIL_ADMIN, nombre='Bench Admin', rol='admin', password=password)
+
+
+def _moviles(n, rnd):
+    for i in range(1, n + 1):
+        movil = MovilXiaomi(
+            id=i, name=f'Xiaomi Bench {i}', imgURL='',
+            price=rnd.randint(90, 1200), ratings=round(rnd.uniform(3, 5), 1),
+            ram=rnd.choice([4, 6, 8, 12, 16]), storage=rnd.choice([64, 128, 256, 512]),
+            camera=rnd.choice([12, 48, 50, 64, 108, 200]), battery=rnd.randint(3000, 6000),
+        )
+        yield documento(movil)
+
+
+def _categorias(n, num_moviles, rnd):
+    for i in range(1, n + 1):
+        moviles = rnd.sample(range(1, num_moviles + 1), min(num_moviles, max(1, num_moviles // n)))
+        yield {columna_pk(Categoria): i, 'name': f'Categoría {i}', 'description': '', 'code': 'CAT',
+               'moviles': moviles, 'num_moviles': len(moviles)}
+
+
+def _valoraciones(usuarios, cuentas, populares, rnd):
+    for usuario, cuenta in zip(usuarios, cuentas):
+        for movil_id in populares.distintos(rnd, cuenta):
+            yield {
+                'user_email': email_usuario(usuario),
+                'movil_id': movil_id,
+                #más valoraciones recientes que antiguas
+                'fecha': EPOCA - timedelta(days=365 * rnd.random() ** 2),
+                'puntuacion': rnd.choices(range(1, 6), weights=PESOS_PUNTUACION)[0],
+                'comentario': 'Generado para pruebas de carga',
+            }
+
+
+def _rankings(desde, hasta, num_usuarios, populares, rnd):
+    for i in range(desde, hasta):
+        elementos = tierlist.tiers_vacias()
+        for movil_id in populares.distintos(rnd, rnd.randint(5, 30)):
+            elementos[rnd.choices(tierlist.TIERS, weights=PESOS_TIER)[0]].append(movil_id)
+        #reparto circular: los primeros usuarios siempre tienen ranking (el benchmark lo usa)
+        yield {columna_pk(RankingPersonal): i, 'user_email': email_usuario((i - 1) % num_usuarios + 1),
+               'nombre': f'Ranking {i}', 'elementos': elementos,
+               'fecha_creacion': EPOCA - timedelta(days=365 * rnd.random())}
+
+
+def generar(escala=None, semilla=0, salida=None, hilos=HILOS, zipf=ZIPF_MOVILES):
+    #escala: dict con usuarios, moviles, categorias, valoraciones y rankings.
+    #Devuelve cuántas filas se han creado de cada tipo
+    escala = {**ESCALA_DEFECTO, **(escala or {})}
+    avisar = salida or (lambda texto: None)
+    creados = dict(escala)
+
+    avisar(f"Usuarios: {escala['usuarios']}")
+    _usuarios(escala['usuarios'])
+    for modelo in (MovilXiaomi, Categoria, Valoracion, RankingPersonal):
+        coleccion(modelo).delete_many({})
+    #los rankings nuevos ya van en el formato de tiers, pero la migración
+    #tiene que volver a revisarlos desde el principio si se lanza
+    coleccion(migracion_rankings.MIGRACIONES).delete_many({})
+
+    avisar(f"Móviles: {escala['moviles']}")
+    _insertar(coleccion(MovilXiaomi), _moviles(escala['moviles'], _rnd(semilla, 'moviles')))
+    avisar(f"Categorías: {escala['categorias']}")
+    _insertar(coleccion(Categoria), _categorias(escala['categorias'], escala['moviles'], _rnd(semilla, 'categorias')))
+
+    populares = Zipf(range(1, escala['moviles'] + 1), zipf, _rnd(semilla, 'popularidad'))
+    activos = Zipf(range(1, escala['usuarios'] + 1), ZIPF_USUARIOS, _rnd(semilla, 'actividad'))
+    cuentas = _reparto(escala['valoraciones'], activos,
+                       max(1, int(escala['moviles'] * MAX_FRACCION_VALORADA)))
+
+    #las colecciones se sacan aquí: los hilos no deben abrir conexiones propias de django
+    destino_valoraciones, destino_rankings = coleccion(Valoracion), coleccion(RankingPersonal)
+    tareas = []
+    for bloque, inicio in enumerate(range(0, escala['usuarios'], USUARIOS_POR_BLOQUE)):
+        fin = inicio + USUARIOS_POR_BLOQUE
+        tareas.append(('valoraciones', destino_valoraciones, _valoraciones(
+            activos.poblacion[inicio:fin], cuentas[inicio:fin], populares,
+            _rnd(semilla, 'valoraciones', bloque))))
+    for bloque, inicio in enumerate(range(1, escala['rankings'] + 1, RANKINGS_POR_BLOQUE)):
+        fin = min(inicio + RANKINGS_POR_BLOQUE, escala['rankings'] + 1)
+        tareas.append(('rankings', destino_rankings, _rankings(
+            inicio, fin, escala['usuarios'], populares, _rnd(semilla, 'rankings', bloque))))
+
+    avisar(f"Valoraciones y rankings ({len(tareas)} bloques, {hilos} hilos)")
+    creados['valoraciones'] = creados['rankings'] = 0
+    with ThreadPoolExecutor(hilos) as pool:
+        futuros = [(tabla, pool.submit(_insertar, destino, docs)) for tabla, destino, docs in tareas]
+        for tabla, futuro in futuros:
+            creados[tabla] += futuro.result()
+
+    avisar("Recalculando resúmenes, índices y clasificaciones")
+    for modelo, ultimo in ((MovilXiaomi, escala['moviles']), (Categoria, escala['categorias']),
+                           (RankingPersonal, escala['rankings'])):
+        coleccion(ids.CONTADORES).update_one({'_id': modelo._meta.db_table}, {'$max': {'valor': ultimo}}, upsert=True)
+    cache_catalogo.invalidar()
+    agregados.reconstruir()
+    actividad.reconstruir()
+    indice_categorias.reconstruir()
+    indices.crear()
+    clasificacion.reconstruir()
+    consenso.reconstruir()
+    recomendaciones.reconstruir(procesos=hilos)
+    return creados
@@ -0,0 +1,110 @@
+from django.db import connections
+from pymongo import DeleteMany, UpdateMany
+
+from . import actividad, cache_catalogo, consenso, indice_categorias, recomendaciones
+from .agregados import RESUMEN
+from .clasificacion import CLASIFICACIONES
+from .models import MovilXiaomi, Categoria, Valoracion, RankingPersonal
+from .mongo import ALIAS, coleccion, columna_pk
+from .tierlist import TIERS
+
+#operaciones masivas del admin sobre el catálogo. Cada una va en un solo
+#bulk_write, y borrar móviles limpia en cascada todo lo que los nombra
+#(categorías, índice inverso, rankings, valoraciones, resúmenes,
+#clasificaciones, consenso y recomendaciones) con updates multi-documento,
+#así las páginas no tienen que filtrar ids de móviles que ya no existen
+
+#campos que se pueden cambiar a la vez en varios móviles
+CAMPOS_EDITABLES = ('price', 'ram', 'storage', 'battery', 'camera', 'android_version')
+
+
+def _valor(campo, valor):
+    #el mismo valor que guardaría el ORM (price es IntegerField: 199.99 se guarda 199)
+    field = MovilXiaomi._meta.get_field(campo)
+    return field.get_db_prep_save(field.get_prep_value(float(valor)), connections[ALIAS])
+
+
+def editar_moviles(movil_ids, cambios):
+    #pone los mismos valores a todos los móviles seleccionados; devuelve cuántos han cambiado
+    valores = {c: _valor(c, v) for c, v in cambios.items() if c in CAMPOS_EDITABLES and v not in (None, '')}
+    if not movil_ids or not valores:
+        return 0
+    res = coleccion(MovilXiaomi).bulk_write([
+        UpdateMany({columna_pk(MovilXiaomi): {'$in': list(movil_ids)}}, {'$set': valores}),
+    ])
+    cache_catalogo.invalidar()
+    return res.modified_count
+
+
+def _quitar_de_categorias(movil_ids):
+    #saca los móviles del array y recalcula num_moviles en el mismo update
+    coleccion(Categoria).update_many({'moviles': {'$in': movil_ids}}, [{'$set': {'moviles': {'$filter': {
+        'input': '$moviles', 'cond': {'$not': [{'$in': ['$$this', movil_ids]}]},
+    }}}}, {'$set': {'num_moviles': {'$size': {'$setUnion': ['$moviles', []]}}}}])
+    coleccion(indice_categorias.INDICE).delete_many({'_id': {'$in': movil_ids}})
+
+
+def _quitar_de_rankings(movil_ids):
+    coleccion(RankingPersonal).update_many(
+        {'$or': [{f'elementos.{t}': {'$in': movil_ids}} for t in TIERS]},
+        {'$pull': {f'elementos.{t}': {'$in': movil_ids} for t in TIERS}},
+    )
+    consenso.quitar_moviles(movil_ids)
+
+
+def _quitar_valoraciones(movil_ids):
+    valoraciones = coleccion(Valoracion)
+    por_usuario = valoraciones.aggregate([
+        {'$match': {'movil_id': {'$in': movil_ids}}},
+        {'$group': {'_id': '$user_email', 'n': {'$sum': 1}}},
+    ])
+    for fila in por_usuario:
+        actividad.registrar_valoracion(fila['_id'], -fila['n'])
+    valoraciones.delete_many({'movil_id': {'$in': movil_ids}})
+    coleccion(RESUMEN).delete_many({'_id': {'$in': movil_ids}})
+    coleccion(CLASIFICACIONES).update_many(
+        {'top.movil_id': {'$in': movil_ids}}, {'$pull': {'top': {'movil_id': {'$in': movil_ids}}}},
+    )
+
+
+def _quitar_de_recomendaciones(movil_ids):
+    vecinos = coleccion(recomendaciones.RECOMENDACIONES)
+    vecinos.delete_many({'_id': {'$in': movil_ids}})
+    vecinos.update_many(
+        {'vecinos.movil_id': {'$in': movil_ids}}, {'$pull': {'vecinos': {'movil_id': {'$in': movil_ids}}}},
+    )
+
+
+def limpiar_referencias(movil_ids):
+    #borra todo lo que apunta a estos móviles (que ya no deberían existir)
+    movil_ids = list(movil_ids)
+    if not movil_ids:
+        return
+    _quitar_de_categorias(movil_ids)
+    _quitar_de_rankings(movil_ids)
+    _quitar_valoraciones(movil_ids)
+    _quitar_de_recomendaciones(movil_ids)
+    cache_catalogo.invalidar()
+
+
+def borrar_moviles(movil_ids):
+    #devuelve cuántos móviles se han borrado
+    movil_ids = [int(m) for m in movil_ids]
+    if not movil_ids:
+        return 0
+    res = coleccion(MovilXiaomi).bulk_write([
+        DeleteMany({columna_pk(MovilXiaomi): {'$in': movil_ids}}),
+    ])
+    limpiar_referencias(movil_ids)
+    return res.deleted_count
+
+
+def huerfanos():
+    #ids de móviles que aparecen en categorías, rankings o valoraciones pero ya no existen
+    pk = columna_pk(MovilXiaomi)
+    referenciados = set(coleccion(Valoracion).distinct('movil_id'))
+    referenciados.update(coleccion(Categoria).distinct('moviles'))
+    for t in TIERS:
+        referenciados.update(coleccion(RankingPersonal).distinct(f'elementos.{t}'))
+    existentes = set(coleccion(MovilXiaomi).distinct(pk, {pk: {'$in': list(referenciados)}}))
+    return sorted(referenciados - existentes)
@@ -0,0 +1,51 @@
+import threading
+
+from pymongo import DESCENDING, ReturnDocument
+
+from .mongo import coleccion, columna_pk
+
+#reparto de ids para los modelos de mongo con id numérico. Hay un contador
+#por colección en 'contadores' que se sube con $inc (atómico), y cada proceso
+#se reserva un bloque de ids de golpe, así casi nunca hace falta ir a la base
+#de datos. Puede haber huecos entre bloques, pero nunca ids repetidos
+
+CONTADORES = 'contadores'
+TAM_BLOQUE = 20
+
+_lock = threading.Lock()
+_bloques = {}
+_sembrados = set()
+
+
+def _sembrar(modelo):
+    #el contador tiene que arrancar por encima del id más alto que ya exista
+    pk = columna_pk(modelo)
+    ultimo = coleccion(modelo).find_one({pk: {'$type': 'number'}}, {pk: 1}, sort=[(pk, DESCENDING)])
+    maximo = int(ultimo[pk]) if ultimo else 0
+    coleccion(CONTADORES).update_one({'_id': modelo._meta.db_table}, {'$max': {'valor': maximo}}, upsert=True)
+
+
+def reservar(modelo, cantidad):
+    #reserva `cantidad` ids seguidos y devuelve (primero, último)
+    nombre = modelo._meta.db_table
+    if nombre not in _sembrados:
+        _sembrar(modelo)
+        _sembrados.add(nombre)
+    doc = coleccion(CONTADORES).find_one_and_update(
+        {'_id': nombre},
+        {'$inc': {'valor': cantidad}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return doc['valor'] - cantidad + 1, doc['valor']
+
+
+def siguiente_id(modelo):
+    nombre = modelo._meta.db_table
+    with _lock:
+        bloque = _bloques.get(nombre)
+        if bloque is None or bloque[0] > bloque[1]:
+            bloque = _bloques[nombre] = list(reservar(modelo, TAM_BLOQUE))
+        nuevo = bloque[0]
+        bloque[0] += 1
+    return nuevo
@@ -0,0 +1,126 @@
+import csv
+import io
+from itertools import islice
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from . import gestion_catalogo, ids, miniaturas
+from .models import MovilXiaomi
+from .mongo import coleccion, columna_pk, documento
+
+#importador de móviles desde CSV: lee el fichero en streaming, valida por
+#lotes y escribe cada lote con un solo bulk_write. Un móvil se reconoce por
+#su nombre: si ya estaba conserva su id (y con él sus valoraciones, rankings
+#y categorías) y solo se le actualizan los datos. Con reemplazar=True los
+#que ya no vienen en el CSV se borran en cascada, y solo si se ha leído entero
+
+# --- TASA DE CONVERSIÓN REAL (Rupias Indias a Euros) ---
+TASA_INR_EUR = 0.0111
+
+TAM_LOTE = 1000
+
+#cuántos rechazos se guardan con detalle (el total se cuenta siempre)
+MAX_RECHAZOS = 200
+
+
+def abrir_texto(fichero_binario):
+    #decodifica mientras se lee, sin cargar el fichero entero en memoria
+    return io.TextIOWrapper(fichero_binario, encoding='utf-8-sig', newline='')
+
+
+def _movil_desde_fila(row):
+    movil = MovilXiaomi()
+    movil.name = row.get('name', row.get('Name'))
+    movil.imgURL = row.get('imgURL', row.get('Image'))
+    if not movil.name:
+        raise ValueError("falta el nombre")
+
+    # CONVERSIÓN DE MONEDA: Multiplicamos por la tasa oficial
+    for campo, conversion in (('price', float), ('ratings', float), ('ram', int),
+                              ('storage', int), ('camera', int), ('battery', int)):
+        valor = row.get(campo) or 0
+        try:
+            valor = conversion(valor)
+        except ValueError:
+            raise ValueError(f"valor no válido en '{campo}': {valor!r}")
+        setattr(movil, campo, valor)
+    movil.price = round(movil.price * TASA_INR_EUR, 2)
+    return movil
+
+
+def _ids_por_nombre(destino, nombres):
+    #id de cada nombre que ya está en el catálogo; si hay repetidos gana el más antiguo
+    pk = columna_pk(MovilXiaomi)
+    existentes = {}
+    for doc in destino.find({'name': {'$in': list(nombres)}}, {pk: 1, 'name': 1}).sort(pk, 1):
+        existentes.setdefault(doc['name'], doc[pk])
+    return existentes
+
+
+def importar_csv(texto, tam_lote=TAM_LOTE, reemplazar=False):
+    #texto: cualquier iterable de líneas (fichero abierto en modo texto)
+    #un fichero que no se puede leer (codificación, CSV roto) lanza ValueError sin borrar nada
+    #devuelve {'cargados': n, 'rechazados': n, 'rechazos': [(linea, motivo), ...], 'borrados': n}
+    destino = coleccion(MovilXiaomi)
+    resultado = {'cargados': 0, 'rechazados': 0, 'rechazos': [], 'borrados': 0}
+
+    def rechazar(linea, motivo):
+        resultado['rechazados'] += 1
+        if len(resultado['rechazos']) < MAX_RECHAZOS:
+            resultado['rechazos'].append((linea, motivo))
+
+    pk = columna_pk(MovilXiaomi)
+    anteriores = set(destino.distinct(pk))
+    vistos = set()
+
+    #la línea 1 es la cabecera
+    filas = enumerate(csv.DictReader(texto), start=2)
+    while True:
+        try:
+            lote = list(islice(filas, tam_lote))
+        except (UnicodeDecodeError, csv.Error) as e:
+            raise ValueError(f"el fichero no se puede leer como CSV UTF-8: {e}") from e
+        if not lote:
+            break
+        validos, lineas = [], []
+        for linea, row in lote:
+            try:
+                validos.append(_movil_desde_fila(row))
+            except ValueError as e:
+                rechazar(linea, str(e))
+                continue
+            lineas.append(linea)
+
+        if not validos:
+            continue
+        ids_lote = _ids_por_nombre(destino, {m.name for m in validos})
+        nuevos = list(dict.fromkeys(m.name for m in validos if m.name not in ids_lote))
+        if nuevos:
+            #un bloque de ids solo para los móviles que no estaban; los ids siguen
+            #creciendo aunque se borre alguno, así un ranking viejo nunca apunta a otro móvil
+            primero, _ = ids.reservar(MovilXiaomi, len(nuevos))
+            ids_lote.update((nombre, primero + i) for i, nombre in enumerate(nuevos))
+        #las imágenes que ya se habían procesado en otra carga conservan sus miniaturas
+        conocidas = miniaturas.hashes_conocidos({m.imgURL for m in validos if m.imgURL})
+        operaciones = []
+        for movil in validos:
+            movil.id = ids_lote[movil.name]
+            movil.imagen = conocidas.get(movil.imgURL)
+            doc = documento(movil)
+            del doc[pk]
+            operaciones.append(UpdateOne({pk: movil.id}, {'$set': doc}, upsert=True))
+            vistos.add(movil.id)
+        try:
+            destino.bulk_write(operaciones, ordered=False)
+            resultado['cargados'] += len(operaciones)
+        except BulkWriteError as e:
+            errores = e.details.get('writeErrors', [])
+            for err in errores:
+                rechazar(lineas[err['index']], err.get('errmsg', 'error de escritura'))
+            resultado['cargados'] += len(operaciones) - len(errores)
+
+    if reemplazar:
+        #solo desaparece lo que ya no está en el CSV
+        resultado['borrados'] = gestion_catalogo.borrar_moviles(anteriores - vistos)
+    return resultado
@@ -0,0 +1,67 @@
+from pymongo import ASCENDING, UpdateOne
+
+from .models import Categoria
+from .mongo import coleccion, columna_pk
+
+#índice inverso móvil -> categorías: {'_id': movil_id, 'categorias': [cat_id, ...]}
+#con índice multikey en 'categorias', así "móviles de la categoría X" y
+#"categorías del móvil Y" son consultas indexadas en vez de recorrer los
+#arrays de todas las categorías. Además cada categoría guarda num_moviles
+
+INDICE = 'movil_categorias'
+
+
+def _indice():
+    return coleccion(INDICE)
+
+
+def crear_indice():
+    _indice().create_index([('categorias', ASCENDING), ('_id', ASCENDING)])
+
+
+def num_moviles(moviles):
+    return len(set(moviles))
+
+
+def actualizar_categoria(cat_id, anteriores, nuevos):
+    #aplica al índice solo la diferencia entre la lista vieja y la nueva
+    anteriores, nuevos = set(anteriores), set(nuevos)
+    ops = [UpdateOne({'_id': m}, {'$addToSet': {'categorias': cat_id}}, upsert=True) for m in nuevos - anteriores]
+    ops += [UpdateOne({'_id': m}, {'$pull': {'categorias': cat_id}}) for m in anteriores - nuevos]
+    if ops:
+        _indice().bulk_write(ops, ordered=False)
+
+
+def quitar_categoria(cat_id):
+    _indice().update_many({'categorias': cat_id}, {'$pull': {'categorias': cat_id}})
+
+
+def categorias_de(movil_id):
+    doc = _indice().find_one({'_id': movil_id}, {'categorias': 1})
+    return doc.get('categorias', []) if doc else []
+
+
+def moviles_de(cat_id, despues=None, limite=None):
+    #ids de la categoría en orden, opcionalmente a partir de un cursor
+    filtro = {'categorias': cat_id}
+    if despues is not None:
+        filtro['_id'] = {'$gt': despues}
+    cursor = _indice().find(filtro, {'_id': 1}).sort('_id', ASCENDING)
+    if limite:
+        cursor = cursor.limit(limite)
+    return [d['_id'] for d in cursor]
+
+
+def reconstruir():
+    pk = columna_pk(Categoria)
+    categorias = coleccion(Categoria)
+    categorias.aggregate([
+        {'$unwind': '$moviles'},
+        {'$group': {'_id': '$moviles', 'categorias': {'$addToSet': f'${pk}'}}},
+        {'$out': INDICE},
+    ])
+    categorias.update_many({}, [{'$set': {
+        'num_moviles': {'$size': {'$setUnion': [{'$ifNull': ['$moviles', []]}, []]}},
+    }}])
+    crear_indice()
+    return _indice().count_documents({})
@@ -0,0 +1,76 @@
+from pymongo import ASCENDING, DESCENDING
+
+from . import consenso, indice_categorias
+from .models import MovilXiaomi, Valoracion
+from .mongo import coleccion, columna_pk
+
+#índices que necesitan las consultas del catálogo y de las opiniones. Siguen
+#la regla igualdad -> orden -> rango, y todos acaban en el id para el cursor
+
+#opiniones de un móvil por fecha (resenas.py) y la del usuario en detalle_movil
+INDICES_VALORACIONES = [
+    [('movil_id', ASCENDING), ('fecha', DESCENDING), ('_id', DESCENDING)],
+    [('user_email', ASCENDING), ('movil_id', ASCENDING), ('fecha', DESCENDING)],
+]
+
+
+def indices_moviles():
+    pk = columna_pk(MovilXiaomi)
+    indices = [
+        [('price', ASCENDING), (pk, ASCENDING)],
+        [('ratings', DESCENDING), (pk, DESCENDING)],
+        [('battery', DESCENDING), (pk, DESCENDING)],
+        [('name', ASCENDING), (pk, ASCENDING)],
+        [('ram', ASCENDING), ('storage', ASCENDING), ('price', ASCENDING), (pk, ASCENDING)],
+        [('camera', ASCENDING), (pk, ASCENDING)],
+    ]
+    if pk != '_id':
+        indices.insert(0, [(pk, ASCENDING)])
+    return indices
+
+
+def crear():
+    #devuelve los nombres de los índices creados (o que ya existían)
+    moviles = coleccion(MovilXiaomi)
+    pk = columna_pk(MovilXiaomi)
+    nombres = []
+    for claves in indices_moviles():
+        unico = claves == [(pk, ASCENDING)]
+        nombres.append(moviles.create_index(claves, unique=unico))
+    for claves in INDICES_VALORACIONES:
+        nombres.append(coleccion(Valoracion).create_index(claves))
+    indice_categorias.crear_indice()
+    consenso.crear_indice()
+    return nombres
+
+
+def consultas_de_prueba():
+    #(descripción, modelo, filtro, orden) con la misma forma que las que generan busqueda.py y resenas.py
+    pk = columna_pk(MovilXiaomi)
+    return [
+        ('catálogo por id', MovilXiaomi, {pk: {'$gt': 0}}, [(pk, ASCENDING)]),
+        ('precio máximo, más barato primero', MovilXiaomi, {'price': {'$lte': 300}}, [('price', ASCENDING), (pk, ASCENDING)]),
+        ('mejor nota', MovilXiaomi, {'ratings': {'$gte': 4}}, [('ratings', DESCENDING), (pk, DESCENDING)]),
+        ('más batería', MovilXiaomi, {}, [('battery', DESCENDING), (pk, DESCENDING)]),
+        ('ram + almacenaje + precio', MovilXiaomi,
+         {'ram': {'$in': [8, 12]}, 'storage': {'$in': [256]}, 'price': {'$lte': 500}}, [(pk, ASCENDING)]),
+        ('cámara mínima', MovilXiaomi, {'camera': {'$gte': 50}}, [(pk, ASCENDING)]),
+        ('opiniones de un móvil', Valoracion, {'movil_id': 1}, [('fecha', DESCENDING), ('_id', DESCENDING)]),
+        ('mi opinión de un móvil', Valoracion, {'user_email': 'a@b.c', 'movil_id': 1}, [('fecha', DESCENDING)]),
+    ]
+
+
+def _etapas(plan):
+    yield plan.get('stage')
+    for hijo in plan.get('inputStages', []) + ([plan['inputStage']] if 'inputStage' in plan else []):
+        yield from _etapas(hijo)
+
+
+def verificar():
+    #explica cada consulta de prueba y dice si usa índice o recorre la colección
+    resultado = []
+    for descripcion, modelo, filtro, orden in consultas_de_prueba():
+        plan = coleccion(modelo).find(filtro).sort(orden).limit(25).explain()['queryPlanner']['winningPlan']
+        etapas = set(_etapas(plan.get('queryPlan', plan)))
+        resultado.append((descripcion, 'COLLSCAN' not in etapas, sorted(e for e in etapas if e)))
+    return resultado
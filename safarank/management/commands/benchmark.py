@@ -0,0 +1,62 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from safarank import benchmark, generador
+
+
+class Command(BaseCommand):
+    help = ('Mide throughput, latencia (p50/p95/p99) y pico de memoria de los flujos principales '
+            'con clientes concurrentes y guarda el resultado en JSON para comparar entre versiones. '
+            'Con --sembrar borra y regenera los datos sintéticos antes de medir. Solo se lanza contra una '
+            f'base de datos de mongo dedicada, cuyo nombre acabe en "{generador.SUFIJO_BENCH}".')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sembrar', action='store_true', help='Regenera los datos antes de medir (BORRA las colecciones)')
+        for nombre, valor in generador.ESCALA_DEFECTO.items():
+            parser.add_argument(f'--{nombre}', type=int, default=valor)
+        parser.add_argument('--semilla', type=int, default=0)
+        parser.add_argument('--peticiones', type=int, default=200, help='Peticiones por endpoint')
+        parser.add_argument('--concurrencia', type=int, default=8)
+        parser.add_argument('--filas-csv', type=int, default=1000, help='Filas del CSV que se sube a cargar_datos')
+        parser.add_argument('--endpoints', nargs='+', choices=benchmark.ENDPOINTS, default=list(benchmark.ENDPOINTS))
+        parser.add_argument('--salida', help='Fichero JSON de resultados (por defecto se imprime)')
+        parser.add_argument('--noinput', '--no-input', action='store_false', dest='interactive',
+                            help='No pedir confirmación antes de sembrar')
+
+    def handle(self, *args, **options):
+        #el benchmark vota, mueve rankings y sube un CSV, y --sembrar borra las
+        #colecciones: nunca contra la base de datos de verdad, pregunte o no
+        nombre = generador.base_de_datos()
+        if not nombre.endswith(generador.SUFIJO_BENCH):
+            raise CommandError(
+                f"La base de datos de mongo es '{nombre}' y el benchmark escribe en ella. Lánzalo contra una "
+                f"dedicada cuyo nombre acabe en '{generador.SUFIJO_BENCH}', p.ej. SAFARANK_MONGO_DB=safarank_bench."
+            )
+
+        escala = None
+        if options['sembrar']:
+            if options['interactive']:
+                respuesta = input(f"Se van a borrar los móviles, categorías, valoraciones y rankings de la base de "
+                                  f"datos '{nombre}'. Escribe 'si' para continuar: ")
+                if respuesta.strip().lower() != 'si':
+                    raise CommandError('Cancelado.')
+            escala = generador.generar({nombre: options[nombre] for nombre in generador.ESCALA_DEFECTO},
+                                       options['semilla'], self.stdout.write)
+
+        try:
+            resultado = benchmark.ejecutar(
+                options['peticiones'], options['concurrencia'], options['endpoints'],
+                options['filas_csv'], options['semilla'], self.stdout.write,
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        resultado['escala'] = escala
+
+        texto = json.dumps(resultado, indent=2, sort_keys=True)
+        if options['salida']:
+            with open(options['salida'], 'w') as f:
+                f.write(texto + '\n')
+            self.stdout.write(self.style.SUCCESS(f"Resultados guardados en {options['salida']}"))
+        else:
+            self.stdout.write(texto)
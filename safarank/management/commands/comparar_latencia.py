@@ -0,0 +1,92 @@
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, Client, override_settings
+from django.urls import reverse
+
+from safarank.models import MovilXiaomi, RankingPersonal
+from safarank.mongo import cerrar_async
+
+
+def _percentil(muestras, p):
+    ordenadas = sorted(muestras)
+    return ordenadas[min(len(ordenadas) - 1, int(len(ordenadas) * p / 100))]
+
+
+class Command(BaseCommand):
+    help = ('Compara la latencia (p50/p99) de detalle_movil y ver_ranking entre las vistas '
+            'sync por WSGI y las async por ASGI.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('email', help='Usuario con el que se hacen las peticiones')
+        parser.add_argument('--peticiones', type=int, default=200)
+        parser.add_argument('--concurrencia', type=int, default=10)
+
+    def handle(self, *args, **options):
+        try:
+            usuario = get_user_model().objects.get(email=options['email'])
+        except get_user_model().DoesNotExist:
+            raise CommandError('Ese usuario no existe.')
+
+        movil = MovilXiaomi.objects.using('mongodb').only('id').first()
+        ranking = RankingPersonal.objects.using('mongodb').filter(user_email=usuario.email).only('id').first()
+        if movil is None:
+            raise CommandError('No hay móviles cargados.')
+        urls = [reverse('detalle_movil', args=[movil.id])]
+        if ranking is not None:
+            urls.append(reverse('ver_ranking', args=[ranking.id]))
+
+        n, concurrencia = options['peticiones'], options['concurrencia']
+        for url in urls:
+            with override_settings(ROOT_URLCONF='safarank.urls_sync'):
+                sync = self._medir_sync(usuario, url, n, concurrencia)
+            with override_settings(ROOT_URLCONF='safarank.urls_async'):
+                asincrono = asyncio.run(self._medir_async(usuario, url, n, concurrencia))
+            for nombre, muestras in (('sync/WSGI ', sync), ('async/ASGI', asincrono)):
+                self.stdout.write(
+                    f'{url:<28} {nombre}  p50={_percentil(muestras, 50):7.1f}ms  '
+                    f'p99={_percentil(muestras, 99):7.1f}ms  media={statistics.mean(muestras):7.1f}ms'
+                )
+
+    def _medir_sync(self, usuario, url, n, concurrencia):
+        def cliente():
+            c = Client()
+            c.force_login(usuario)
+            return c
+
+        clientes = [cliente() for _ in range(concurrencia)]
+
+        def peticion(i):
+            inicio = time.perf_counter()
+            respuesta = clientes[i % concurrencia].get(url)
+            if respuesta.status_code != 200:
+                raise CommandError(f'{url} ha devuelto {respuesta.status_code}')
+            return (time.perf_counter() - inicio) * 1000
+
+        with ThreadPoolExecutor(concurrencia) as pool:
+            return list(pool.map(peticion, range(n)))
+
+    async def _medir_async(self, usuario, url, n, concurrencia):
+        clientes = []
+        for _ in range(concurrencia):
+            c = AsyncClient()
+            await c.aforce_login(usuario)
+            clientes.append(c)
+        semaforo = asyncio.Semaphore(concurrencia)
+
+        async def peticion(i):
+            async with semaforo:
+                inicio = time.perf_counter()
+                respuesta = await clientes[i % concurrencia].get(url)
+                if respuesta.status_code != 200:
+                    raise CommandError(f'{url} ha devuelto {respuesta.status_code}')
+                return (time.perf_counter() - inicio) * 1000
+
+        try:
+            return await asyncio.gather(*(peticion(i) for i in range(n)))
+        finally:
+            await cerrar_async()
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from safarank import indices
+
+
+class Command(BaseCommand):
+    help = 'Crea los índices de MongoDB del catálogo y de las opiniones y comprueba que las consultas los aprovechan.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--solo-verificar', action='store_true',
+                            help='No crea nada, solo comprueba los planes de las consultas')
+
+    def handle(self, *args, **options):
+        if not options['solo_verificar']:
+            for nombre in indices.crear():
+                self.stdout.write(f'Índice listo: {nombre}')
+
+        fallos = 0
+        for descripcion, usa_indice, etapas in indices.verificar():
+            if usa_indice:
+                self.stdout.write(self.style.SUCCESS(f'OK  {descripcion}: {" > ".join(etapas)}'))
+            else:
+                fallos += 1
+                self.stdout.write(self.style.ERROR(f'MAL {descripcion}: {" > ".join(etapas)}'))
+        if fallos:
+            raise CommandError(f'{fallos} consultas recorren la colección entera.')
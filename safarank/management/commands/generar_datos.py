@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from safarank import generador
+
+
+class Command(BaseCommand):
+    help = ('Genera usuarios, móviles, categorías, valoraciones y rankings sintéticos con popularidad '
+            'tipo Zipf. BORRA los datos actuales: usar solo contra una base de datos de pruebas.')
+
+    def add_arguments(self, parser):
+        for nombre, valor in generador.ESCALA_DEFECTO.items():
+            parser.add_argument(f'--{nombre}', type=int, default=valor)
+        parser.add_argument('--semilla', type=int, default=0, help='Con la misma semilla se generan los mismos datos')
+        parser.add_argument('--zipf', type=float, default=generador.ZIPF_MOVILES,
+                            help='Exponente de la popularidad de los móviles (0 = uniforme)')
+        parser.add_argument('--hilos', type=int, default=generador.HILOS)
+        parser.add_argument('--noinput', '--no-input', action='store_false', dest='interactive',
+                            help='No pedir confirmación')
+
+    def handle(self, *args, **options):
+        escala = {nombre: options[nombre] for nombre in generador.ESCALA_DEFECTO}
+        if escala['usuarios'] < 1 or escala['moviles'] < 1 or min(escala.values()) < 0:
+            raise CommandError('Hace falta al menos un usuario y un móvil, y ninguna cantidad puede ser negativa.')
+        if options['hilos'] < 1:
+            raise CommandError('--hilos tiene que ser al menos 1.')
+
+        if options['interactive']:
+            respuesta = input(f"Se van a borrar los móviles, categorías, valoraciones y rankings de la base de "
+                              f"datos '{generador.base_de_datos()}'. Escribe 'si' para continuar: ")
+            if respuesta.strip().lower() != 'si':
+                raise CommandError('Cancelado.')
+
+        creados = generador.generar(escala, options['semilla'], self.stdout.write, options['hilos'], options['zipf'])
+        self.stdout.write(self.style.SUCCESS(
+            'Generados: ' + ', '.join(f'{n} {nombre}' for nombre, n in creados.items())
+        ))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from safarank import cache_catalogo, miniaturas
+
+
+class Command(BaseCommand):
+    help = ('Descarga (o lee de una carpeta local) las imágenes de los móviles que aún no tienen '
+            'miniatura y genera sus versiones WebP/JPEG.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir-imagenes', help='Carpeta con las imágenes ya descargadas (mismo nombre que en la URL)')
+        parser.add_argument('--hilos', type=int, default=miniaturas.HILOS)
+        parser.add_argument('--todos', action='store_true', help='Reprocesa también los móviles que ya tienen miniatura')
+
+    def handle(self, *args, **options):
+        if options['hilos'] < 1:
+            raise CommandError('--hilos tiene que ser al menos 1.')
+        procesados, errores = miniaturas.procesar_pendientes(options['dir_imagenes'], options['hilos'], options['todos'])
+        cache_catalogo.invalidar()
+
+        for url, error in errores:
+            self.stderr.write(f'{url}: {error}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Miniaturas generadas para {procesados} imágenes ({len(errores)} errores).'
+        ))
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from safarank import cache_catalogo, importador, miniaturas
+
+
+class Command(BaseCommand):
+    help = 'Importa los móviles de un CSV grande, por lotes (los que ya existen se actualizan).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('ruta', help='Ruta del fichero CSV')
+        parser.add_argument('--lote', type=int, default=importador.TAM_LOTE,
+                            help='Filas por cada insert_many')
+        parser.add_argument('--reemplazar', action='store_true',
+                            help='Borra los móviles que no aparezcan en el CSV, con todo lo que apunta a ellos')
+        parser.add_argument('--miniaturas', action='store_true',
+                            help='Genera después las miniaturas de las imágenes que aún no tienen')
+        parser.add_argument('--dir-imagenes', help='Carpeta con las imágenes ya descargadas (mismo nombre que en la URL)')
+
+    def handle(self, *args, **options):
+        try:
+            fichero = open(options['ruta'], newline='', encoding='utf-8-sig')
+        except OSError as e:
+            raise CommandError(f'No se puede abrir el fichero: {e}')
+
+        with fichero:
+            try:
+                resultado = importador.importar_csv(fichero, tam_lote=options['lote'],
+                                                    reemplazar=options['reemplazar'])
+            except ValueError as e:
+                raise CommandError(str(e))
+        if options['miniaturas']:
+            procesados, errores = miniaturas.procesar_pendientes(options['dir_imagenes'])
+            for url, error in errores:
+                self.stderr.write(f'{url}: {error}')
+            self.stdout.write(f'Miniaturas generadas para {procesados} imágenes ({len(errores)} errores).')
+        cache_catalogo.invalidar()
+
+        for linea, motivo in resultado['rechazos']:
+            self.stderr.write(f'Línea {linea}: {motivo}')
+        if resultado['rechazados'] > len(resultado['rechazos']):
+            self.stderr.write(f"... y {resultado['rechazados'] - len(resultado['rechazos'])} rechazos más.")
+        self.stdout.write(self.style.SUCCESS(
+            f"Se han cargado {resultado['cargados']} móviles ({resultado['rechazados']} filas rechazadas, "
+            f"{resultado['borrados']} borrados)."
+        ))
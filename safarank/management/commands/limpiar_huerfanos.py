@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from safarank import gestion_catalogo
+
+
+class Command(BaseCommand):
+    help = ('Quita de categorías, rankings, valoraciones y demás colecciones los móviles que ya no existen '
+            '(borrados antes de que el borrado fuera en cascada).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Solo lista los ids, no borra nada')
+
+    def handle(self, *args, **options):
+        huerfanos = gestion_catalogo.huerfanos()
+        if huerfanos:
+            self.stdout.write(f'Móviles inexistentes referenciados: {", ".join(map(str, huerfanos))}')
+        if not options['dry_run']:
+            gestion_catalogo.limpiar_referencias(huerfanos)
+        self.stdout.write(self.style.SUCCESS(f'{len(huerfanos)} móviles huérfanos{"" if options["dry_run"] else " limpiados"}.'))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from safarank import cache_catalogo, migracion_rankings
+
+
+class Command(BaseCommand):
+    help = ('Convierte todos los rankings al formato de tiers (S, A, B, C, D, unranked) por lotes. '
+            'Si se corta, al relanzarlo sigue por donde iba.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=migracion_rankings.TAM_LOTE)
+        parser.add_argument('--dry-run', action='store_true', help='Solo informa de lo que cambiaría, no escribe nada')
+        parser.add_argument('--desde-cero', action='store_true', help='Ignora el checkpoint y empieza por el primer ranking')
+
+    def handle(self, *args, **options):
+        if options['lote'] < 1:
+            raise CommandError('--lote tiene que ser al menos 1.')
+        informe = migracion_rankings.migrar(options['lote'], options['dry_run'], options['desde_cero'], self.stdout.write)
+        if not options['dry_run']:
+            cache_catalogo.invalidar()
+
+        for problema, n in sorted(informe['problemas'].items()):
+            self.stdout.write(f'  {problema}: {n}')
+        verbo = 'por convertir' if options['dry_run'] else 'convertidos'
+        self.stdout.write(self.style.SUCCESS(
+            f"{informe['revisados']} rankings revisados, {informe['convertidos']} {verbo}."
+        ))
@@ -0,0 +1,19 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from safarank import recomendaciones
+
+
+class Command(BaseCommand):
+    help = 'Recalcula los móviles parecidos de cada móvil (similitud coseno entre sus valoraciones).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vecinos', type=int, default=None, help='Cuántos vecinos se guardan por móvil')
+        parser.add_argument('--procesos', type=int, default=os.cpu_count(), help='Tamaño del pool de procesos')
+
+    def handle(self, *args, **options):
+        if options['procesos'] < 1:
+            raise CommandError('--procesos tiene que ser al menos 1.')
+        total = recomendaciones.reconstruir(options['vecinos'], options['procesos'])
+        self.stdout.write(self.style.SUCCESS(f'Recomendaciones calculadas para {total} móviles.'))
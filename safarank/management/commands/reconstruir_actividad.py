@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from safarank import actividad, cache_catalogo
+
+
+class Command(BaseCommand):
+    help = 'Recalcula desde cero los contadores de valoraciones y rankings de cada usuario.'
+
+    def handle(self, *args, **options):
+        total = actividad.reconstruir()
+        cache_catalogo.invalidar()
+        self.stdout.write(self.style.SUCCESS(f'Actividad reconstruida para {total} usuarios.'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from safarank import agregados, clasificacion
+
+
+class Command(BaseCommand):
+    help = 'Recalcula desde cero los resúmenes de valoraciones por móvil y las clasificaciones.'
+
+    def handle(self, *args, **options):
+        total = agregados.reconstruir()
+        self.stdout.write(self.style.SUCCESS(f'Resúmenes reconstruidos para {total} móviles.'))
+        #el $out deja los resúmenes sin 'bayes': sin esto las listas top-k se
+        #rehacen vacías en cuanto un voto manda a un móvil al último puesto
+        listas = clasificacion.reconstruir()
+        self.stdout.write(self.style.SUCCESS(f'{listas} clasificaciones reconstruidas.'))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from safarank import cache_catalogo, indice_categorias
+
+
+class Command(BaseCommand):
+    help = 'Recalcula el índice móvil -> categorías y el número de móviles de cada categoría.'
+
+    def handle(self, *args, **options):
+        total = indice_categorias.reconstruir()
+        cache_catalogo.invalidar()
+        self.stdout.write(self.style.SUCCESS(f'Índice reconstruido para {total} móviles.'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from safarank import clasificacion
+
+
+class Command(BaseCommand):
+    help = 'Recalcula la media bayesiana de todos los móviles y las clasificaciones top-k.'
+
+    def handle(self, *args, **options):
+        total = clasificacion.reconstruir()
+        self.stdout.write(self.style.SUCCESS(f'{total} clasificaciones reconstruidas.'))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from safarank import cache_catalogo, consenso
+
+
+class Command(BaseCommand):
+    help = 'Recalcula desde cero la tier list de la comunidad a partir de todos los rankings.'
+
+    def handle(self, *args, **options):
+        total = consenso.reconstruir()
+        cache_catalogo.invalidar()
+        self.stdout.write(self.style.SUCCESS(f'Tier list de la comunidad reconstruida para {total} móviles.'))
@@ -0,0 +1,174 @@
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.template.backends.django import DjangoTemplates
+from pymongo import monitoring
+
+from .mongo import ALIAS
+
+#métricas por vista: cuántas consultas a mongo y a sqlite hace cada petición,
+#cuánto tardan, cuánto se va en pintar plantillas y la latencia total.
+#Se guardan las últimas VENTANA peticiones de cada url (por nombre) y de ahí
+#salen los percentiles y el histograma de la página de métricas
+
+logger = logging.getLogger(__name__)
+
+VENTANA = 1000
+CUBETAS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+_actual = ContextVar('metricas_peticion', default=None)
+_lock = threading.Lock()
+_muestras = defaultdict(lambda: deque(maxlen=VENTANA))
+
+
+def _nueva():
+    return {'mongo': 0, 'mongo_ms': 0.0, 'sqlite': 0, 'sqlite_ms': 0.0, 'plantillas_ms': 0.0}
+
+
+def _sumar(contador, ms):
+    datos = _actual.get()
+    if datos is not None:
+        datos[contador] += 1
+        datos[f'{contador}_ms'] += ms
+
+
+#MONGO: listener de pymongo, recibe un evento por cada comando que acaba
+
+class EscuchaMongo(monitoring.CommandListener):
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        _sumar('mongo', event.duration_micros / 1000)
+
+    def failed(self, event):
+        _sumar('mongo', event.duration_micros / 1000)
+
+
+#SQLITE: execute_wrapper que se instala en cada conexión nueva
+
+def _medir_sql(execute, sql, params, many, context):
+    inicio = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        _sumar('sqlite', (time.perf_counter() - inicio) * 1000)
+
+
+def instalar_en_conexion(sender, connection, **kwargs):
+    if connection.alias != ALIAS and _medir_sql not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_medir_sql)
+
+
+#PLANTILLAS: backend de plantillas igual que el de django pero cronometrado
+
+class _PlantillaMedida:
+    def __init__(self, plantilla):
+        self.plantilla = plantilla
+
+    def __getattr__(self, nombre):
+        return getattr(self.plantilla, nombre)
+
+    def render(self, context=None, request=None):
+        inicio = time.perf_counter()
+        try:
+            return self.plantilla.render(context, request)
+        finally:
+            datos = _actual.get()
+            if datos is not None:
+                datos['plantillas_ms'] += (time.perf_counter() - inicio) * 1000
+
+
+class PlantillasMedidas(DjangoTemplates):
+    def from_string(self, template_code):
+        return _PlantillaMedida(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return _PlantillaMedida(super().get_template(template_name))
+
+
+#MIDDLEWARE
+
+class MetricasMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.asincrono = iscoroutinefunction(get_response)
+        if self.asincrono:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.asincrono:
+            return self.__acall__(request)
+        token, inicio = _actual.set(_nueva()), time.perf_counter()
+        try:
+            response = self.get_response(request)
+            self._registrar(request, inicio)
+            return response
+        finally:
+            _actual.reset(token)
+
+    async def __acall__(self, request):
+        token, inicio = _actual.set(_nueva()), time.perf_counter()
+        try:
+            response = await self.get_response(request)
+            self._registrar(request, inicio)
+            return response
+        finally:
+            _actual.reset(token)
+
+    def _registrar(self, request, inicio):
+        match = getattr(request, 'resolver_match', None)
+        if match is None or not match.url_name:
+            return
+        datos = _actual.get()
+        datos['total_ms'] = (time.perf_counter() - inicio) * 1000
+        with _lock:
+            _muestras[match.url_name].append(datos)
+
+        consultas = datos['mongo'] + datos['sqlite']
+        presupuesto = getattr(settings, 'SAFARANK_PRESUPUESTO_CONSULTAS', 20)
+        if consultas > presupuesto:
+            logger.warning(
+                "La vista '%s' ha hecho %d consultas (%d mongo, %d sqlite), el presupuesto es %d",
+                match.url_name, consultas, datos['mongo'], datos['sqlite'], presupuesto,
+            )
+
+
+#RESUMEN
+
+def _percentil(ordenadas, p):
+    return round(ordenadas[min(len(ordenadas) - 1, int(len(ordenadas) * p / 100))], 2)
+
+
+def resumen():
+    with _lock:
+        copia = {nombre: list(muestras) for nombre, muestras in _muestras.items()}
+
+    vistas = []
+    for nombre, muestras in sorted(copia.items()):
+        totales = sorted(m['total_ms'] for m in muestras)
+        n = len(muestras)
+        cubetas = [sum(1 for t in totales if t <= limite) for limite in CUBETAS_MS]
+        vistas.append({
+            'vista': nombre,
+            'peticiones': n,
+            'p50_ms': _percentil(totales, 50),
+            'p95_ms': _percentil(totales, 95),
+            'p99_ms': _percentil(totales, 99),
+            'mongo_consultas': round(sum(m['mongo'] for m in muestras) / n, 1),
+            'mongo_ms': round(sum(m['mongo_ms'] for m in muestras) / n, 2),
+            'sqlite_consultas': round(sum(m['sqlite'] for m in muestras) / n, 1),
+            'sqlite_ms': round(sum(m['sqlite_ms'] for m in muestras) / n, 2),
+            'plantillas_ms': round(sum(m['plantillas_ms'] for m in muestras) / n, 2),
+            #histograma acumulado: peticiones que tardaron <= cada límite
+            'histograma': dict(zip([f'<={c}ms' for c in CUBETAS_MS], cubetas)) | {'total': n},
+        })
+    return vistas
@@ -0,0 +1,108 @@
+from pymongo import UpdateOne
+
+from . import consenso
+from .models import RankingPersonal
+from .mongo import coleccion, columna_pk
+from .tierlist import TIERS, tiers_vacias
+
+#migración de los rankings al único formato de tiers que entienden las vistas:
+#elementos = {'S': [...], 'A': [...], 'B': [...], 'C': [...], 'D': [...], 'unranked': [...]}
+#con ids enteros y cada móvil en una sola tier. Las listas antiguas (lista
+#plana) pasan enteras a 'unranked'. Va por lotes en orden de id y guarda por
+#dónde va en 'migraciones', así si se corta se puede relanzar y sigue
+
+MIGRACIONES = 'migraciones'
+NOMBRE = 'rankings_tiers'
+TAM_LOTE = 500
+
+
+def compactar(elementos):
+    #devuelve (elementos en el formato nuevo, lista de problemas encontrados)
+    problemas = []
+    if isinstance(elementos, list):
+        problemas.append('lista antigua')
+        elementos = {'unranked': elementos}
+    elif not isinstance(elementos, dict):
+        problemas.append('sin elementos')
+        elementos = {}
+
+    if problemas == [] and any(t not in elementos for t in TIERS):
+        problemas.append('faltan tiers')
+    sobran = [k for k in elementos if k not in TIERS]
+    if sobran:
+        problemas.append('tiers desconocidas')
+
+    nuevo, vistos = tiers_vacias(), set()
+    #las tiers desconocidas van a 'unranked', detrás de lo que ya hubiera
+    for tier, destino in [(t, t) for t in TIERS] + [(k, 'unranked') for k in sobran]:
+        for m in elementos.get(tier) or []:
+            try:
+                movil_id = int(m)
+            except (TypeError, ValueError):
+                problemas.append('ids no válidos')
+                continue
+            if type(m) is not int:
+                problemas.append('ids no enteros')
+            if movil_id in vistos:
+                problemas.append('repetidos')
+                continue
+            vistos.add(movil_id)
+            nuevo[destino].append(movil_id)
+    return nuevo, sorted(set(problemas))
+
+
+def _checkpoint():
+    return coleccion(MIGRACIONES).find_one({'_id': NOMBRE}) or {}
+
+
+def migrar(lote=TAM_LOTE, dry_run=False, desde_cero=False, avisar=None):
+    #devuelve el informe {'revisados', 'convertidos', 'problemas': {problema: n}}.
+    #Con dry_run no escribe nada, ni siquiera el checkpoint
+    avisar = avisar or (lambda texto: None)
+    pk = columna_pk(RankingPersonal)
+    rankings = coleccion(RankingPersonal)
+    if desde_cero and not dry_run:
+        coleccion(MIGRACIONES).delete_one({'_id': NOMBRE})
+    estado = {} if desde_cero else _checkpoint()
+    ultimo = estado.get('ultimo')
+    informe = {'revisados': 0, 'convertidos': 0, 'problemas': {}}
+    recalcular_consenso = False
+    if ultimo is not None:
+        avisar(f"Continuando después del ranking {ultimo}")
+
+    while True:
+        filtro = {pk: {'$type': 'number'}}
+        if ultimo is not None:
+            filtro[pk] = {'$gt': ultimo}
+        docs = list(rankings.find(filtro, {pk: 1, 'elementos': 1}).sort(pk, 1).limit(lote))
+        if not docs:
+            break
+
+        ops = []
+        for doc in docs:
+            antes = doc.get('elementos')
+            nuevo, problemas = compactar(antes)
+            for p in problemas:
+                informe['problemas'][p] = informe['problemas'].get(p, 0) + 1
+            if problemas or nuevo != antes:
+                informe['convertidos'] += 1
+                #solo si nadie lo ha tocado mientras (guardar_orden ya escribe el formato nuevo)
+                ops.append(UpdateOne({pk: doc[pk], 'elementos': antes}, {'$set': {'elementos': nuevo}}))
+        informe['revisados'] += len(docs)
+        ultimo = docs[-1][pk]
+
+        if not dry_run:
+            if ops:
+                rankings.bulk_write(ops, ordered=False)
+                recalcular_consenso = True
+            coleccion(MIGRACIONES).update_one(
+                {'_id': NOMBRE},
+                {'$set': {'ultimo': ultimo}, '$inc': {'revisados': len(docs), 'convertidos': len(ops)}},
+                upsert=True,
+            )
+        avisar(f"{informe['revisados']} revisados, {informe['convertidos']} por convertir (último id {ultimo})")
+
+    #las tiers repetidas o desconocidas contaban raro en el consenso: se recalcula una vez al final
+    if recalcular_consenso:
+        consenso.reconstruir()
+    return informe
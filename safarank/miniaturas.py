@@ -0,0 +1,179 @@
+import hashlib
+import io
+import os
+import re
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.utils import timezone
+from PIL import Image, ImageOps
+from pymongo import UpdateOne
+
+from . import cache_catalogo
+from .ids import CONTADORES
+from .models import MovilXiaomi
+from .mongo import coleccion, columna_pk
+
+#miniaturas de las fotos de los móviles. Cada imagen original se identifica
+#por el sha256 de su contenido y se guarda en disco ya redimensionada en
+#WebP y JPEG. Como el nombre depende del contenido, un fichero nunca cambia
+#y se puede servir con caché de un año. La URL original -> hash se apunta
+#en la colección 'imagenes' para no volver a descargar al reimportar el CSV
+
+IMAGENES = 'imagenes'
+
+#lado máximo en px: p = tier list y tablas, m = tarjetas, g = detalle
+TAMANOS = {'p': 96, 'm': 240, 'g': 480}
+FORMATOS = ('webp', 'jpg')
+
+MAX_BYTES = 10 * 1024 * 1024
+TIMEOUT_DESCARGA = 10
+HILOS = 8
+
+_segundo_plano = ThreadPoolExecutor(2, thread_name_prefix='miniaturas')
+#tareas en cola y si alguna ha cambiado algún móvil: el catálogo entero se
+#invalida una sola vez, cuando se vacía la cola
+_lock = threading.Lock()
+_pendientes = {'tareas': 0, 'cambios': False}
+
+NOMBRE = re.compile(r'^(?P<hash>[0-9a-f]{64})-(?P<tam>[pmg])\.(?P<formato>webp|jpg)$')
+
+
+def directorio():
+    return Path(settings.SAFARANK_MINIATURAS_DIR)
+
+
+def ruta(hash_imagen, tam, formato):
+    #se reparte en subcarpetas por los dos primeros caracteres del hash
+    return directorio() / hash_imagen[:2] / f'{hash_imagen}-{tam}.{formato}'
+
+
+def _guardar(imagen, destino, formato):
+    destino.parent.mkdir(parents=True, exist_ok=True)
+    temporal = destino.with_name(destino.name + '.tmp')
+    if formato == 'webp':
+        imagen.save(temporal, 'WEBP', quality=80, method=4)
+    else:
+        #JPEG no tiene transparencia: fondo blanco
+        fondo = Image.new('RGB', imagen.size, 'white')
+        fondo.paste(imagen, mask=imagen.getchannel('A'))
+        fondo.save(temporal, 'JPEG', quality=82, optimize=True, progressive=True)
+    #se escribe aparte y se renombra para que nunca se sirva un fichero a medias
+    os.replace(temporal, destino)
+
+
+def ingerir(datos):
+    #genera (si no existen ya) todas las miniaturas de una imagen y devuelve su hash
+    hash_imagen = hashlib.sha256(datos).hexdigest()
+    pendientes = [(t, f) for t in TAMANOS for f in FORMATOS if not ruta(hash_imagen, t, f).exists()]
+    if pendientes:
+        with Image.open(io.BytesIO(datos)) as original:
+            original = ImageOps.exif_transpose(original).convert('RGBA')
+            for tam in {t for t, _ in pendientes}:
+                imagen = original.copy()
+                imagen.thumbnail((TAMANOS[tam], TAMANOS[tam]), Image.LANCZOS)
+                for t, formato in pendientes:
+                    if t == tam:
+                        _guardar(imagen, ruta(hash_imagen, tam, formato), formato)
+    return hash_imagen
+
+
+def _leer(origen, dir_local=None):
+    #primero se busca en la carpeta local un fichero con el mismo nombre que el de la URL
+    if dir_local:
+        local = Path(dir_local) / Path(urlparse(origen).path).name
+        if local.is_file():
+            return local.read_bytes()
+    if not origen.startswith(('http://', 'https://')):
+        raise ValueError('no es una URL http')
+    peticion = urllib.request.Request(origen, headers={'User-Agent': 'safarank-miniaturas'})
+    with urllib.request.urlopen(peticion, timeout=TIMEOUT_DESCARGA) as respuesta:
+        datos = respuesta.read(MAX_BYTES + 1)
+    if len(datos) > MAX_BYTES:
+        raise ValueError('imagen demasiado grande')
+    return datos
+
+
+def procesar_url(url, dir_local=None, imagenes=None):
+    #hash de la imagen de esa URL, descargándola solo si no se había hecho antes.
+    #Desde otros hilos hay que pasar la colección: no deben abrir conexiones de django
+    if imagenes is None:
+        imagenes = coleccion(IMAGENES)
+    conocida = imagenes.find_one({'_id': url})
+    if conocida and all(ruta(conocida['hash'], t, f).exists() for t in TAMANOS for f in FORMATOS):
+        return conocida['hash']
+    hash_imagen = ingerir(_leer(url, dir_local))
+    imagenes.update_one({'_id': url}, {'$set': {'hash': hash_imagen, 'fecha': timezone.now()}}, upsert=True)
+    return hash_imagen
+
+
+def procesar_en_segundo_plano(movil_id, url):
+    #para el admin: la descarga no bloquea la petición. Cuando termina apunta
+    #el hash en el móvil (si sigue teniendo esa URL); si falla, el móvil se
+    #queda sin miniatura y lo recoge el comando generar_miniaturas. Al acabar
+    #cada una solo se quita ese móvil de la caché; el catálogo se invalida
+    #una vez cuando ya no quedan más en cola
+    moviles, imagenes, contadores = coleccion(MovilXiaomi), coleccion(IMAGENES), coleccion(CONTADORES)
+    with _lock:
+        _pendientes['tareas'] += 1
+
+    def tarea():
+        try:
+            hash_imagen = procesar_url(url, imagenes=imagenes)
+            res = moviles.update_one({columna_pk(MovilXiaomi): movil_id, 'imgURL': url},
+                                     {'$set': {'imagen': hash_imagen}})
+            if res.modified_count:
+                cache_catalogo.olvidar_movil(movil_id)
+                with _lock:
+                    _pendientes['cambios'] = True
+        except Exception:
+            pass
+        finally:
+            with _lock:
+                _pendientes['tareas'] -= 1
+                invalidar = _pendientes['tareas'] == 0 and _pendientes['cambios']
+                if invalidar:
+                    _pendientes['cambios'] = False
+            if invalidar:
+                cache_catalogo.invalidar(contadores)
+
+    return _segundo_plano.submit(tarea)
+
+
+def hashes_conocidos(urls):
+    #{url: hash} de las URLs que ya tienen miniaturas (para el importador)
+    return {d['_id']: d['hash'] for d in coleccion(IMAGENES).find({'_id': {'$in': list(urls)}})}
+
+
+def procesar_pendientes(dir_local=None, hilos=HILOS, todos=False):
+    #genera las miniaturas de los móviles que aún no tienen, descargando en
+    #paralelo. Devuelve (procesados, [(url, error), ...])
+    moviles, imagenes = coleccion(MovilXiaomi), coleccion(IMAGENES)
+    filtro = {'imgURL': {'$nin': ['', None]}}
+    if not todos:
+        filtro['imagen'] = {'$in': ['', None]}
+    por_url = {}
+    for doc in moviles.find(filtro, {columna_pk(MovilXiaomi): 1, 'imgURL': 1}):
+        por_url.setdefault(doc['imgURL'], []).append(doc[columna_pk(MovilXiaomi)])
+
+    def procesar(url):
+        try:
+            return url, procesar_url(url, dir_local, imagenes), None
+        except Exception as e:
+            return url, None, str(e)
+
+    errores, cambios = [], []
+    with ThreadPoolExecutor(hilos) as pool:
+        for url, hash_imagen, error in pool.map(procesar, por_url):
+            if error:
+                errores.append((url, error))
+            else:
+                cambios.append(UpdateOne({columna_pk(MovilXiaomi): {'$in': por_url[url]}},
+                                         {'$set': {'imagen': hash_imagen}}))
+    if cambios:
+        moviles.bulk_write(cambios, ordered=False)
+    return len(cambios), errores
@@ -56,6 +56,8 @@ class MovilXiaomi(models.Model):
     ratings = models.FloatField(default=0.0)
     price = models.IntegerField(default=0.0)
     imgURL = models.URLField(max_length=900)
+    #sha256 de la imagen, para sus miniaturas (ver miniaturas.py)
+    imagen = models.CharField(max_length=64, blank=True, null=True)
     camera = models.IntegerField(default=0)
     display = models.CharField(max_length=100, default="N/A")
     battery = models.IntegerField(default=0)
@@ -81,6 +83,8 @@ class Categoria(models.Model):
     name = models.CharField(max_length=150, unique=True)
     description = models.CharField(max_length=300)
     moviles = JSONField(default=list, blank=True)
+    #len(set(moviles)), se mantiene al guardar para no leer el array entero
+    num_moviles = models.IntegerField(default=0)
 
     class Meta:
         managed = False
@@ -0,0 +1,68 @@
+import asyncio
+import weakref
+
+from django.db import connections
+from pymongo import AsyncMongoClient
+
+#acceso directo a pymongo para las operaciones que el ORM no sabe hacer
+#(incrementos atómicos, agregaciones, updates masivos...)
+
+ALIAS = 'mongodb'
+
+
+def coleccion(modelo_o_nombre):
+    nombre = modelo_o_nombre if isinstance(modelo_o_nombre, str) else modelo_o_nombre._meta.db_table
+    return connections[ALIAS].database[nombre]
+
+
+def columna_pk(modelo):
+    return modelo._meta.pk.column
+
+
+def documento(obj):
+    #el documento que guardaría el ORM para este objeto, para inserciones masivas
+    connection = connections[ALIAS]
+    return {
+        f.column: f.get_db_prep_save(getattr(obj, f.attname), connection)
+        for f in obj._meta.concrete_fields
+    }
+
+
+#cliente asíncrono para las vistas async. El cliente va atado al bucle de
+#eventos en el que se crea, así que se guarda uno por bucle. Por ASGI hay un
+#solo bucle en todo el proceso; quien cree bucles propios (asyncio.run) tiene
+#que llamar a cerrar_async antes de que termine
+_clientes_async = weakref.WeakKeyDictionary()
+
+
+def _cliente_async(ajustes):
+    #los mismos parámetros con los que django_mongodb_backend abre el cliente sync
+    return AsyncMongoClient(
+        host=ajustes['HOST'] or None,
+        port=int(ajustes['PORT']) if ajustes.get('PORT') else None,
+        username=ajustes.get('USER') or None,
+        password=ajustes.get('PASSWORD') or None,
+        **ajustes.get('OPTIONS', {}),
+    )
+
+
+def coleccion_async(modelo_o_nombre):
+    nombre = modelo_o_nombre if isinstance(modelo_o_nombre, str) else modelo_o_nombre._meta.db_table
+    ajustes = connections[ALIAS].settings_dict
+    bucle = asyncio.get_running_loop()
+    if bucle not in _clientes_async:
+        _clientes_async[bucle] = _cliente_async(ajustes)
+    return _clientes_async[bucle][ajustes['NAME']][nombre]
+
+
+async def cerrar_async():
+    #cierra el cliente del bucle actual (si se llegó a abrir)
+    cliente = _clientes_async.pop(asyncio.get_running_loop(), None)
+    if cliente is not None:
+        await cliente.close()
+
+
+def instancia(modelo, doc):
+    #convierte un documento crudo en un objeto del modelo (como si viniera del ORM)
+    campos = [f for f in modelo._meta.concrete_fields if f.column in doc]
+    return modelo.from_db(ALIAS, [f.attname for f in campos], [f.to_python(doc[f.column]) for f in campos])
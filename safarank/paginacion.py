@@ -0,0 +1,36 @@
+from django.db.models import Q
+
+#paginación por cursor (keyset): en vez de OFFSET se pide "lo que va después
+#del último que viste", así cada página cuesta lo mismo aunque haya miles
+
+TAM_PAGINA = 24
+TAM_PAGINA_MAX = 100
+
+
+def tam_pagina(request, defecto=TAM_PAGINA, maximo=TAM_PAGINA_MAX):
+    try:
+        n = int(request.GET.get('n', defecto))
+    except ValueError:
+        return defecto
+    return max(1, min(n, maximo))
+
+
+def pagina_keyset(qs, campo, despues, n, descendente=False, desempate=None):
+    #devuelve (filas, cursor_siguiente); el cursor es None en la última página.
+    #Con desempate (p.ej. 'id') el cursor es (valor, valor_desempate), para
+    #ordenar por campos que se pueden repetir como el precio
+    op = 'lt' if descendente else 'gt'
+    if despues is not None:
+        if desempate:
+            valor, valor_desempate = despues
+            qs = qs.filter(Q(**{f'{campo}__{op}': valor}) | Q(**{campo: valor, f'{desempate}__{op}': valor_desempate}))
+        else:
+            qs = qs.filter(**{f'{campo}__{op}': despues})
+    signo = '-' if descendente else ''
+    qs = qs.order_by(f'{signo}{campo}', *([f'{signo}{desempate}'] if desempate else []))
+    filas = list(qs[:n + 1])
+    siguiente = None
+    if len(filas) > n:
+        ultimo = filas[n - 1]
+        siguiente = (getattr(ultimo, campo), getattr(ultimo, desempate)) if desempate else getattr(ultimo, campo)
+    return filas[:n], siguiente
@@ -0,0 +1,147 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from django.conf import settings
+from scipy import sparse
+
+from .models import Valoracion
+from .mongo import coleccion
+
+#"quien valoró este también valoró": similitud coseno item-item sobre la
+#matriz usuarios x móviles de las valoraciones. El cálculo es por lotes
+#(comando recalcular_recomendaciones) y deja los N vecinos de cada móvil en
+#'recomendaciones': {'_id': movil_id, 'vecinos': [{'movil_id', 'similitud'}, ...]}
+#así detalle_movil solo hace un find_one por _id.
+#
+#La similitud se encoge según cuántos usuarios han valorado los dos móviles:
+#sim * comunes / (comunes + ENCOGIMIENTO), para que un único usuario en común
+#no dé una similitud de 1
+
+RECOMENDACIONES = 'recomendaciones'
+LOTE_LECTURA = 50000
+MOVILES_POR_TAREA = 500
+
+
+def _vecinos():
+    return getattr(settings, 'SAFARANK_RECOMENDACIONES_N', 10)
+
+
+def _encogimiento():
+    return getattr(settings, 'SAFARANK_RECOMENDACIONES_ENCOGIMIENTO', 5)
+
+
+def vecinos(movil_id, n=None):
+    doc = coleccion(RECOMENDACIONES).find_one({'_id': movil_id}, {'vecinos': 1}) or {}
+    return doc.get('vecinos', [])[:n]
+
+
+#CÁLCULO
+
+def _leer_valoraciones():
+    #tres arrays (usuario, móvil, puntuación) leídos por lotes, sin crear objetos del ORM
+    usuarios, moviles, puntos = [], [], []
+    cursor = coleccion(Valoracion).find(
+        {}, {'_id': 0, 'user_email': 1, 'movil_id': 1, 'puntuacion': 1}, batch_size=LOTE_LECTURA,
+    )
+    for doc in cursor:
+        usuarios.append(doc['user_email'])
+        moviles.append(doc['movil_id'])
+        puntos.append(doc['puntuacion'])
+    return np.array(usuarios, dtype=object), np.array(moviles, dtype=np.int64), np.array(puntos, dtype=np.float32)
+
+
+def matriz(usuarios, moviles, puntos):
+    #matriz dispersa usuarios x móviles (CSC) y el id de móvil de cada columna.
+    #Si alguien tiene dos valoraciones del mismo móvil cuenta solo la última leída
+    if len(usuarios) == 0:
+        return sparse.csc_matrix((0, 0), dtype=np.float32), np.array([], dtype=np.int64)
+    _, filas = np.unique(usuarios, return_inverse=True)
+    ids_moviles, columnas = np.unique(moviles, return_inverse=True)
+    clave = filas.astype(np.int64) * len(ids_moviles) + columnas
+    ultima = len(clave) - 1 - np.unique(clave[::-1], return_index=True)[1]
+    m = sparse.csc_matrix(
+        (puntos[ultima], (filas[ultima], columnas[ultima])), shape=(filas.max() + 1, len(ids_moviles)),
+    )
+    return m, ids_moviles
+
+
+def _top(sim, comunes, i, propio, n, encogimiento):
+    #los n vecinos de la fila i; las dos matrices tienen los mismos huecos
+    #(las puntuaciones son >= 1), así que basta con mirar sus datos
+    inicio, fin = sim.indptr[i], sim.indptr[i + 1]
+    columnas = sim.indices[inicio:fin]
+    cuenta = comunes.data[inicio:fin]
+    valores = sim.data[inicio:fin] * cuenta / (cuenta + encogimiento)
+    valores[columnas == propio] = 0
+    candidatos = np.flatnonzero(valores > 0)
+    if len(candidatos) > n:
+        candidatos = candidatos[np.argpartition(-valores[candidatos], n - 1)[:n]]
+    candidatos = candidatos[np.argsort(-valores[candidatos], kind='stable')]
+    return columnas[candidatos], valores[candidatos]
+
+
+#matrices de cada proceso del pool: se mandan una vez al arrancarlo, no en cada tarea.
+#El pool usa fork: con forkserver/spawn (lo de serie en Linux desde Python 3.14)
+#cada proceso volvería a importar este módulo, que importa .models, sin Django
+#configurado. Con fork heredan el proceso ya preparado y las matrices sin copiarlas
+_matrices = {}
+
+
+def _preparar(normalizada, binaria, ids_moviles):
+    _matrices.update(normalizada=normalizada, binaria=binaria, ids_moviles=ids_moviles)
+
+
+def _tarea_pool(desde, hasta, n, encogimiento):
+    return _tarea(_matrices['normalizada'], _matrices['binaria'], _matrices['ids_moviles'], desde, hasta, n, encogimiento)
+
+
+def _tarea(normalizada, binaria, ids_moviles, desde, hasta, n, encogimiento):
+    #vecinos de las columnas [desde, hasta)
+    sim = (normalizada[:, desde:hasta].T @ normalizada).tocsr()
+    comunes = (binaria[:, desde:hasta].T @ binaria).tocsr()
+    sim.sort_indices()
+    comunes.sort_indices()
+    resultado = []
+    for i in range(hasta - desde):
+        columnas, valores = _top(sim, comunes, i, desde + i, n, encogimiento)
+        resultado.append({
+            '_id': int(ids_moviles[desde + i]),
+            'vecinos': [{'movil_id': int(ids_moviles[c]), 'similitud': round(float(v), 4)}
+                        for c, v in zip(columnas, valores)],
+        })
+    return resultado
+
+
+def calcular(m, ids_moviles, n=None, procesos=None):
+    #lista de documentos {'_id', 'vecinos'} para todos los móviles con votos
+    n = n or _vecinos()
+    encogimiento = _encogimiento()
+    normas = np.sqrt(np.asarray(m.multiply(m).sum(axis=0)).ravel())
+    normas[normas == 0] = 1
+    normalizada = (m @ sparse.diags(1 / normas)).tocsc()
+    binaria = (m != 0).astype(np.float32).tocsc()
+
+    rangos = [(d, min(d + MOVILES_POR_TAREA, len(ids_moviles))) for d in range(0, len(ids_moviles), MOVILES_POR_TAREA)]
+    if (procesos or 1) <= 1 or len(rangos) <= 1:
+        return [doc for d, h in rangos for doc in _tarea(normalizada, binaria, ids_moviles, d, h, n, encogimiento)]
+    with ProcessPoolExecutor(min(procesos, len(rangos)), mp_context=multiprocessing.get_context('fork'),
+                             initializer=_preparar, initargs=(normalizada, binaria, ids_moviles)) as pool:
+        futuros = [pool.submit(_tarea_pool, d, h, n, encogimiento) for d, h in rangos]
+        return [doc for f in futuros for doc in f.result()]
+
+
+def reconstruir(n=None, procesos=None):
+    #calcula la instantánea entera en una colección aparte y la cambia de golpe
+    #por la actual (rename), así las páginas nunca ven una a medio escribir
+    docs = calcular(*matriz(*_leer_valoraciones()), n=n, procesos=procesos or os.cpu_count())
+    temporal = coleccion(f'{RECOMENDACIONES}_nuevas')
+    temporal.drop()
+    for i in range(0, len(docs), LOTE_LECTURA):
+        temporal.insert_many(docs[i:i + LOTE_LECTURA], ordered=False)
+    if docs:
+        temporal.rename(RECOMENDACIONES, dropTarget=True)
+    else:
+        coleccion(RECOMENDACIONES).delete_many({})
+    return len(docs)
@@ -0,0 +1,62 @@
+from datetime import datetime
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import DESCENDING
+
+from . import agregados
+from .models import Valoracion
+from .mongo import coleccion, coleccion_async, instancia
+
+#opiniones de un móvil, de la más nueva a la más antigua, por páginas con
+#cursor (fecha, _id) sobre el índice (movil_id, fecha, _id) de indices.py
+
+TAM_PAGINA = 10
+ORDEN = [('fecha', DESCENDING), ('_id', DESCENDING)]
+
+
+def _filtro(movil_id, despues):
+    filtro = {'movil_id': movil_id}
+    if despues is not None:
+        fecha, oid = despues
+        filtro['$or'] = [{'fecha': {'$lt': fecha}}, {'fecha': fecha, '_id': {'$lt': oid}}]
+    return filtro
+
+
+def _partir(docs, n):
+    #(valoraciones, cursor_siguiente); None en la última página
+    siguiente = (docs[n - 1]['fecha'], docs[n - 1]['_id']) if len(docs) > n else None
+    return [instancia(Valoracion, d) for d in docs[:n]], siguiente
+
+
+def pagina(movil_id, despues=None, n=TAM_PAGINA):
+    docs = list(coleccion(Valoracion).find(_filtro(movil_id, despues)).sort(ORDEN).limit(n + 1))
+    return _partir(docs, n)
+
+
+async def pagina_async(movil_id, despues=None, n=TAM_PAGINA):
+    cursor = coleccion_async(Valoracion).find(_filtro(movil_id, despues)).sort(ORDEN).limit(n + 1)
+    return _partir([d async for d in cursor], n)
+
+
+def cursor_a_texto(cursor):
+    fecha, oid = cursor
+    return f'{fecha.isoformat()}_{oid}'
+
+
+def texto_a_cursor(texto):
+    #None si el cursor no es válido (se vuelve a la primera página)
+    try:
+        fecha, oid = texto.rsplit('_', 1)
+        return datetime.fromisoformat(fecha), ObjectId(oid)
+    except (ValueError, InvalidId):
+        return None
+
+
+def histograma(resumen):
+    #[(estrellas, votos, porcentaje)] de 5 a 1 a partir de agregados.resumen_movil
+    votos = resumen['votos']
+    return [
+        (int(e), resumen['estrellas'][e], round(100 * resumen['estrellas'][e] / votos) if votos else 0)
+        for e in reversed(agregados.ESTRELLAS)
+    ]
@@ -0,0 +1,58 @@
+from .agregados import RESUMEN
+from .models import MovilXiaomi, Valoracion, Categoria
+from .mongo import coleccion, columna_pk
+
+#consultas de las páginas de estadísticas hechas como pipelines de agregación,
+#así mongo hace el trabajo y solo nos llegan las filas que se pintan
+
+
+def _lookup_nombre_movil(campo_local):
+    return {'$lookup': {
+        'from': MovilXiaomi._meta.db_table,
+        'localField': campo_local,
+        'foreignField': columna_pk(MovilXiaomi),
+        'pipeline': [{'$project': {'_id': 0, 'name': 1}}],
+        'as': 'movil',
+    }}
+
+
+def stats_categorias():
+    #suma los resúmenes de todos los móviles de cada categoría
+    filas = coleccion(Categoria).aggregate([
+        {'$project': {columna_pk(Categoria): 1, 'name': 1, 'moviles': 1}},
+        {'$unwind': {'path': '$moviles', 'preserveNullAndEmptyArrays': True}},
+        {'$lookup': {
+            'from': RESUMEN,
+            'localField': 'moviles',
+            'foreignField': '_id',
+            'pipeline': [{'$project': {'votos': 1, 'suma': 1}}],
+            'as': 'resumen',
+        }},
+        {'$unwind': {'path': '$resumen', 'preserveNullAndEmptyArrays': True}},
+        {'$group': {
+            '_id': '$_id',
+            'cat_id': {'$first': f'${columna_pk(Categoria)}'},
+            'nombre': {'$first': '$name'},
+            'votos': {'$sum': {'$ifNull': ['$resumen.votos', 0]}},
+            'suma': {'$sum': {'$ifNull': ['$resumen.suma', 0]}},
+        }},
+        {'$sort': {'_id': 1}},
+    ])
+    return [
+        {'cat_id': f['cat_id'], 'nombre': f['nombre'],
+         'media': round(f['suma'] / f['votos'], 1) if f['votos'] > 0 else 0, 'votos': f['votos']}
+        for f in filas
+    ]
+
+
+def valoraciones_recientes(n=5):
+    filas = coleccion(Valoracion).aggregate([
+        {'$sort': {'fecha': -1}},
+        {'$limit': n},
+        _lookup_nombre_movil('movil_id'),
+        {'$project': {
+            '_id': 0, 'user_email': 1, 'movil_id': 1, 'puntuacion': 1, 'comentario': 1, 'fecha': 1,
+            'nombre_movil': {'$ifNull': [{'$first': '$movil.name'}, 'Móvil Borrado']},
+        }},
+    ])
+    return list(filas)
@@ -0,0 +1,15 @@
+from django import template
+from django.urls import reverse
+
+from safarank import miniaturas
+
+register = template.Library()
+
+
+@register.inclusion_tag('includes/miniatura.html')
+def miniatura(movil, tam='m', clase='', estilo=''):
+    #<picture> con la miniatura WebP (y JPEG para navegadores viejos) o el placeholder local
+    urls = {}
+    if getattr(movil, 'imagen', None):
+        urls = {f: reverse('miniatura', args=[f'{movil.imagen}-{tam}.{f}']) for f in miniaturas.FORMATOS}
+    return {'movil': movil, 'urls': urls, 'lado': miniaturas.TAMANOS[tam], 'clase': clase, 'estilo': estilo}
@@ -1,3 +1,1009 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+import json
+import random
+import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.conf import settings
+from django.core.management import CommandError, call_command
+from django.db import connections
+from django.http import QueryDict
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import (actividad, agregados, alternativas, autenticacion, busqueda, cache_catalogo, clasificacion, consenso,
+               exportar, generador, gestion_catalogo, ids, importador, indice_categorias, metricas, migracion_rankings,
+               miniaturas, recomendaciones, resenas, servicio_estadisticas, tierlist)
+from .models import MovilXiaomi, Valoracion, Categoria, RankingPersonal, Usuario
+from .mongo import coleccion, columna_pk
+from .paginacion import pagina_keyset
+
+
+def _sembrar(semilla=7):
+    #base de datos pequeña pero con casos raros: categorías vacías,
+    #móviles repetidos en una categoría y votos de móviles borrados
+    rnd = random.Random(semilla)
+    ahora = timezone.now()
+
+    coleccion(MovilXiaomi).insert_many([
+        {columna_pk(MovilXiaomi): i, 'name': f'Xiaomi {i}', 'price': 100 + i, 'imgURL': ''}
+        for i in range(1, 31)
+    ])
+    coleccion(Categoria).insert_many([
+        {columna_pk(Categoria): 1, 'name': 'Gama Alta', 'description': '', 'moviles': list(range(1, 11))},
+        {columna_pk(Categoria): 2, 'name': 'Gama Media', 'description': '', 'moviles': [5, 6, 6, 20, 21, 99]},
+        {columna_pk(Categoria): 3, 'name': 'Vacía', 'description': '', 'moviles': []},
+    ])
+    coleccion(Valoracion).insert_many([
+        {
+            'user_email': f'user{rnd.randint(1, 40)}@test.com',
+            'movil_id': rnd.choice(list(range(1, 31)) + [99]),
+            'puntuacion': rnd.randint(1, 5),
+            'comentario': 'ok',
+            'fecha': ahora - timedelta(minutes=n),
+        }
+        for n in range(400)
+    ])
+    agregados.reconstruir()
+
+
+def _estadisticas_python():
+    #cálculo original de estadisticas_globales, recorriendo todo en python
+    #(con desempate por id para que el orden sea determinista)
+    valoraciones = list(Valoracion.objects.using('mongodb').all())
+    moviles = {m.id: m for m in MovilXiaomi.objects.using('mongodb').all()}
+    categorias = sorted(Categoria.objects.using('mongodb').all(), key=lambda c: c.pk)
+
+    stats_m = {}
+    for v in valoraciones:
+        if v.movil_id not in stats_m:
+            stats_m[v.movil_id] = {'votos': 0, 'suma': 0}
+        stats_m[v.movil_id]['votos'] += 1
+        stats_m[v.movil_id]['suma'] += v.puntuacion
+
+    stats_cat = []
+    for cat in categorias:
+        c_votos, c_suma = 0, 0
+        for mid in cat.moviles:
+            if mid in stats_m:
+                c_votos += stats_m[mid]['votos']
+                c_suma += stats_m[mid]['suma']
+        media = round(c_suma / c_votos, 1) if c_votos > 0 else 0
+        stats_cat.append({'cat_id': cat.pk, 'nombre': cat.name, 'media': media, 'votos': c_votos})
+
+    recientes = sorted(valoraciones, key=lambda v: v.fecha, reverse=True)[:5]
+    v_recientes = [
+        (v.user_email, v.puntuacion, moviles[v.movil_id].name if v.movil_id in moviles else "Móvil Borrado")
+        for v in recientes
+    ]
+    return stats_cat, v_recientes
+
+
+class MongoLimpioMixin:
+    #vacía antes de cada test las colecciones de mongo que usa la clase
+    #(modelos o nombres) y deja la caché del catálogo sin nada de otro test
+    databases = {'default', 'mongodb'}
+    colecciones = ()
+
+    def setUp(self):
+        super().setUp()
+        for c in self.colecciones:
+            coleccion(c).drop()
+        cache_catalogo.invalidar()
+
+
+class ServicioEstadisticasTests(MongoLimpioMixin, TestCase):
+    colecciones = (MovilXiaomi, Categoria, Valoracion, agregados.RESUMEN, indice_categorias.INDICE,
+                   clasificacion.CLASIFICACIONES)
+
+    def setUp(self):
+        super().setUp()
+        _sembrar()
+        self.cat_py, self.recientes_py = _estadisticas_python()
+
+    def test_stats_categorias(self):
+        self.assertEqual(servicio_estadisticas.stats_categorias(), self.cat_py)
+
+    def test_valoraciones_recientes(self):
+        recientes = [
+            (v['user_email'], v['puntuacion'], v['nombre_movil'])
+            for v in servicio_estadisticas.valoraciones_recientes(5)
+        ]
+        self.assertEqual(recientes, self.recientes_py)
+
+    def test_agregados_incrementales(self):
+        #un voto nuevo y una edición deben dejar el resumen igual que reconstruirlo
+        agregados.registrar_voto(3, 5)
+        coleccion(Valoracion).insert_one({'user_email': 'x@test.com', 'movil_id': 3, 'puntuacion': 5,
+                                          'comentario': '', 'fecha': timezone.now()})
+        v = coleccion(Valoracion).find_one({'movil_id': 4})
+        coleccion(Valoracion).update_one({'_id': v['_id']}, {'$set': {'puntuacion': 1}})
+        agregados.registrar_voto(4, 1, v['puntuacion'])
+
+        incremental = [agregados.resumen_movil(m) for m in (3, 4)]
+        agregados.reconstruir()
+        self.assertEqual(incremental, [agregados.resumen_movil(m) for m in (3, 4)])
+
+    def test_prior_se_guarda_la_primera_vez(self):
+        #sin reconstruir, el primer voto guarda la media global y los siguientes ya no la recalculan
+        coleccion(clasificacion.CLASIFICACIONES).drop()
+        cache_catalogo.invalidar()
+        clasificacion.actualizar_movil(3, agregados.registrar_voto(3, 5))
+        votos, suma = agregados.totales()
+        prior = coleccion(clasificacion.CLASIFICACIONES).find_one({'_id': 'prior'})
+        self.assertAlmostEqual(prior['media'], suma / votos)
+        with mock.patch.object(agregados, 'totales') as totales:
+            clasificacion.actualizar_movil(4, agregados.registrar_voto(4, 2))
+        totales.assert_not_called()
+        self.assertEqual({e['movil_id'] for e in clasificacion.top()}, {3, 4})
+
+    def test_clasificacion_con_nombres_actuales(self):
+        #el 5 queda el primero de todas sus listas
+        for _ in range(30):
+            agregados.registrar_voto(5, 5)
+        indice_categorias.reconstruir()
+        clasificacion.reconstruir()
+        #un voto que no saca a nadie de la lista no necesita los móviles de sus categorías
+        with mock.patch.object(indice_categorias, 'moviles_de') as moviles_de:
+            clasificacion.actualizar_movil(5, agregados.registrar_voto(5, 5))
+        moviles_de.assert_not_called()
+
+        coleccion(MovilXiaomi).update_one({columna_pk(MovilXiaomi): 5}, {'$set': {'name': 'Redmi Cinco'}})
+        cache_catalogo.invalidar()
+        nombres = {e['movil_id']: e['nombre'] for e in clasificacion.top()}
+        self.assertEqual(nombres[5], 'Redmi Cinco')
+        mejores = clasificacion.tops_categorias([1])[clasificacion.clave_categoria(1)]
+        self.assertIn('Redmi Cinco', [e['nombre'] for e in mejores])
+
+    def test_paginas_de_resenas(self):
+        #recorriendo las páginas salen todas, en orden y sin repetir, aunque haya fechas iguales
+        fecha = timezone.now().replace(microsecond=0)
+        coleccion(Valoracion).insert_many([
+            {'user_email': f'igual{i}@test.com', 'movil_id': 7, 'puntuacion': 3, 'comentario': '', 'fecha': fecha}
+            for i in range(5)
+        ])
+        esperado = [v.pk for v in Valoracion.objects.using('mongodb').filter(movil_id=7).order_by('-fecha', '-id')]
+
+        vistas, despues = [], None
+        while True:
+            pagina, despues = resenas.pagina(7, despues, n=3)
+            vistas += [v.pk for v in pagina]
+            if despues is None:
+                break
+            despues = resenas.texto_a_cursor(resenas.cursor_a_texto(despues))
+        self.assertEqual(vistas, esperado)
+        self.assertEqual(sum(n for _, n, _ in resenas.histograma(agregados.resumen_movil(7))) + 5, len(esperado))
+
+
+class CatalogoTests(MongoLimpioMixin, TestCase):
+    colecciones = (MovilXiaomi, Categoria, RankingPersonal)
+
+    def setUp(self):
+        super().setUp()
+        coleccion(MovilXiaomi).insert_many([
+            {columna_pk(MovilXiaomi): i, 'name': f'Xiaomi {i}', 'price': 100 + i, 'imgURL': ''}
+            for i in range(1, 4)
+        ])
+        coleccion(RankingPersonal).insert_many([
+            {columna_pk(RankingPersonal): 1, 'user_email': 'a@test.com', 'nombre': 'Mía', 'elementos': tierlist.tiers_vacias()},
+            {columna_pk(RankingPersonal): 2, 'user_email': 'b@test.com', 'nombre': 'Ajena', 'elementos': tierlist.tiers_vacias()},
+        ])
+        self.client.force_login(Usuario.objects.create_user('a@test.com', 'A', 'cliente', 'x'))
+
+    def test_catalogo_304_si_no_cambia(self):
+        respuesta = self.client.get(reverse('catalogo'))
+        self.assertEqual(respuesta.status_code, 200)
+        #el selector de listas sale una vez, no en cada tarjeta
+        self.assertContains(respuesta, 'data-ranking-id="1"', count=1)
+        self.assertNotContains(respuesta, 'Ajena')
+
+        etag = respuesta['ETag']
+        self.assertEqual(self.client.get(reverse('catalogo'), HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        cache_catalogo.invalidar()
+        self.assertEqual(self.client.get(reverse('catalogo'), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_anadir_a_ranking(self):
+        def anadir(ranking_id, movil_id):
+            return self.client.post(reverse('anadir_a_ranking'), json.dumps({'ranking_id': ranking_id, 'movil_id': movil_id}),
+                                    content_type='application/json')
+
+        self.assertTrue(anadir(1, 2).json()['anadido'])
+        self.assertFalse(anadir(1, 2).json()['anadido'])
+        self.assertEqual(anadir(2, 2).status_code, 403)
+        self.assertEqual(anadir(1, 99).status_code, 404)
+        self.assertEqual(RankingPersonal.objects.using('mongodb').get(id=1).elementos['unranked'], [2])
+
+
+class PaginacionKeysetTests(MongoLimpioMixin, TestCase):
+    colecciones = (MovilXiaomi, Categoria, RankingPersonal)
+
+    def setUp(self):
+        super().setUp()
+        #precios repetidos para que el desempate por id decida el orden
+        self.precios = {i: p for i, p in enumerate([150, 100, 100, 300, 150, 100, 200, 150, 300, 100, 250], start=1)}
+        coleccion(MovilXiaomi).insert_many([
+            {columna_pk(MovilXiaomi): i, 'name': f'Xiaomi {i}', 'price': p, 'imgURL': ''}
+            for i, p in self.precios.items()
+        ])
+        self.client.force_login(Usuario.objects.create_user('a@test.com', 'A', 'cliente', 'x'))
+
+    def _esperado(self, descendente):
+        return sorted(self.precios, key=lambda i: (self.precios[i], i), reverse=descendente)
+
+    def test_cursor_ida_y_vuelta_con_empates(self):
+        for orden, descendente in (('precio', False), ('-precio', True)):
+            criterios = busqueda.parsear(QueryDict(f'orden={orden}'))
+            campo, desc, desempate = busqueda.orden(criterios)
+            self.assertEqual((campo, desc, desempate), ('price', descendente, 'id'))
+
+            vistos, despues = [], None
+            while True:
+                filas, siguiente = pagina_keyset(MovilXiaomi.objects.using('mongodb'), campo, despues, 3, desc, desempate)
+                vistos += [m.id for m in filas]
+                if siguiente is None:
+                    break
+                despues = busqueda.texto_a_cursor(busqueda.cursor_a_texto(siguiente), criterios)
+                self.assertEqual(despues, siguiente)
+            self.assertEqual(vistos, self._esperado(descendente))
+
+    def test_cursor_no_valido_vuelve_al_principio(self):
+        criterios = busqueda.parsear(QueryDict('orden=precio'))
+        self.assertIsNone(busqueda.texto_a_cursor('abc:1', criterios))
+        self.assertIsNone(busqueda.texto_a_cursor('100', criterios))
+
+    def test_cargar_mas_recorre_el_catalogo(self):
+        vistos, url = [], '?orden=-precio&n=4'
+        while url:
+            respuesta = self.client.get(reverse('catalogo') + url + '&parcial=1')
+            vistos += [int(m) for m in re.findall(r'data-movil-id="(\d+)"', respuesta.content.decode())]
+            url = respuesta['X-Siguiente']
+        self.assertEqual(vistos, self._esperado(True))
+
+
+class ImportadorTests(MongoLimpioMixin, TestCase):
+    colecciones = (MovilXiaomi, Categoria, Valoracion, RankingPersonal, agregados.RESUMEN, indice_categorias.INDICE)
+
+    CABECERA = 'name,imgURL,price,ratings,ram,storage,camera,battery\n'
+
+    def _lineas(self, filas):
+        #generador: el importador tiene que ir leyendo, no puede pedir la longitud
+        yield self.CABECERA
+        for fila in filas:
+            yield fila + '\n'
+
+    def test_rechazos_por_fila_y_lotes(self):
+        resultado = importador.importar_csv(self._lineas([
+            'Redmi A,,10000,4.5,8,128,50,5000',
+            ',,10000,4.5,8,128,50,5000',
+            'Redmi B,,10000,4.5,ocho,128,50,5000',
+            'Redmi C,,20000,4.1,6,64,48,4500',
+            'Redmi D,,,,,,,',
+        ]), tam_lote=2)
+
+        self.assertEqual((resultado['cargados'], resultado['rechazados']), (3, 2))
+        self.assertEqual(resultado['rechazos'], [(3, 'falta el nombre'), (4, "valor no válido en 'ram': 'ocho'")])
+        moviles = list(MovilXiaomi.objects.using('mongodb').order_by('id'))
+        self.assertEqual([m.name for m in moviles], ['Redmi A', 'Redmi C', 'Redmi D'])
+        self.assertEqual(moviles[0].price, 111)
+        #ids seguidos aunque vayan en lotes distintos
+        self.assertEqual([m.id - moviles[0].id for m in moviles], [0, 1, 2])
+
+    def _catalogo_con_referencias(self):
+        #Viejo (1) y Redmi A (2), los dos en una categoría, un ranking y con una valoración
+        pk = columna_pk(MovilXiaomi)
+        coleccion(MovilXiaomi).insert_many([{pk: 1, 'name': 'Viejo', 'price': 100, 'imgURL': ''},
+                                            {pk: 2, 'name': 'Redmi A', 'price': 50, 'imgURL': ''}])
+        coleccion(Categoria).insert_one({columna_pk(Categoria): 1, 'name': 'C', 'description': '', 'moviles': [1, 2]})
+        coleccion(RankingPersonal).insert_one({columna_pk(RankingPersonal): 1, 'user_email': 'a@test.com', 'nombre': 'R',
+                                               'elementos': {**tierlist.tiers_vacias(), 'S': [1, 2]}})
+        coleccion(Valoracion).insert_many([{'user_email': 'a@test.com', 'movil_id': m, 'puntuacion': 4,
+                                            'comentario': '', 'fecha': timezone.now()} for m in (1, 2)])
+        agregados.reconstruir()
+        indice_categorias.reconstruir()
+
+    def test_reimportar_conserva_ids_y_los_que_faltan(self):
+        self._catalogo_con_referencias()
+
+        importador.importar_csv(self._lineas(['Redmi A,,20000,4.5,8,128,50,5000']))
+
+        self.assertEqual(dict(MovilXiaomi.objects.using('mongodb').values_list('name', 'id')), {'Viejo': 1, 'Redmi A': 2})
+        self.assertEqual(MovilXiaomi.objects.using('mongodb').get(id=2).price, 222)
+        self.assertEqual(RankingPersonal.objects.using('mongodb').get(id=1).elementos['S'], [1, 2])
+        self.assertEqual(Valoracion.objects.using('mongodb').count(), 2)
+
+    def test_reemplazar_borra_solo_los_que_faltan(self):
+        self._catalogo_con_referencias()
+
+        resultado = importador.importar_csv(self._lineas(['Redmi A,,20000,4.5,8,128,50,5000',
+                                                          'Redmi Nuevo,,10000,4.5,8,128,50,5000']), reemplazar=True)
+
+        moviles = {m.name: m for m in MovilXiaomi.objects.using('mongodb')}
+        self.assertEqual(set(moviles), {'Redmi A', 'Redmi Nuevo'})
+        #el que ya estaba mantiene su id y sus referencias, con los datos nuevos
+        self.assertEqual((moviles['Redmi A'].id, moviles['Redmi A'].price), (2, 222))
+        self.assertGreater(moviles['Redmi Nuevo'].id, 2)
+        self.assertEqual(Categoria.objects.using('mongodb').get(pk=1).moviles, [2])
+        self.assertEqual(indice_categorias.moviles_de(1), [2])
+        self.assertEqual(RankingPersonal.objects.using('mongodb').get(id=1).elementos['S'], [2])
+        self.assertEqual(list(Valoracion.objects.using('mongodb').values_list('movil_id', flat=True)), [2])
+        self.assertEqual(agregados.resumen_movil(1)['votos'], 0)
+        self.assertEqual(agregados.resumen_movil(2)['votos'], 1)
+        self.assertEqual(resultado['borrados'], 1)
+
+    def test_fichero_ilegible_no_borra_nada(self):
+        self._catalogo_con_referencias()
+        fichero = io.BytesIO(self.CABECERA.encode() + b'Redmi \xff,,10000,4.5,8,128,50,5000\n')
+
+        with self.assertRaises(ValueError):
+            importador.importar_csv(importador.abrir_texto(fichero), reemplazar=True)
+
+        self.assertEqual(MovilXiaomi.objects.using('mongodb').count(), 2)
+        self.assertEqual(RankingPersonal.objects.using('mongodb').get(id=1).elementos['S'], [1, 2])
+
+
+class TierListTests(MongoLimpioMixin, TestCase):
+    colecciones = (RankingPersonal, consenso.CONSENSO)
+
+    def setUp(self):
+        super().setUp()
+        coleccion(RankingPersonal).insert_one({columna_pk(RankingPersonal): 1, 'user_email': 'a@test.com', 'nombre': 'R',
+                                               'elementos': {**tierlist.tiers_vacias(), 'S': [1, 2, 3], 'B': [4]}})
+        self.client.force_login(Usuario.objects.create_user('a@test.com', 'A', 'cliente', 'x'))
+
+    def _elementos(self):
+        return RankingPersonal.objects.using('mongodb').get(id=1).elementos
+
+    def _mover(self, **mover):
+        return self.client.post(reverse('guardar_orden_ranking'), json.dumps({'ranking_id': 1, 'mover': mover}),
+                                content_type='application/json')
+
+    def test_mover_sin_cambios_y_reintentos(self):
+        #dejarlo donde estaba no es un conflicto
+        self.assertTrue(tierlist.mover(1, 'a@test.com', 2, 'S', 'S', 3))
+        self.assertTrue(tierlist.mover(1, 'a@test.com', 2, 'S', 'A'))
+        #la misma petición otra vez (u otra pestaña con el ranking viejo): ya no está en S
+        self.assertFalse(tierlist.mover(1, 'a@test.com', 2, 'S', 'A'))
+        #un vecino que no está en la tier lo deja el último
+        self.assertTrue(tierlist.mover(1, 'a@test.com', 1, 'S', 'B', 99))
+        self.assertEqual(self._elementos(), {**tierlist.tiers_vacias(), 'S': [3], 'A': [2], 'B': [4, 1]})
+        #un ranking ajeno no se toca
+        self.assertFalse(tierlist.mover(1, 'b@test.com', 3, 'S', 'D'))
+
+    def test_mover_delante_de_un_vecino(self):
+        #el 99 ya no existe y la página no lo pinta: la posición va por vecino, no por índice
+        coleccion(RankingPersonal).update_one({columna_pk(RankingPersonal): 1}, {'$set': {'elementos.S': [99, 1, 2, 3]}})
+        self.assertTrue(tierlist.mover(1, 'a@test.com', 3, 'S', 'S', 1))
+        self.assertEqual(self._elementos()['S'], [99, 3, 1, 2])
+        self.assertTrue(tierlist.mover(1, 'a@test.com', 4, 'B', 'S', 2))
+        self.assertEqual(self._elementos()['S'], [99, 3, 1, 4, 2])
+
+    def test_anadir_una_sola_vez(self):
+        self.assertFalse(tierlist.anadir(1, 'a@test.com', 4))
+        self.assertTrue(tierlist.anadir(1, 'a@test.com', 9))
+        self.assertFalse(tierlist.anadir(1, 'a@test.com', 9))
+        self.assertFalse(tierlist.anadir(1, 'b@test.com', 10))
+        self.assertEqual(self._elementos()['unranked'], [9])
+
+    def test_guardar_orden_valida_la_peticion(self):
+        self.assertEqual(self._mover(movil_id=1, desde='S', hasta='S', antes_de=2).status_code, 200)
+        self.assertEqual(self._mover(movil_id=1, desde='S', hasta='Z', antes_de=None).status_code, 400)
+        self.assertEqual(self._mover(movil_id=1, desde='S', hasta='A', antes_de=1).status_code, 400)
+        self.assertEqual(self._mover(movil_id=1, desde='S', hasta='A', antes_de='x').status_code, 400)
+        self.assertEqual(self._mover(desde='S', hasta='A').status_code, 400)
+        self.assertEqual(self._mover(movil_id=4, desde='S', hasta='A', antes_de=None).status_code, 409)
+        respuesta = self.client.post(reverse('guardar_orden_ranking'), json.dumps({'ranking_id': 1, 'tiers': {'Z': [1]}}),
+                                     content_type='application/json')
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertEqual(self._elementos()['S'], [1, 2, 3])
+
+
+class CacheCatalogoTests(MongoLimpioMixin, TestCase):
+    colecciones = (MovilXiaomi,)
+
+    def setUp(self):
+        super().setUp()
+        coleccion(MovilXiaomi).insert_many([
+            {columna_pk(MovilXiaomi): i, 'name': f'Xiaomi {i}', 'price': 100, 'imgURL': ''} for i in (1, 2)
+        ])
+
+    def test_invalidar_cambia_de_version(self):
+        self.assertEqual(cache_catalogo.movil(1).name, 'Xiaomi 1')
+        coleccion(MovilXiaomi).update_one({columna_pk(MovilXiaomi): 1}, {'$set': {'name': 'Cambiado'}})
+        #sin invalidar se sigue sirviendo lo cacheado
+        self.assertEqual(cache_catalogo.movil(1).name, 'Xiaomi 1')
+        cache_catalogo.invalidar()
+        self.assertEqual(cache_catalogo.movil(1).name, 'Cambiado')
+
+    def test_obtener_calcula_una_vez_por_version(self):
+        llamadas = []
+        calcular = lambda: llamadas.append(1) or len(llamadas)
+        self.assertEqual([cache_catalogo.obtener('prueba', calcular) for _ in range(3)], [1, 1, 1])
+        cache_catalogo.invalidar()
+        self.assertEqual(cache_catalogo.obtener('prueba', calcular), 2)
+
+    def test_version_perdida_no_repite_una_anterior(self):
+        antes = cache_catalogo.version()
+        cache_catalogo._cache().delete(cache_catalogo.CLAVE_VERSION)
+        self.assertNotEqual(cache_catalogo.version(), antes)
+
+    def test_moviles_por_id_solo_pide_lo_que_falta(self):
+        cache_catalogo.movil(1)
+        antes = cache_catalogo.contadores()
+        #el 99 no existe: se cachea que no está y no sale en el resultado
+        self.assertEqual(sorted(cache_catalogo.moviles_por_id([1, 2, 99])), [1, 2])
+        despues = cache_catalogo.contadores()
+        self.assertEqual((despues['aciertos'] - antes['aciertos'], despues['fallos'] - antes['fallos']), (1, 2))
+        self.assertEqual(sorted(cache_catalogo.moviles_por_id([1, 2, 99])), [1, 2])
+        self.assertEqual(cache_catalogo.contadores()['fallos'], despues['fallos'])
+
+
+class IndiceCategoriasTests(MongoLimpioMixin, TestCase):
+    colecciones = (MovilXiaomi, Categoria, indice_categorias.INDICE)
+
+    def setUp(self):
+        super().setUp()
+        coleccion(MovilXiaomi).insert_many([
+            {columna_pk(MovilXiaomi): i, 'name': f'Xiaomi {i}', 'price': 100, 'imgURL': ''} for i in range(1, 9)
+        ])
+        coleccion(Categoria).insert_many([
+            {columna_pk(Categoria): 1, 'name': 'Uno', 'description': '', 'moviles': [7, 1, 3, 5, 8]},
+            {columna_pk(Categoria): 2, 'name': 'Dos', 'description': '', 'moviles': [3, 3, 4]},
+        ])
+        indice_categorias.reconstruir()
+
+    def test_reconstruir_y_consultas(self):
+        self.assertEqual(indice_categorias.moviles_de(1), [1, 3, 5, 7, 8])
+        self.assertEqual(indice_categorias.moviles_de(1, despues=3, limite=2), [5, 7])
+        self.assertEqual(sorted(indice_categorias.categorias_de(3)), [1, 2])
+        self.assertEqual(Categoria.objects.using('mongodb').get(pk=2).num_moviles, 2)
+
+    def test_actualizar_solo_la_diferencia(self):
+        indice_categorias.actualizar_categoria(2, [3, 3, 4], [4, 6])
+        self.assertEqual(indice_categorias.moviles_de(2), [4, 6])
+        self.assertEqual(indice_categorias.categorias_de(3), [1])
+        indice_categorias.quitar_categoria(1)
+        self.assertEqual(indice_categorias.moviles_de(1), [])
+        self.assertEqual(indice_categorias.categorias_de(3), [])
+
+    def test_pagina_de_categoria_completa(self):
+        self.client.force_login(Usuario.objects.create_user('a@test.com', 'A', 'cliente', 'x'))
+        vistos, url = [], '?cat=1&n=2'
+        while url:
+            respuesta = self.client.get(reverse('catalogo') + url + '&parcial=1')
+            vistos += [int(m) for m in re.findall(r'data-movil-id="(\d+)"', respuesta.content.decode())]
+            url = respuesta['X-Siguiente']
+        self.assertEqual(vistos, [1, 3, 5, 7, 8])
+
+    def test_pagina_de_categoria_con_borrados(self):
+        #3 y 5 siguen en el índice pero ya no existen: la primera página sigue teniendo 2 y "cargar más"
+        coleccion(MovilXiaomi).delete_many({columna_pk(MovilXiaomi): {'$in': [3, 5]}})
+        self.client.force_login(Usuario.objects.create_user('a@test.com', 'A', 'cliente', 'x'))
+        respuesta = self.client.get(reverse('catalogo') + '?cat=1&n=2&parcial=1')
+        self.assertEqual(re.findall(r'data-movil-id="(\d+)"', respuesta.content.decode()), ['1', '7'])
+        self.assertTrue(respuesta['X-Siguiente'])
+
+    def test_categoria_no_valida(self):
+        self.client.force_login(Usuario.objects.create_user('a@test.com', 'A', 'cliente', 'x'))
+        self.assertEqual(self.client.get(reverse('catalogo'), {'cat': 'abc'}).status_code, 200)
+
+
+class BusquedaTests(MongoLimpioMixin, TestCase):
+    colecciones = (MovilXiaomi,)
+
+    def setUp(self):
+        super().setUp()
+        filas = [(1, 'Redmi Note', 120, 8, 128), (2, 'Redmi Pro', 300, 8, 256), (3, 'Poco F', 450, 12, 256),
+                 (4, 'Xiaomi 14', 950, 12, 512), (5, 'Redmi A', 90, 4, 64)]
+        coleccion(MovilXiaomi).insert_many([
+            {columna_pk(MovilXiaomi): i, 'name': n, 'price': p, 'ram': r, 'storage': a, 'ratings': 4.0, 'imgURL': ''}
+            for i, n, p, r, a in filas
+        ])
+
+    def test_filtros_y_facetas_coinciden(self):
+        criterios = busqueda.parsear(QueryDict('q=redmi&precio_max=310&ram=8&ram=4&ram=x&bateria_min=mucha&orden=raro'))
+        self.assertEqual(set(criterios['rangos']), {'precio_max'})
+        self.assertEqual(criterios['orden'], '')
+        #un valor no válido en una lista descarta esa lista entera
+        self.assertEqual(criterios['valores'], {})
+
+        criterios = busqueda.parsear(QueryDict('q=redmi&precio_max=310&ram=8&ram=4'))
+        ids = sorted(m.id for m in busqueda.filtrar(MovilXiaomi.objects.using('mongodb'), criterios))
+        self.assertEqual(ids, [1, 2, 5])
+        facetas = busqueda.facetas(criterios)
+        self.assertEqual(facetas['total'], 3)
+        self.assertEqual(facetas['ram'], [(4, 1), (8, 2)])
+        self.assertEqual(facetas['precio'], [(0, 2), (250, 1)])
+        self.assertEqual(busqueda.facetas(criterios, ids=[1, 3])['total'], 1)
+
+    def test_faceta_ignora_su_propio_filtro(self):
+        criterios = busqueda.parsear(QueryDict('ram=8&precio_max=310'))
+        facetas = busqueda.facetas(criterios)
+        self.assertEqual(facetas['total'], 2)
+        #las otras RAM siguen saliendo, pero con el filtro de precio aplicado
+        self.assertEqual(facetas['ram'], [(4, 1), (8, 2)])
+        #y los precios se cuentan solo entre los de 8 GB
+        self.assertEqual(facetas['precio'], [(0, 1), (250, 1)])
+
+    def test_texto_literal(self):
+        criterios = busqueda.parsear(QueryDict('q=(.*'))
+        self.assertFalse(busqueda.filtrar(MovilXiaomi.objects.using('mongodb'), criterios).exists())
+        self.assertEqual(busqueda.facetas(criterios)['total'], 0)
+        self.client.force_login(Usuario.objects.create_user('a@test.com', 'A', 'cliente', 'x'))
+        self.assertEqual(self.client.get(reverse('catalogo'), {'q': '('}).status_code, 200)
+
+
+class IdsTests(MongoLimpioMixin, TestCase):
+    colecciones = (RankingPersonal,)
+
+    def setUp(self):
+        super().setUp()
+        nombre = RankingPersonal._meta.db_table
+        coleccion(ids.CONTADORES).delete_one({'_id': nombre})
+        ids._sembrados.discard(nombre)
+        ids._bloques.pop(nombre, None)
+        coleccion(RankingPersonal).insert_one({columna_pk(RankingPersonal): 41, 'user_email': 'a@test.com',
+                                               'nombre': 'R', 'elementos': tierlist.tiers_vacias()})
+
+    def _en_hilos(self, funcion, veces):
+        def una(_):
+            try:
+                return funcion()
+            finally:
+                #cada hilo abre su propia conexión de django
+                connections['mongodb'].close()
+
+        with ThreadPoolExecutor(8) as pool:
+            return list(pool.map(una, range(veces)))
+
+    def test_empieza_por_encima_del_maximo(self):
+        self.assertEqual(ids.reservar(RankingPersonal, 3), (42, 44))
+        self.assertEqual(ids.siguiente_id(RankingPersonal), 45)
+
+    def test_sin_repetidos_en_paralelo(self):
+        bloques = self._en_hilos(lambda: ids.reservar(RankingPersonal, 5), 40)
+        repartidos = [i for primero, ultimo in bloques for i in range(primero, ultimo + 1)]
+        self.assertEqual(sorted(repartidos), list(range(42, 242)))
+
+        sueltos = self._en_hilos(lambda: ids.siguiente_id(RankingPersonal), 100)
+        self.assertEqual(len(set(sueltos)), 100)
+        self.assertGreater(min(sueltos), 241)
+
+
+class VistasAsyncTests(MongoLimpioMixin, TestCase):
+    colecciones = (MovilXiaomi, Valoracion, RankingPersonal, agregados.RESUMEN)
+
+    def setUp(self):
+        super().setUp()
+        coleccion(MovilXiaomi).insert_many([
+            {columna_pk(MovilXiaomi): i, 'name': f'Xiaomi {i}', 'price': 100 + i, 'imgURL': ''} for i in (1, 2, 3)
+        ])
+        #el 99 ya no existe (p.ej. tras reimportar el CSV): se salta sin error
+        coleccion(RankingPersonal).insert_many([
+            {columna_pk(RankingPersonal): 1, 'user_email': 'a@test.com', 'nombre': 'Mía',
+             'elementos': {**tierlist.tiers_vacias(), 'S': [2, 99, 1], 'unranked': [3]}},
+            {columna_pk(RankingPersonal): 2, 'user_email': 'b@test.com', 'nombre': 'Ajena',
+             'elementos': tierlist.tiers_vacias()},
+        ])
+        self.client.force_login(Usuario.objects.create_user('a@test.com', 'A', 'cliente', 'x'))
+
+    def _paginas(self):
+        #las mismas peticiones por las vistas async y por las sync
+        resultados = []
+        for urlconf in ('safarank.urls_async', 'safarank.urls_sync'):
+            with self.settings(ROOT_URLCONF=urlconf):
+                ranking = self.client.get(reverse('ver_ranking', args=[1]))
+                resultados.append({
+                    'ranking': (ranking.status_code, re.findall(r'<p title="([^"]+)">', ranking.content.decode())),
+                    'ajeno': self.client.get(reverse('ver_ranking', args=[2])).url,
+                    'detalle': self.client.get(reverse('detalle_movil', args=[2])).status_code,
+                    'no_existe': self.client.get(reverse('detalle_movil', args=[999])).url,
+                })
+        return resultados
+
+    def test_async_igual_que_sync(self):
+        asincrono, sincrono = self._paginas()
+        self.assertEqual(asincrono, sincrono)
+        self.assertEqual(asincrono['ranking'], (200, ['Xiaomi 2', 'Xiaomi 1', 'Xiaomi 3']))
+        self.assertEqual((asincrono['ajeno'], asincrono['no_existe']), (reverse('dashboard'), reverse('catalogo')))
+        self.assertEqual(asincrono['detalle'], 200)
+
+
+class MetricasTests(MongoLimpioMixin, TestCase):
+    colecciones = (MovilXiaomi, Categoria, RankingPersonal)
+
+    def setUp(self):
+        super().setUp()
+        coleccion(MovilXiaomi).insert_one({columna_pk(MovilXiaomi): 1, 'name': 'Xiaomi 1', 'price': 100, 'imgURL': ''})
+        coleccion(RankingPersonal).insert_one({columna_pk(RankingPersonal): 1, 'user_email': 'a@test.com',
+                                               'nombre': 'R', 'elementos': {**tierlist.tiers_vacias(), 'S': [1]}})
+        self.client.force_login(Usuario.objects.create_user('a@test.com', 'A', 'cliente', 'x'))
+        metricas._muestras.clear()
+
+    def test_cuenta_por_vista(self):
+        self.client.get(reverse('catalogo'))
+        self.client.get(reverse('catalogo'))
+        self.client.get(reverse('ver_ranking', args=[1]))
+        self.client.get('/no-existe/')
+
+        vistas = {v['vista']: v for v in metricas.resumen()}
+        #las urls sin nombre (404) no se apuntan
+        self.assertEqual(set(vistas), {'catalogo', 'ver_ranking'})
+        self.assertEqual((vistas['catalogo']['peticiones'], vistas['ver_ranking']['peticiones']), (2, 1))
+        self.assertGreater(vistas['catalogo']['mongo_consultas'], 0)
+        self.assertGreater(vistas['catalogo']['plantillas_ms'], 0)
+        self.assertEqual(vistas['catalogo']['histograma']['total'], 2)
+
+    def test_aviso_si_pasa_del_presupuesto(self):
+        with self.settings(SAFARANK_PRESUPUESTO_CONSULTAS=0), self.assertLogs('safarank.metricas', 'WARNING') as logs:
+            self.client.get(reverse('catalogo'))
+        self.assertIn("'catalogo'", logs.output[0])
+
+
+class GeneradorTests(MongoLimpioMixin, TestCase):
+    colecciones = (MovilXiaomi, Categoria, Valoracion, RankingPersonal)
+    ESCALA = {'usuarios': 20, 'moviles': 40, 'categorias': 3, 'valoraciones': 60, 'rankings': 10}
+
+    def _generar(self, semilla, hilos):
+        #bloques pequeños para que haya varios y se repartan entre los hilos
+        with mock.patch.object(generador, 'USUARIOS_POR_BLOQUE', 7), mock.patch.object(generador, 'RANKINGS_POR_BLOQUE', 4):
+            creados = generador.generar(self.ESCALA, semilla, hilos=hilos)
+        pk = columna_pk(MovilXiaomi)
+        return creados, {
+            'moviles': list(coleccion(MovilXiaomi).find({}, {'_id': 0}).sort(pk, 1)),
+            'categorias': list(coleccion(Categoria).find({}, {'_id': 0}).sort(columna_pk(Categoria), 1)),
+            'valoraciones': sorted((v['user_email'], v['movil_id'], v['puntuacion'], v['fecha'])
+                                   for v in coleccion(Valoracion).find({}, {'_id': 0})),
+            'rankings': [(r[columna_pk(RankingPersonal)], r['user_email'], r['elementos'], r['fecha_creacion'])
+                         for r in coleccion(RankingPersonal).find({}).sort(columna_pk(RankingPersonal), 1)],
+        }
+
+    def test_misma_semilla_mismos_datos(self):
+        creados, datos = self._generar(3, hilos=1)
+        self.assertEqual(self._generar(3, hilos=3), (creados, datos))
+        self.assertNotEqual(self._generar(4, hilos=1)[1], datos)
+
+        self.assertEqual(len(datos['moviles']), 40)
+        self.assertEqual(creados['valoraciones'], len(datos['valoraciones']))
+        #nadie valora dos veces el mismo móvil
+        self.assertEqual(len({(u, m) for u, m, *_ in datos['valoraciones']}), len(datos['valoraciones']))
+        #los primeros usuarios tienen ranking (lo necesita el benchmark)
+        self.assertEqual(datos['rankings'][0][1], generador.email_usuario(1))
+
+    def test_benchmark_solo_contra_base_dedicada(self):
+        coleccion(MovilXiaomi).insert_one({columna_pk(MovilXiaomi): 1, 'name': 'No tocar', 'price': 100, 'imgURL': ''})
+        with self.assertRaisesMessage(CommandError, generador.SUFIJO_BENCH):
+            call_command('benchmark', '--sembrar', '--noinput')
+        self.assertEqual(coleccion(MovilXiaomi).count_documents({}), 1)
+
+
+class MiniaturasTests(MongoLimpioMixin, TestCase):
+    colecciones = (MovilXiaomi, miniaturas.IMAGENES)
+    URL = 'https://ejemplo.test/fotos/redmi.png'
+
+    def setUp(self):
+        super().setUp()
+        temporal = tempfile.TemporaryDirectory()
+        self.addCleanup(temporal.cleanup)
+        self.dir_imagenes = Path(temporal.name) / 'originales'
+        self.dir_imagenes.mkdir()
+        Image.new('RGBA', (800, 400), (255, 0, 0, 128)).save(self.dir_imagenes / 'redmi.png')
+        ajustes = self.settings(SAFARANK_MINIATURAS_DIR=Path(temporal.name) / 'miniaturas')
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        coleccion(MovilXiaomi).insert_many([
+            {columna_pk(MovilXiaomi): i, 'name': f'Xiaomi {i}', 'price': 100, 'imgURL': self.URL, 'imagen': None}
+            for i in (1, 2)
+        ])
+
+    def test_genera_todos_los_tamanos_una_vez(self):
+        hash_imagen = miniaturas.procesar_url(self.URL, self.dir_imagenes)
+        for tam, lado in miniaturas.TAMANOS.items():
+            for formato in miniaturas.FORMATOS:
+                with Image.open(miniaturas.ruta(hash_imagen, tam, formato)) as imagen:
+                    self.assertEqual(imagen.size, (lado, lado // 2))
+        #la segunda vez ya no se lee la imagen
+        with mock.patch.object(miniaturas, '_leer') as leer:
+            self.assertEqual(miniaturas.procesar_url(self.URL), hash_imagen)
+        leer.assert_not_called()
+        self.assertEqual(miniaturas.hashes_conocidos([self.URL, 'https://otra.test/x.png']), {self.URL: hash_imagen})
+
+    def test_pendientes_y_vista(self):
+        self.assertEqual(miniaturas.procesar_pendientes(self.dir_imagenes, hilos=2), (1, []))
+        hashes = {m.imagen for m in MovilXiaomi.objects.using('mongodb').all()}
+        self.assertEqual(len(hashes), 1)
+
+        self.client.force_login(Usuario.objects.create_user('a@test.com', 'A', 'cliente', 'x'))
+        respuesta = self.client.get(reverse('miniatura', args=[f'{hashes.pop()}-m.webp']))
+        self.assertEqual((respuesta.status_code, respuesta['Content-Type']), (200, 'image/webp'))
+        self.assertIn('immutable', respuesta['Cache-Control'])
+        self.assertEqual(self.client.get(reverse('miniatura', args=['no-es-un-hash-m.webp'])).status_code, 404)
+
+    def test_admin_descarga_en_segundo_plano(self):
+        admin = Usuario.objects.create_user('admin@test.com', 'Admin', 'admin', 'x')
+        self.client.force_login(admin)
+        datos = (self.dir_imagenes / 'redmi.png').read_bytes()
+        formulario = {'name': 'Xiaomi 1', 'price': '100', 'ram': '8', 'storage': '128', 'battery': '5000'}
+
+        with mock.patch.object(miniaturas, 'procesar_en_segundo_plano') as segundo_plano:
+            #misma URL: no se vuelve a procesar
+            self.client.post(reverse('editar_movil', args=[1]), {**formulario, 'imgURL': self.URL})
+            segundo_plano.assert_not_called()
+            self.client.post(reverse('editar_movil', args=[1]), {**formulario, 'imgURL': 'https://ejemplo.test/nueva.png'})
+            segundo_plano.assert_called_once_with(1, 'https://ejemplo.test/nueva.png')
+
+        #la tarea apunta el hash en el móvil cuando acaba; el catálogo se invalida una vez, al vaciarse la cola
+        version = cache_catalogo.version_compartida()
+        encoladas = threading.Event()
+        with mock.patch.object(miniaturas, '_leer', side_effect=lambda *args: encoladas.wait() and datos):
+            tareas = [miniaturas.procesar_en_segundo_plano(1, 'https://ejemplo.test/nueva.png') for _ in range(3)]
+            encoladas.set()
+            for tarea in tareas:
+                tarea.result()
+        self.assertTrue(MovilXiaomi.objects.using('mongodb').get(id=1).imagen)
+        self.assertTrue(cache_catalogo.movil(1).imagen)
+        self.assertEqual(cache_catalogo.version_compartida(), version + 1)
+
+
+class UsuarioCacheadoTests(TestCase):
+
+    def test_get_user_sin_sqlite_e_invalidacion(self):
+        #con una caché compartida (en producción Redis; aquí basta LocMem)
+        compartida = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'usuarios-test'}
+        with self.settings(CACHES={**settings.CACHES, 'sesiones': compartida}, SAFARANK_CACHE_USUARIOS='sesiones'):
+            usuario = Usuario.objects.create_user('c@test.com', 'C', 'cliente', 'x')
+            backend = autenticacion.BackendCacheado()
+            backend.get_user(usuario.pk)
+            with self.assertNumQueries(0):
+                self.assertEqual(backend.get_user(usuario.pk).rol, 'cliente')
+
+            usuario.rol = 'admin'
+            usuario.save()
+            self.assertEqual(backend.get_user(usuario.pk).rol, 'admin')
+
+    def test_sin_cache_compartida_no_se_cachea(self):
+        with self.settings(SAFARANK_CACHE_USUARIOS=None):
+            usuario = Usuario.objects.create_user('d@test.com', 'D', 'cliente', 'x')
+            backend = autenticacion.BackendCacheado()
+            backend.get_user(usuario.pk)
+            #otro proceso cambia el rol sin pasar por las señales de este
+            Usuario.objects.filter(pk=usuario.pk).update(rol='admin')
+            self.assertEqual(backend.get_user(usuario.pk).rol, 'admin')
+
+
+class ActividadUsuariosTests(MongoLimpioMixin, TestCase):
+    colecciones = (Valoracion, RankingPersonal, actividad.ACTIVIDAD)
+
+    def setUp(self):
+        super().setUp()
+        coleccion(actividad.CONTADORES).delete_one({'_id': actividad.ACTIVIDAD})
+
+    def test_incremental_igual_que_reconstruir(self):
+        #u1 vota y crea un ranking, u2 solo vota, u3 crea un ranking y lo borra
+        for email, movil_id in (('u1@test.com', 1), ('u1@test.com', 2), ('u2@test.com', 1)):
+            coleccion(Valoracion).insert_one({'user_email': email, 'movil_id': movil_id, 'puntuacion': 3,
+                                              'comentario': '', 'fecha': timezone.now()})
+            actividad.registrar_valoracion(email)
+        coleccion(RankingPersonal).insert_one({columna_pk(RankingPersonal): 1, 'user_email': 'u1@test.com',
+                                               'nombre': 'R', 'elementos': tierlist.tiers_vacias()})
+        actividad.registrar_ranking('u1@test.com')
+        actividad.registrar_ranking('u3@test.com')
+        actividad.registrar_ranking('u3@test.com', -1)
+
+        esperado = {'con_valoraciones': 2, 'con_rankings': 1, 'con_actividad': 2}
+        self.assertEqual(actividad.totales(), esperado)
+        self.assertEqual(actividad.de_usuarios(['u1@test.com'])['u1@test.com'], {'valoraciones': 2, 'rankings': 1})
+        actividad.reconstruir()
+        self.assertEqual(actividad.totales(), esperado)
+
+
+class ExportarTests(MongoLimpioMixin, TestCase):
+    colecciones = (MovilXiaomi, Categoria, Valoracion, agregados.RESUMEN)
+
+    def setUp(self):
+        super().setUp()
+        _sembrar()
+
+    def _bytes(self, *args, **kwargs):
+        trozos, _, _ = exportar.exportar(*args, **kwargs)
+        return b''.join(trozos)
+
+    def test_csv_y_ndjson_con_filtros(self):
+        #todas las valoraciones sembradas son de las últimas horas
+        hoy = (timezone.localdate() - timedelta(days=1)).isoformat()
+        esperado = Valoracion.objects.using('mongodb').filter(movil_id=3).count()
+
+        filas = list(csv.DictReader(self._bytes('valoraciones', 'csv', movil=3, desde=hoy).decode().splitlines()))
+        self.assertEqual(len(filas), esperado)
+        self.assertTrue(all(f['movil_id'] == '3' for f in filas))
+
+        lineas = gzip.decompress(self._bytes('valoraciones', 'ndjson', True, movil=3, desde=hoy)).decode().splitlines()
+        self.assertEqual([json.loads(l)['movil_id'] for l in lineas], [3] * esperado)
+
+    def test_filtro_no_valido(self):
+        with self.assertRaises(ValueError):
+            exportar.exportar('moviles', 'csv', desde='2024-01-01')
+        with self.assertRaises(ValueError):
+            exportar.exportar('usuarios', 'csv')
+
+
+class RecomendacionesTests(SimpleTestCase):
+
+    def test_vecinos_coseno(self):
+        #10 y 20 los valoran igual los mismos tres usuarios; 30 solo lo comparte uno.
+        #El voto repetido de 'c' a 30 cuenta solo el último
+        usuarios = np.array(['a', 'a', 'b', 'b', 'c', 'c', 'c', 'c'], dtype=object)
+        moviles = np.array([10, 20, 10, 20, 10, 20, 30, 30])
+        puntos = np.array([5, 5, 4, 4, 2, 2, 1, 5], dtype=np.float32)
+        m, ids_moviles = recomendaciones.matriz(usuarios, moviles, puntos)
+        self.assertEqual(m.shape, (3, 3))
+        self.assertEqual(m[2, 2], 5)
+
+        docs = {d['_id']: d['vecinos'] for d in recomendaciones.calcular(m, ids_moviles, n=5)}
+        self.assertEqual([v['movil_id'] for v in docs[10]], [20, 30])
+        self.assertAlmostEqual(docs[10][0]['similitud'], 3 / 8, places=4)
+        self.assertNotIn(10, [v['movil_id'] for v in docs[10]])
+
+
+class AlternativasTests(SimpleTestCase):
+
+    def test_buscar_con_condiciones(self):
+        #mismo resultado que calcular todas las distancias a mano
+        rnd = np.random.default_rng(3)
+        valores = np.column_stack([rnd.uniform(100, 1000, 500), rnd.choice([4, 6, 8, 12], 500)] +
+                                  [rnd.uniform(0, 100, 500) for _ in alternativas.CAMPOS[2:]])
+        ids = np.arange(1, 501)
+        datos = alternativas._Matriz(0, ids, valores)
+        z = (valores - valores.mean(axis=0)) / valores.std(axis=0)
+
+        for kwargs, validos in (({}, np.ones(500, dtype=bool)),
+                                ({'precio_max': 400, 'ram_min': 8}, (valores[:, 0] <= 400) & (valores[:, 1] >= 8)),
+                                ({'mas_barato': True}, valores[:, 0] < valores[9, 0])):
+            distancia = ((z - z[9]) ** 2).sum(axis=1)
+            distancia[~validos] = np.inf
+            distancia[9] = np.inf
+            esperado = [int(ids[i]) for i in np.argsort(distancia)[:5] if np.isfinite(distancia[i])]
+            self.assertEqual(alternativas.buscar(10, 5, datos=datos, **kwargs), esperado)
+
+
+class MatrizAlternativasTests(MongoLimpioMixin, TestCase):
+    colecciones = (MovilXiaomi,)
+
+    def setUp(self):
+        super().setUp()
+        coleccion(MovilXiaomi).insert_many([
+            {columna_pk(MovilXiaomi): i, 'name': f'Xiaomi {i}', 'price': 100 * i, 'imgURL': ''} for i in (1, 2, 3)
+        ])
+        alternativas._datos, alternativas._comprobado = None, 0.0
+        self.addCleanup(setattr, alternativas, '_datos', None)
+
+    def _esperar(self):
+        #el hilo de fondo es uno solo: cuando termina esta tarea ya ha terminado la anterior
+        alternativas._segundo_plano.submit(lambda: None).result()
+
+    def test_se_rehace_en_segundo_plano(self):
+        #la primera vez no se espera a mongo: vacía hasta que esté lista
+        self.assertEqual(len(alternativas.matriz().ids), 0)
+        self._esperar()
+        self.assertEqual(sorted(alternativas.matriz().ids), [1, 2, 3])
+
+        #otro proceso invalida: se sigue sirviendo la vieja hasta que está la nueva
+        coleccion(MovilXiaomi).insert_one({columna_pk(MovilXiaomi): 4, 'name': 'Xiaomi 4', 'price': 50, 'imgURL': ''})
+        cache_catalogo.invalidar()
+        alternativas._comprobado = 0.0
+        self.assertEqual(len(alternativas.matriz().ids), 3)
+        self._esperar()
+        self.assertEqual(alternativas.matriz().version, cache_catalogo.version_compartida())
+        self.assertEqual(len(alternativas.matriz().ids), 4)
+
+
+class ConsensoTests(MongoLimpioMixin, TestCase):
+    colecciones = (RankingPersonal, consenso.CONSENSO)
+
+    def setUp(self):
+        super().setUp()
+        coleccion(RankingPersonal).insert_many([
+            {columna_pk(RankingPersonal): i, 'user_email': f'u{i}@test.com', 'nombre': 'R', 'elementos': tierlist.tiers_vacias()}
+            for i in (1, 2, 3)
+        ])
+
+    def _contadores(self):
+        return {d['_id']: d for d in coleccion(consenso.CONSENSO).find({'total': {'$gt': 0}})}
+
+    def test_incremental_igual_que_reconstruir(self):
+        tierlist.guardar_orden(1, 'u1@test.com', {'S': [1, 2], 'B': [3]})
+        tierlist.guardar_orden(2, 'u2@test.com', {'S': [1], 'A': [2], 'unranked': [3]})
+        tierlist.guardar_orden(3, 'u3@test.com', {'D': [1, 3]})
+        tierlist.mover(1, 'u1@test.com', 2, 'S', 'C')
+        tierlist.quitar(2, 'u2@test.com', 1)
+        tierlist.borrar(3, 'u3@test.com')
+        #un ranking ajeno no se toca ni cuenta
+        self.assertFalse(tierlist.borrar(1, 'u2@test.com'))
+
+        incremental = self._contadores()
+        self.assertEqual({m: d['tier'] for m, d in incremental.items()}, {1: 'S', 2: 'B', 3: 'B'})
+        consenso.reconstruir()
+        self.assertEqual(self._contadores(), incremental)
+
+
+class BorradoEnCascadaTests(MongoLimpioMixin, TestCase):
+    colecciones = (MovilXiaomi, Categoria, Valoracion, RankingPersonal, agregados.RESUMEN, consenso.CONSENSO)
+
+    def setUp(self):
+        super().setUp()
+        _sembrar()
+        coleccion(RankingPersonal).insert_many([
+            {columna_pk(RankingPersonal): 1, 'user_email': 'a@test.com', 'nombre': 'Nueva',
+             'elementos': {**tierlist.tiers_vacias(), 'S': [5, 7], 'unranked': [6]}},
+            {columna_pk(RankingPersonal): 2, 'user_email': 'b@test.com', 'nombre': 'Otra',
+             'elementos': {**tierlist.tiers_vacias(), 'A': [5], 'unranked': [6, 8]}},
+        ])
+        consenso.reconstruir()
+
+    def test_borrar_moviles_limpia_referencias(self):
+        self.assertEqual(gestion_catalogo.borrar_moviles([5, 6]), 2)
+
+        rankings = {r.id: r.elementos for r in RankingPersonal.objects.using('mongodb').all()}
+        self.assertEqual(rankings[1]['S'], [7])
+        self.assertEqual(rankings[1]['unranked'], [])
+        self.assertEqual((rankings[2]['A'], rankings[2]['unranked']), ([], [8]))
+        cat = Categoria.objects.using('mongodb').get(pk=2)
+        self.assertEqual((cat.moviles, cat.num_moviles), ([20, 21, 99], 3))
+        self.assertFalse(Valoracion.objects.using('mongodb').filter(movil_id__in=[5, 6]).exists())
+        self.assertEqual(agregados.resumen_movil(5)['votos'], 0)
+        self.assertIsNone(coleccion(consenso.CONSENSO).find_one({'_id': 5}))
+        #solo queda el 99, que ya estaba borrado antes de empezar
+        self.assertEqual(gestion_catalogo.huerfanos(), [99])
+
+    def test_editar_moviles_como_el_orm(self):
+        #price es IntegerField: se guarda como lo guardaría el ORM, sin decimales
+        self.assertEqual(gestion_catalogo.editar_moviles([1, 2], {'price': '199.99', 'ram': '8', 'name': 'x'}), 2)
+        doc = coleccion(MovilXiaomi).find_one({columna_pk(MovilXiaomi): 1})
+        self.assertEqual((doc['price'], doc['ram'], doc['name']), (199, 8, 'Xiaomi 1'))
+        self.assertIs(type(doc['price']), int)
+
+
+class MigracionRankingsTests(MongoLimpioMixin, TestCase):
+    colecciones = (RankingPersonal, consenso.CONSENSO, migracion_rankings.MIGRACIONES)
+
+    def setUp(self):
+        super().setUp()
+        coleccion(RankingPersonal).insert_many([
+            {columna_pk(RankingPersonal): 1, 'user_email': 'a@test.com', 'nombre': 'Antigua', 'elementos': [3, 1, 3]},
+            {columna_pk(RankingPersonal): 2, 'user_email': 'a@test.com', 'nombre': 'Rara',
+             'elementos': {'S': [1, '2'], 'A': [1], 'Z': [4]}},
+            {columna_pk(RankingPersonal): 3, 'user_email': 'a@test.com', 'nombre': 'Buena', 'elementos': tierlist.tiers_vacias()},
+        ])
+
+    def _elementos(self):
+        return {r.id: r.elementos for r in RankingPersonal.objects.using('mongodb').order_by('id')}
+
+    def test_dry_run_no_escribe(self):
+        antes = self._elementos()
+        informe = migracion_rankings.migrar(dry_run=True)
+        self.assertEqual((informe['revisados'], informe['convertidos']), (3, 2))
+        self.assertEqual(informe['problemas']['lista antigua'], 1)
+        self.assertEqual(self._elementos(), antes)
+        self.assertIsNone(coleccion(migracion_rankings.MIGRACIONES).find_one())
+
+    def test_por_lotes_y_continua(self):
+        migracion_rankings.migrar(lote=1)
+        self.assertEqual(self._elementos(), {
+            1: {**tierlist.tiers_vacias(), 'unranked': [3, 1]},
+            2: {**tierlist.tiers_vacias(), 'S': [1, 2], 'unranked': [4]},
+            3: tierlist.tiers_vacias(),
+        })
+        #relanzarlo no vuelve a revisar nada; un ranking nuevo sí se revisa
+        coleccion(RankingPersonal).insert_one({columna_pk(RankingPersonal): 4, 'user_email': 'a@test.com',
+                                               'nombre': 'Nueva', 'elementos': [7]})
+        self.assertEqual(migracion_rankings.migrar()['revisados'], 1)
+        self.assertEqual(coleccion(consenso.CONSENSO).find_one({'_id': 2})['S'], 1)
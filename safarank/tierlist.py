@@ -0,0 +1,125 @@
+from pymongo import ReturnDocument
+
+from . import consenso
+from .models import RankingPersonal
+from .mongo import coleccion, columna_pk
+
+#cambios de las tier lists hechos directamente en mongo ($addToSet, $pull,
+#updates con pipeline...) en vez de leer el ranking entero, tocarlo en
+#python y volver a guardarlo. Todas filtran por dueño, si el ranking no es
+#del usuario simplemente no se modifica nada. Las que cambian las tiers S..D
+#pasan la diferencia a consenso.py (tier list de la comunidad)
+
+TIERS = ('S', 'A', 'B', 'C', 'D', 'unranked')
+
+
+def tiers_vacias():
+    return {t: [] for t in TIERS}
+
+
+def _rankings():
+    return coleccion(RankingPersonal)
+
+
+def _filtro(ranking_id, email):
+    return {columna_pk(RankingPersonal): ranking_id, 'user_email': email}
+
+
+def _tier(nombre):
+    return {'$ifNull': [f'$elementos.{nombre}', []]}
+
+
+def anadir(ranking_id, email, movil_id):
+    #mete el móvil en 'unranked' solo si no está ya en ninguna tier
+    filtro = _filtro(ranking_id, email)
+    for t in TIERS:
+        filtro[f'elementos.{t}'] = {'$ne': movil_id}
+    res = _rankings().update_one(filtro, {'$addToSet': {'elementos.unranked': movil_id}})
+    return res.modified_count == 1
+
+
+def quitar(ranking_id, email, movil_id):
+    antes = _rankings().find_one_and_update(
+        {**_filtro(ranking_id, email), '$or': [{f'elementos.{t}': movil_id} for t in TIERS]},
+        {'$pull': {f'elementos.{t}': movil_id for t in TIERS}},
+        projection={'elementos': 1},
+        return_document=ReturnDocument.BEFORE,
+    )
+    if antes is None:
+        return False
+    tier = consenso.tiers_de(antes['elementos']).get(movil_id)
+    if tier:
+        consenso.aplicar({movil_id: {tier: -1}})
+    return True
+
+
+def mover(ranking_id, email, movil_id, desde, hasta, antes_de=None):
+    #mueve un móvil de una tier a otra, justo delante de antes_de (None o un
+    #móvil que ya no está en esa tier: al final). Se posiciona por vecino y no
+    #por índice porque la página no pinta los móviles borrados que sigan en la
+    #lista. Si ya no estaba en 'desde' (otra pestaña lo movió antes) no se toca
+    #nada y devuelve False. Dejarlo donde ya estaba (o repetir la petición) cuenta como hecho
+    if desde not in TIERS or hasta not in TIERS:
+        raise ValueError("Tier no válida")
+    if antes_de is not None and (type(antes_de) is not int or antes_de == movil_id):
+        raise ValueError("Posición no válida")
+    destino = {'$filter': {'input': _tier(hasta), 'cond': {'$ne': ['$$this', movil_id]}}}
+    if antes_de is None:
+        nueva = {'$concatArrays': [destino, [movil_id]]}
+    else:
+        nueva = {'$let': {
+            'vars': {'destino': destino, 'pos': {'$indexOfArray': [destino, antes_de]}},
+            'in': {'$cond': [
+                {'$lt': ['$$pos', 0]},
+                {'$concatArrays': ['$$destino', [movil_id]]},
+                {'$concatArrays': [
+                    {'$slice': ['$$destino', '$$pos']},
+                    [movil_id],
+                    {'$slice': ['$$destino', '$$pos', {'$add': [{'$size': '$$destino'}, 1]}]},
+                ]},
+            ]},
+        }}
+    res = _rankings().update_one(
+        {**_filtro(ranking_id, email), f'elementos.{desde}': movil_id},
+        [
+            {'$set': {f'elementos.{t}': {'$filter': {'input': _tier(t), 'cond': {'$ne': ['$$this', movil_id]}}}
+                      for t in TIERS if t != hasta}},
+            {'$set': {f'elementos.{hasta}': nueva}},
+        ],
+    )
+    if res.matched_count != 1:
+        return False
+    if desde != hasta:
+        consenso.aplicar(consenso.diferencia({desde: [movil_id]}, {hasta: [movil_id]}))
+    return True
+
+
+def guardar_orden(ranking_id, email, tiers):
+    #sustituye el orden completo (botón "Guardar Orden")
+    if not isinstance(tiers, dict) or any(t not in TIERS or not isinstance(v, list) for t, v in tiers.items()):
+        raise ValueError("Tiers no válidas")
+    elementos = tiers_vacias()
+    vistos = set()
+    for t in TIERS:
+        for x in tiers.get(t, []):
+            x = int(x)
+            if x not in vistos:
+                vistos.add(x)
+                elementos[t].append(x)
+    antes = _rankings().find_one_and_update(
+        _filtro(ranking_id, email), {'$set': {'elementos': elementos}},
+        projection={'elementos': 1}, return_document=ReturnDocument.BEFORE,
+    )
+    if antes is None:
+        return False
+    consenso.registrar(antes.get('elementos'), elementos)
+    return True
+
+
+def borrar(ranking_id, email):
+    #borra el ranking y lo descuenta de la tier list de la comunidad
+    antes = _rankings().find_one_and_delete(_filtro(ranking_id, email), projection={'elementos': 1})
+    if antes is None:
+        return False
+    consenso.registrar(antes.get('elementos'), None)
+    return True
@@ -1,6 +1,10 @@
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path
-from safarank import views
+from safarank import views, vistas_async
+
+#detalle y ranking van por las vistas async solo cuando se sirve por ASGI
+lectura = vistas_async if settings.SAFARANK_VISTAS_ASYNC else views
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -14,15 +18,19 @@ urlpatterns = [
     path('dashboard/', views.dashboard, name='dashboard'),  # Nuevo Menú Principal
     path('catalogo/', views.catalogo, name='catalogo'),  # Antes era 'inicio'
 
-    path('movil/<int:movil_id>/', views.detalle_movil, name='detalle_movil'),
+    path('movil/<int:movil_id>/', lectura.detalle_movil, name='detalle_movil'),
+    path('movil/<int:movil_id>/alternativas/', views.alternativas_movil, name='alternativas_movil'),
 
     # Rankings
     path('mis-rankings/', views.mis_rankings, name='mis_rankings'),
-    path('ranking/<int:ranking_id>/', views.ver_ranking, name='ver_ranking'),
+    path('ranking/<int:ranking_id>/', lectura.ver_ranking, name='ver_ranking'),
     path('ranking/borrar/<int:ranking_id>/', views.borrar_ranking, name='borrar_ranking'),
 
 
     path('ranking/guardar-orden/', views.guardar_orden_ranking, name='guardar_orden_ranking'),
+    path('ranking/anadir/', views.anadir_a_ranking, name='anadir_a_ranking'),
+    path('comunidad/', views.tier_list_comunidad, name='tier_list_comunidad'),
+    path('comunidad.json', views.tier_list_comunidad_json, name='tier_list_comunidad_json'),
 
     # Admin
     path('panel-admin/', views.panel_administracion, name='panel_administracion'),
@@ -40,5 +48,11 @@ urlpatterns = [
     path('gestion/categorias/borrar/<int:cat_id>/', views.borrar_categoria, name='borrar_categoria'),
 
     path('panel-admin/estadisticas/', views.estadisticas_globales, name='estadisticas_globales'),
+    path('panel-admin/exportar/<str:tabla>/', views.exportar_datos, name='exportar_datos'),
+    path('panel-admin/usuarios/', views.admin_usuarios, name='admin_usuarios'),
+    path('panel-admin/metricas/', views.panel_metricas, name='panel_metricas'),
+    path('panel-admin/metricas.json', views.metricas_json, name='metricas_json'),
+
+    path('miniaturas/<str:nombre>', views.miniatura, name='miniatura'),
 ]
 
@@ -0,0 +1,13 @@
+from django.urls import path
+from safarank import vistas_async
+from safarank.urls import urlpatterns as urlpatterns_base
+
+#las mismas rutas pero siempre con las vistas async (el camino ASGI), se sirva
+#como se sirva; comparar_latencia y los tests las comparan con urls_sync
+
+VISTAS_ASYNC = {
+    'detalle_movil': path('movil/<int:movil_id>/', vistas_async.detalle_movil, name='detalle_movil'),
+    'ver_ranking': path('ranking/<int:ranking_id>/', vistas_async.ver_ranking, name='ver_ranking'),
+}
+
+urlpatterns = [VISTAS_ASYNC.get(getattr(p, 'name', None), p) for p in urlpatterns_base]
@@ -0,0 +1,13 @@
+from django.urls import path
+from safarank import views
+from safarank.urls import urlpatterns as urlpatterns_base
+
+#las mismas rutas pero siempre con las vistas sync de siempre (el camino WSGI);
+#comparar_latencia y los tests las comparan con urls_async
+
+VISTAS_SYNC = {
+    'detalle_movil': path('movil/<int:movil_id>/', views.detalle_movil, name='detalle_movil'),
+    'ver_ranking': path('ranking/<int:ranking_id>/', views.ver_ranking, name='ver_ranking'),
+}
+
+urlpatterns = [VISTAS_SYNC.get(getattr(p, 'name', None), p) for p in urlpatterns_base]
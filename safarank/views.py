@@ -1,19 +1,40 @@
-import csv
-import io
+import hashlib
 import json
-import random
-from collections import defaultdict
 
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
-from django.shortcuts import render, redirect, get_object_or_404
+from django.db.models import Q
+from django.shortcuts import render, redirect
+from django.conf import settings
 from django.contrib import messages
 from django.utils import timezone
-from django.http import JsonResponse
+from django.utils.http import urlencode
+from django.http import FileResponse, Http404, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.middleware.csrf import get_token
+from django.views.decorators.cache import cache_control
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition
 
-from .forms import RegistroForm, LoginForm, ValoracionForm, RankingForm
+from . import (actividad, agregados, alternativas, busqueda, cache_catalogo, clasificacion, consenso, exportar,
+               gestion_catalogo, ids, importador, indice_categorias, metricas, miniaturas, recomendaciones, resenas,
+               servicio_estadisticas, tierlist)
+from .forms import RegistroForm, LoginForm, RankingForm
 from .models import Usuario, MovilXiaomi, Valoracion, RankingPersonal, Categoria
+from .paginacion import pagina_keyset, tam_pagina
+
+
+#columnas que se pintan en las tarjetas del catálogo
+CAMPOS_TARJETA = ('id', 'name', 'price', 'ram', 'storage', 'ratings', 'imagen')
+
+#opciones del desplegable de orden (claves de busqueda.ORDENES)
+ORDENES_CATALOGO = [
+    ('', 'Por defecto'),
+    ('precio', 'Precio: menor a mayor'),
+    ('-precio', 'Precio: mayor a menor'),
+    ('-nota', 'Mejor nota'),
+    ('-bateria', 'Más batería'),
+    ('nombre', 'Nombre'),
+]
 
 
 #AUTENTICACIÓN
@@ -64,60 +85,113 @@ def dashboard(request):
     })
 
 
-@login_required(login_url='login')
-def catalogo(request):
+def _listas_usuario(request):
+    #id y nombre de las listas del usuario, se piden una vez por petición
+    if not hasattr(request, '_listas_usuario'):
+        request._listas_usuario = list(
+            RankingPersonal.objects.using('mongodb').filter(user_email=request.user.email).only('id', 'nombre').order_by('id')
+        )
+    return request._listas_usuario
 
-    categorias = Categoria.objects.using('mongodb').all()
 
-    #Comprobar si el usuario ha hecho clic en alguna categoría (?cat=1)
-    cat_id = request.GET.get('cat')
-    if cat_id:
-        try:
-            cat_seleccionada = Categoria.objects.using('mongodb').get(id=int(cat_id))
+def _etag_catalogo(request):
+    #la página solo cambia con el catálogo (versión de la caché), la URL y el
+    #usuario: su nombre y rol, sus listas y su token csrf. Con mensajes
+    #pendientes no hay ETag, que si no se quedarían sin mostrar
+    if request.method != 'GET' or len(messages.get_messages(request)):
+        return None
+    #get_token crea el secreto csrf si aún no hay, para que el ETag no cambie al recibir la cookie
+    get_token(request)
+    datos = (request.user.pk, request.user.nombre, request.user.rol, cache_catalogo.version(),
+             request.get_full_path(), [(l.id, l.nombre) for l in _listas_usuario(request)],
+             request.META['CSRF_COOKIE'])
+    return hashlib.sha1(repr(datos).encode()).hexdigest()
 
-            moviles = MovilXiaomi.objects.using('mongodb').filter(id__in=cat_seleccionada.moviles)
-        except Categoria.DoesNotExist:
-            moviles = MovilXiaomi.objects.using('mongodb').all()
-    else:
-        # si no hay filtro mostramos todos
-        moviles = MovilXiaomi.objects.using('mongodb').all()
 
-    mis_listas = RankingPersonal.objects.using('mongodb').filter(user_email=request.user.email)
+@login_required(login_url='login')
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_etag_catalogo)
+def catalogo(request):
 
-    if request.method == 'POST' and 'btn_ranking_rapido' in request.POST:
-        movil_id = int(request.POST.get('movil_id'))
-        ranking_id = request.POST.get('ranking_seleccionado')
-        if ranking_id:
-            try:
-                ranking = RankingPersonal.objects.using('mongodb').get(id=int(ranking_id))
-                if isinstance(ranking.elementos, list):
-                    ranking.elementos = {'S': [], 'A': [], 'B': [], 'C': [], 'D': [], 'unranked': ranking.elementos}
-                ya_existe = any(movil_id in tier_list for tier_list in ranking.elementos.values())
-                if not ya_existe:
-                    ranking.elementos['unranked'].append(movil_id)
-                    ranking.save(using='mongodb')
-                    messages.success(request, f"¡Añadido a '{ranking.nombre}'!")
-                else:
-                    messages.info(request, f"El móvil ya estaba en la lista '{ranking.nombre}'")
-            except Exception as e:
-                messages.error(request, f"Error: {e}")
-        #mantenemos el filtro al recargar
-        url_redirect = f"/catalogo/?cat={cat_id}" if cat_id else "/catalogo/"
-        return redirect(url_redirect)
+    categorias = cache_catalogo.categorias()
+
+    #Comprobar si el usuario ha hecho clic en alguna categoría (?cat=1)
+    cat_id = request.GET.get('cat', '')
+    cat_id = int(cat_id) if cat_id.isdigit() else None
+    moviles = MovilXiaomi.objects.using('mongodb').only(*CAMPOS_TARJETA)
+    cat_seleccionada = cache_catalogo.categoria(cat_id) if cat_id is not None else None
+    # si no hay filtro mostramos todos
+
+    #filtros y orden (?precio_max=300&ram=8&orden=-nota...)
+    criterios = busqueda.parsear(request.GET)
+    moviles = busqueda.filtrar(moviles, criterios)
+    campo, descendente, desempate = busqueda.orden(criterios)
+
+    #paginación por cursor: ?despues=<cursor del último visto>&n=<tamaño de página>
+    despues = busqueda.texto_a_cursor(request.GET['despues'], criterios) if request.GET.get('despues') else None
+    n = tam_pagina(request)
+
+    def calcular_pagina(qs):
+        if cat_seleccionada:
+            if busqueda.hay_filtros(criterios) or desempate:
+                qs = qs.filter(id__in=indice_categorias.moviles_de(cat_seleccionada.id))
+            else:
+                return pagina_categoria(qs)
+        return pagina_keyset(qs, campo, despues, n, descendente, desempate)
+
+    def pagina_categoria(qs):
+        #solo los ids de esta página, sacados del índice inverso (orden por id).
+        #Si alguno ya no existe se siguen pidiendo hasta tener n + 1 de verdad,
+        #que si no la página sale corta y desaparece el "cargar más"
+        filas, cursor = [], despues
+        while len(filas) <= n:
+            pedir = n + 1 - len(filas)
+            ids_pagina = indice_categorias.moviles_de(cat_seleccionada.id, cursor, pedir)
+            filas += qs.filter(id__in=ids_pagina).order_by('id')
+            if len(ids_pagina) < pedir:
+                break
+            cursor = ids_pagina[-1]
+        return filas[:n], (filas[n - 1].id if len(filas) > n else None)
+
+    clave = f"{cat_seleccionada.id if cat_seleccionada else ''}:{busqueda.clave(criterios)}"
+    moviles, siguiente = cache_catalogo.obtener(f"pagina:{clave}:{despues}:{n}", lambda: calcular_pagina(moviles))
+
+    params = request.GET.copy()
+    params.pop('parcial', None)
+    if siguiente is not None:
+        params['despues'] = busqueda.cursor_a_texto(siguiente)
+    url_siguiente = f"?{params.urlencode()}" if siguiente is not None else None
+
+    #"cargar más": solo las tarjetas de la página siguiente
+    if request.GET.get('parcial'):
+        respuesta = render(request, 'includes/pagina_catalogo.html', {'moviles': moviles})
+        respuesta['X-Siguiente'] = url_siguiente or ''
+        return respuesta
+
+    facetas = cache_catalogo.obtener(f"facetas:{clave}", lambda: busqueda.facetas(
+        criterios, indice_categorias.moviles_de(cat_seleccionada.id) if cat_seleccionada else None
+    ))
 
     return render(request, 'catalogo.html', {
         'moviles': moviles,
-        'mis_listas': mis_listas,
+        'mis_listas': _listas_usuario(request),
         'categorias': categorias,
-        'cat_actual': int(cat_id) if cat_id else None
+        'cat_actual': cat_id,
+        'url_siguiente': url_siguiente,
+        'facetas': facetas,
+        'filtros': request.GET,
+        'seleccion': {p: request.GET.getlist(p) for p in busqueda.VALORES},
+        'ordenes': ORDENES_CATALOGO,
     })
 
 
 @login_required(login_url='login')
 def detalle_movil(request, movil_id):
-    try:
-        movil = MovilXiaomi.objects.using('mongodb').get(id=movil_id)
-    except MovilXiaomi.DoesNotExist:
+    if request.method == 'GET' and request.GET.get('parcial'):
+        return pagina_resenas(request, *resenas.pagina(movil_id, cursor_resenas(request)))
+
+    movil = cache_catalogo.movil(movil_id)
+    if movil is None:
         messages.error(request, "El móvil no existe.")
         return redirect('catalogo')
 
@@ -135,6 +209,7 @@ def detalle_movil(request, movil_id):
         comentario = request.POST.get('comentario')
 
         if puntos:
+            anterior = mi_valoracion.puntuacion if mi_valoracion else None
             if not mi_valoracion:
                 mi_valoracion = Valoracion()
                 mi_valoracion.user_email = request.user.email
@@ -144,6 +219,10 @@ def detalle_movil(request, movil_id):
             mi_valoracion.puntuacion = int(puntos)
             mi_valoracion.comentario = comentario
             mi_valoracion.save(using='mongodb')
+            resumen = agregados.registrar_voto(movil_id, mi_valoracion.puntuacion, anterior)
+            if not ya_votado:
+                actividad.registrar_valoracion(request.user.email)
+            clasificacion.actualizar_movil(movil_id, resumen)
 
             mensaje = "¡Valoración actualizada!" if ya_votado else "¡Valoración guardada!"
             messages.success(request, mensaje)
@@ -158,10 +237,8 @@ def detalle_movil(request, movil_id):
         ranking_id = request.POST.get('ranking_seleccionado')
         if ranking_id:
             try:
-                ranking = RankingPersonal.objects.using('mongodb').get(id=int(ranking_id))
-                if movil_id not in ranking.elementos:
-                    ranking.elementos.append(movil_id)
-                    ranking.save(using='mongodb')
+                ranking = mis_listas.only('id', 'nombre').get(id=int(ranking_id))
+                if tierlist.anadir(ranking.id, request.user.email, movil_id):
                     messages.success(request, f"Añadido a '{ranking.nombre}'")
                 else:
                     messages.info(request, f"Ya estaba en '{ranking.nombre}'")
@@ -169,15 +246,74 @@ def detalle_movil(request, movil_id):
                 messages.error(request, f"Error: {e}")
             return redirect('detalle_movil', movil_id=movil_id)
 
-    valoraciones = Valoracion.objects.using('mongodb').filter(movil_id=movil_id).order_by('-fecha')
+    valoraciones, siguiente = resenas.pagina(movil_id)
+    resumen = agregados.resumen_movil(movil_id)
+
+    return render(request, 'detalle_movil.html', contexto_detalle(
+        movil, mi_valoracion, mis_listas, valoraciones, siguiente, resumen, parecidos(movil_id),
+        mas_baratos(movil_id)
+    ))
+
+
+def parecidos(movil_id, n=4):
+    #"quien valoró este también valoró", ya precalculado (recomendaciones.py)
+    ids_vecinos = [v['movil_id'] for v in recomendaciones.vecinos(movil_id)]
+    moviles = cache_catalogo.moviles_por_id(ids_vecinos)
+    return [moviles[i] for i in ids_vecinos if i in moviles][:n]
+
+
+def mas_baratos(movil_id, n=4):
+    #los más parecidos por specs que cuestan menos (alternativas.py)
+    ids_alternativas = alternativas.buscar(movil_id, n, mas_barato=True)
+    moviles = cache_catalogo.moviles_por_id(ids_alternativas)
+    return [moviles[i] for i in ids_alternativas if i in moviles]
+
 
-    return render(request, 'detalle_movil.html', {
+@login_required
+def alternativas_movil(request, movil_id):
+    #?precio_max=300&ram_min=8&n=10
+    try:
+        precio_max = float(request.GET['precio_max']) if request.GET.get('precio_max') else None
+        ram_min = int(request.GET['ram_min']) if request.GET.get('ram_min') else None
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'Parámetros no válidos'}, status=400)
+    ids_alternativas = alternativas.buscar(movil_id, tam_pagina(request, defecto=5), precio_max, ram_min,
+                                           bool(request.GET.get('mas_barato')))
+    moviles = cache_catalogo.moviles_por_id(ids_alternativas)
+    return JsonResponse({'status': 'ok', 'moviles': [
+        {campo: getattr(moviles[i], campo) for campo in ('id', 'name', *alternativas.CAMPOS)}
+        for i in ids_alternativas if i in moviles
+    ]})
+
+
+def cursor_resenas(request):
+    return resenas.texto_a_cursor(request.GET['despues']) if request.GET.get('despues') else None
+
+
+def _url_resenas(siguiente):
+    return f"?{urlencode({'despues': resenas.cursor_a_texto(siguiente)})}" if siguiente is not None else None
+
+
+def pagina_resenas(request, valoraciones, siguiente):
+    #"cargar más" de las opiniones: solo las tarjetas, el cursor va en X-Siguiente
+    respuesta = render(request, 'includes/pagina_resenas.html', {'valoraciones': valoraciones})
+    respuesta['X-Siguiente'] = _url_resenas(siguiente) or ''
+    return respuesta
+
+
+def contexto_detalle(movil, mi_valoracion, mis_listas, valoraciones, siguiente, resumen, parecidos, mas_baratos):
+    return {
         'movil': movil,
-        'ya_votado': ya_votado,
+        'ya_votado': mi_valoracion is not None,
         'mi_valoracion': mi_valoracion,
         'valoraciones': valoraciones,
-        'mis_listas': mis_listas
-    })
+        'url_siguiente': _url_resenas(siguiente),
+        'mis_listas': mis_listas,
+        'resumen': resumen,
+        'histograma': resenas.histograma(resumen),
+        'parecidos': parecidos,
+        'mas_baratos': mas_baratos,
+    }
 
 #GESTIÓN DE RANKINGS
 
@@ -194,9 +330,11 @@ def mis_rankings(request):
         form = RankingForm(request.POST)
         if form.is_valid():
             nuevo = form.save(commit=False)
-            nuevo.id = random.randint(10000, 999999)
+            nuevo.id = ids.siguiente_id(RankingPersonal)
             nuevo.user_email = request.user.email
+            nuevo.elementos = tierlist.tiers_vacias()
             nuevo.save(using='mongodb')
+            actividad.registrar_ranking(request.user.email)
             messages.success(request, "Ranking creado.")
             return redirect('mis_rankings')
     else:
@@ -215,45 +353,27 @@ def ver_ranking(request, ranking_id):
     if ranking.user_email != request.user.email:
         return redirect('dashboard')
 
-    # convertir lista antigua a tierli
-    if isinstance(ranking.elementos, list):
-        ranking.elementos = {
-            'S': [], 'A': [], 'B': [], 'C': [], 'D': [],
-            'unranked': ranking.elementos
-        }
-        ranking.save(using='mongodb')
-
-    # todos los móviles que est
-    all_ids = []
-    for ids in ranking.elementos.values():
-        all_ids.extend(ids)
-
-    moviles_db = {m.id: m for m in MovilXiaomi.objects.using('mongodb').filter(id__in=all_ids)}
-
-    #  cajas con los objetos
-    tiers_data = {
-        'S': [moviles_db[i] for i in ranking.elementos.get('S', []) if i in moviles_db],
-        'A': [moviles_db[i] for i in ranking.elementos.get('A', []) if i in moviles_db],
-        'B': [moviles_db[i] for i in ranking.elementos.get('B', []) if i in moviles_db],
-        'C': [moviles_db[i] for i in ranking.elementos.get('C', []) if i in moviles_db],
-        'D': [moviles_db[i] for i in ranking.elementos.get('D', []) if i in moviles_db],
-        'unranked': [moviles_db[i] for i in ranking.elementos.get('unranked', []) if i in moviles_db],
-    }
-
     # para borrar un móvil
     if request.method == 'POST' and 'borrar_movil' in request.POST:
         try:
             movil_a_borrar = int(request.POST.get('movil_id_borrar'))
-            for tier_name, tier_list in ranking.elementos.items():
-                if movil_a_borrar in tier_list:
-                    tier_list.remove(movil_a_borrar)
-                    break
-            ranking.save(using='mongodb')
+            tierlist.quitar(ranking_id, request.user.email, movil_a_borrar)
             messages.success(request, "Móvil eliminado de la Tier List.")
             return redirect('ver_ranking', ranking_id=ranking_id)
         except ValueError:
             pass
 
+    # todos los móviles que est
+    all_ids = []
+    for movil_ids in ranking.elementos.values():
+        all_ids.extend(movil_ids)
+
+    moviles_db = cache_catalogo.moviles_por_id(all_ids)
+
+    #  cajas con los objetos (se saltan los ids que ya no están en el catálogo)
+    tiers_data = {tier: [moviles_db[i] for i in ranking.elementos.get(tier, []) if i in moviles_db]
+                  for tier in tierlist.TIERS}
+
     return render(request, 'ver_ranking.html', {
         'ranking': ranking,
         'tiers_data': tiers_data
@@ -263,38 +383,63 @@ def ver_ranking(request, ranking_id):
 @csrf_exempt
 @login_required
 def guardar_orden_ranking(request):
-    if request.method == 'POST':
-        try:
-            data = json.loads(request.body)
-            ranking_id = data.get('ranking_id')
-            nuevas_tiers = data.get('tiers')
-
-            ranking = RankingPersonal.objects.using('mongodb').get(id=ranking_id)
-
-            if ranking.user_email == request.user.email:
+    #admite el orden completo {'ranking_id', 'tiers': {...}} o solo el
+    #movimiento de un drag & drop {'ranking_id', 'mover': {'movil_id', 'desde', 'hasta', 'antes_de'}}
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error'}, status=400)
+    try:
+        data = json.loads(request.body)
+        ranking_id = int(data.get('ranking_id'))
+        movimiento = data.get('mover')
+        if movimiento:
+            antes_de = movimiento.get('antes_de')
+            movimiento = (int(movimiento['movil_id']), movimiento['desde'], movimiento['hasta'],
+                          int(antes_de) if antes_de is not None else None)
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return JsonResponse({'status': 'error', 'message': 'Petición no válida'}, status=400)
+
+    email = request.user.email
+    if not RankingPersonal.objects.using('mongodb').filter(id=ranking_id, user_email=email).exists():
+        return JsonResponse({'status': 'error', 'message': 'No autorizado'}, status=403)
 
-                for tier in nuevas_tiers:
-                    nuevas_tiers[tier] = [int(x) for x in nuevas_tiers[tier]]
+    try:
+        if movimiento:
+            if not tierlist.mover(ranking_id, email, *movimiento):
+                return JsonResponse({'status': 'error', 'message': 'El ranking ha cambiado, recarga la página'}, status=409)
+        else:
+            tierlist.guardar_orden(ranking_id, email, data.get('tiers') or {})
+    except (ValueError, TypeError) as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+    return JsonResponse({'status': 'ok'})
 
-                ranking.elementos = nuevas_tiers
-                ranking.save(using='mongodb')
-                return JsonResponse({'status': 'ok'})
-            else:
-                return JsonResponse({'status': 'error', 'message': 'No autorizado'}, status=403)
-        except Exception as e:
-            return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
-    return JsonResponse({'status': 'error'}, status=400)
+@login_required
+def anadir_a_ranking(request):
+    #alta rápida desde el catálogo: {'ranking_id', 'movil_id'}
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error'}, status=400)
+    try:
+        data = json.loads(request.body)
+        ranking_id, movil_id = int(data['ranking_id']), int(data['movil_id'])
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'status': 'error', 'message': 'Petición no válida'}, status=400)
+
+    ranking = RankingPersonal.objects.using('mongodb').filter(
+        id=ranking_id, user_email=request.user.email
+    ).only('id', 'nombre').first()
+    if ranking is None:
+        return JsonResponse({'status': 'error', 'message': 'No autorizado'}, status=403)
+    if cache_catalogo.movil(movil_id) is None:
+        return JsonResponse({'status': 'error', 'message': 'El móvil no existe'}, status=404)
+
+    anadido = tierlist.anadir(ranking.id, request.user.email, movil_id)
+    return JsonResponse({'status': 'ok', 'anadido': anadido, 'nombre': ranking.nombre})
 
 @login_required
 def borrar_ranking(request, ranking_id):
     if ranking_id == 0: return redirect('mis_rankings')
-    try:
-        ranking = RankingPersonal.objects.using('mongodb').get(id=ranking_id)
-        if ranking.user_email == request.user.email:
-            ranking.delete(using='mongodb')
-            messages.success(request, "Ranking eliminado.")
-    except RankingPersonal.DoesNotExist:
-        pass
+    if tierlist.borrar(ranking_id, request.user.email):
+        actividad.registrar_ranking(request.user.email, -1)
+        messages.success(request, "Ranking eliminado.")
     return redirect('mis_rankings')
 
 
@@ -302,38 +447,22 @@ def borrar_ranking(request, ranking_id):
 
 @login_required
 def estadisticas(request):
-    todas_valoraciones = Valoracion.objects.using('mongodb').all()
-    total_votos = len(todas_valoraciones)
+    total_votos, suma_total = agregados.totales()
     promedio_global = 0
     top_moviles = []
 
     if total_votos > 0:
-        suma_total = sum(v.puntuacion for v in todas_valoraciones)
         promedio_global = round(suma_total / total_votos, 2)
 
-        notas_por_movil = defaultdict(list)
-        for v in todas_valoraciones:
-            notas_por_movil[v.movil_id].append(v.puntuacion)
-
-        ranking_calc = []
-        for mid, notas in notas_por_movil.items():
-            media = sum(notas) / len(notas)
-            ranking_calc.append((mid, media, len(notas)))
-
-        ranking_calc.sort(key=lambda x: x[1], reverse=True)
-        top_5_data = ranking_calc[:5]
-
+        top_5_data = clasificacion.top(n=5)
+        objs = cache_catalogo.moviles_por_id([t['movil_id'] for t in top_5_data])
         for item in top_5_data:
-            mid, media, count = item
-            try:
-                movil = MovilXiaomi.objects.using('mongodb').get(id=mid)
+            if item['movil_id'] in objs:
                 top_moviles.append({
-                    'obj': movil,
-                    'media': round(media, 1),
-                    'total': count
+                    'obj': objs[item['movil_id']],
+                    'media': item['media'],
+                    'total': item['votos']
                 })
-            except MovilXiaomi.DoesNotExist:
-                continue
 
     return render(request, 'estadisticas.html', {
         'total_votos': total_votos,
@@ -342,6 +471,30 @@ def estadisticas(request):
     })
 
 
+@login_required
+def tier_list_comunidad(request):
+    return render(request, 'tier_comunidad.html', {'tiers': _tier_list_comunidad()})
+
+
+@login_required
+def tier_list_comunidad_json(request):
+    return JsonResponse({'status': 'ok', 'tiers': {
+        t: [{'movil_id': e['movil_id'], 'nombre': e['movil'].name, 'media': e['media'], 'listas': e['total']}
+            for e in entradas]
+        for t, entradas in _tier_list_comunidad().items()
+    }})
+
+
+def _tier_list_comunidad():
+    #las mejores de cada tier con su objeto móvil; los móviles borrados se saltan
+    tiers = consenso.tier_list()
+    moviles = cache_catalogo.moviles_por_id([e['movil_id'] for entradas in tiers.values() for e in entradas])
+    return {
+        t: [{**e, 'movil': moviles[e['movil_id']]} for e in entradas if e['movil_id'] in moviles]
+        for t, entradas in tiers.items()
+    }
+
+
 #ADMIN
 
 @login_required
@@ -351,6 +504,39 @@ def panel_administracion(request):
     return render(request, 'admin.html')
 
 
+@login_required
+def panel_metricas(request):
+    if request.user.rol != 'admin': return redirect('dashboard')
+    return render(request, 'admin_metricas.html', {
+        'vistas': metricas.resumen(),
+        'cache': cache_catalogo.contadores(),
+        'presupuesto': settings.SAFARANK_PRESUPUESTO_CONSULTAS,
+    })
+
+
+@login_required
+def metricas_json(request):
+    if request.user.rol != 'admin':
+        return JsonResponse({'status': 'error', 'message': 'No autorizado'}, status=403)
+    return JsonResponse({'vistas': metricas.resumen(), 'cache': cache_catalogo.contadores()})
+
+
+@login_required
+def exportar_datos(request, tabla):
+    #?formato=csv|ndjson&gzip=1&desde=AAAA-MM-DD&hasta=AAAA-MM-DD&movil=<id>
+    if request.user.rol != 'admin': return redirect('dashboard')
+    try:
+        trozos, content_type, nombre = exportar.exportar(
+            tabla, request.GET.get('formato', 'csv'), bool(request.GET.get('gzip')),
+            request.GET.get('desde'), request.GET.get('hasta'), request.GET.get('movil'),
+        )
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    respuesta = StreamingHttpResponse(trozos, content_type=content_type)
+    respuesta['Content-Disposition'] = f'attachment; filename="{nombre}"'
+    return respuesta
+
+
 @login_required
 def cargar_datos(request):
     if request.user.rol != 'admin':
@@ -361,40 +547,14 @@ def cargar_datos(request):
         if not uploaded_file:
             return render(request, 'data_load.html', {'error': 'Falta archivo.'})
         try:
-            MovilXiaomi.objects.using('mongodb').all().delete()
-            file_data = uploaded_file.read().decode("utf-8")
-            io_string = io.StringIO(file_data)
-            reader = csv.DictReader(io_string)
-
-            contador = 0
-            current_id = 1
-
-            # --- TASA DE CONVERSIÓN REAL (Rupias Indias a Euros) ---
-            TASA_INR_EUR = 0.0111
-
-            for row in reader:
-                movil = MovilXiaomi()
-                movil.id = current_id
-                movil.name = row.get('name', row.get('Name'))
-                movil.imgURL = row.get('imgURL', row.get('Image'))
-                try:
-                    # CONVERSIÓN DE MONEDA: Multiplicamos por la tasa oficial
-                    precio_rupias = float(row.get('price', 0))
-                    movil.price = round(precio_rupias * TASA_INR_EUR, 2)
-
-                    movil.ratings = float(row.get('ratings', 0.0))
-                    movil.ram = int(row.get('ram', 0))
-                    movil.storage = int(row.get('storage', 0))
-                    movil.camera = int(row.get('camera', 0))
-                    movil.battery = int(row.get('battery', 0))
-                except ValueError:
-                    continue
-                movil.save(using='mongodb')
-                contador += 1
-                current_id += 1
-
-            mensaje = f"Se han cargado {contador} móviles con conversión real de INR a Euros."
-            return render(request, 'data_load.html', {'mensaje': mensaje})
+            resultado = importador.importar_csv(importador.abrir_texto(uploaded_file.file),
+                                                reemplazar=request.POST.get('reemplazar') == 'on')
+            cache_catalogo.invalidar()
+
+            mensaje = f"Se han cargado {resultado['cargados']} móviles con conversión real de INR a Euros."
+            if resultado['borrados']:
+                mensaje += f" Se han eliminado {resultado['borrados']} móviles que ya no estaban en el CSV."
+            return render(request, 'data_load.html', {'mensaje': mensaje, 'resultado': resultado})
         except Exception as e:
             return render(request, 'data_load.html', {'error': f'Error: {e}'})
 
@@ -404,10 +564,39 @@ def cargar_datos(request):
 @login_required
 def admin_catalogo(request):
     if request.user.rol != 'admin': return redirect('dashboard')
-    moviles = MovilXiaomi.objects.using('mongodb').all()
+
+    #acciones sobre los móviles marcados: borrar o poner los mismos valores a todos
+    if request.method == 'POST':
+        seleccion = [int(m) for m in request.POST.getlist('seleccion') if m.isdigit()]
+        accion = request.POST.get('accion')
+        if not seleccion:
+            messages.error(request, "No has marcado ningún móvil.")
+        elif accion == 'borrar':
+            borrados = gestion_catalogo.borrar_moviles(seleccion)
+            messages.success(request, f"{borrados} móviles eliminados.")
+        elif accion == 'editar':
+            try:
+                cambiados = gestion_catalogo.editar_moviles(seleccion, {
+                    c: request.POST.get(c) for c in gestion_catalogo.CAMPOS_EDITABLES
+                })
+                messages.success(request, f"{cambiados} móviles actualizados.")
+            except ValueError:
+                messages.error(request, "Algún valor no es un número válido.")
+        return redirect('admin_catalogo')
+
+    moviles = cache_catalogo.moviles()
     return render(request, 'admin_catalogo.html', {'moviles': moviles})
 
 
+def _asignar_miniatura(movil, url_anterior=None):
+    #si la imagen ya se había procesado se usa su hash; si no, el móvil se
+    #guarda con el placeholder y devuelve True para descargarla en segundo plano
+    if movil.imgURL == url_anterior:
+        return False
+    movil.imagen = miniaturas.hashes_conocidos([movil.imgURL]).get(movil.imgURL) if movil.imgURL else None
+    return bool(movil.imgURL) and movil.imagen is None
+
+
 @login_required
 def crear_movil(request):
     if request.user.rol != 'admin': return redirect('dashboard')
@@ -415,18 +604,19 @@ def crear_movil(request):
     if request.method == 'POST':
         try:
 
-            ultimo_movil = MovilXiaomi.objects.using('mongodb').order_by('-id').first()
-            nuevo_id = (ultimo_movil.id + 1) if ultimo_movil else 1
-
             nuevo = MovilXiaomi()
-            nuevo.id = nuevo_id
+            nuevo.id = ids.siguiente_id(MovilXiaomi)
             nuevo.name = request.POST.get('name')
             nuevo.price = float(request.POST.get('price', 0))
             nuevo.imgURL = request.POST.get('imgURL', 'https://via.placeholder.com/200')
             nuevo.ram = int(request.POST.get('ram', 0))
             nuevo.storage = int(request.POST.get('storage', 0))
             nuevo.battery = int(request.POST.get('battery', 0))
+            pendiente = _asignar_miniatura(nuevo)
             nuevo.save(using='mongodb')
+            cache_catalogo.invalidar()
+            if pendiente:
+                miniaturas.procesar_en_segundo_plano(nuevo.id, nuevo.imgURL)
 
             messages.success(request, "¡Móvil creado con éxito!")
             return redirect('admin_catalogo')
@@ -447,13 +637,18 @@ def editar_movil(request, movil_id):
 
     if request.method == 'POST':
         try:
+            url_anterior = movil.imgURL
             movil.name = request.POST.get('name')
             movil.price = float(request.POST.get('price', 0))
             movil.imgURL = request.POST.get('imgURL', 'https://via.placeholder.com/200')
             movil.ram = int(request.POST.get('ram', 0))
             movil.storage = int(request.POST.get('storage', 0))
             movil.battery = int(request.POST.get('battery', 0))
+            pendiente = _asignar_miniatura(movil, url_anterior)
             movil.save(using='mongodb')
+            cache_catalogo.invalidar()
+            if pendiente:
+                miniaturas.procesar_en_segundo_plano(movil.id, movil.imgURL)
 
             messages.success(request, "¡Móvil actualizado correctamente!")
             return redirect('admin_catalogo')
@@ -466,40 +661,38 @@ def editar_movil(request, movil_id):
 @login_required
 def borrar_movil(request, movil_id):
     if request.user.rol == 'admin':
-        try:
-            movil = MovilXiaomi.objects.using('mongodb').get(id=movil_id)
-            movil.delete(using='mongodb')
+        if gestion_catalogo.borrar_moviles([movil_id]):
             messages.success(request, "Móvil eliminado de la base de datos.")
-        except:
-            pass
+        else:
+            messages.error(request, "El móvil no existe.")
     return redirect('admin_catalogo')
 
 
 @login_required
 def admin_categorias(request):
     if request.user.rol != 'admin': return redirect('dashboard')
-    categorias = Categoria.objects.using('mongodb').all()
+    categorias = cache_catalogo.categorias()
     return render(request, 'admin_categorias.html', {'categorias': categorias})
 
 
 @login_required
 def crear_categoria(request):
     if request.user.rol != 'admin': return redirect('dashboard')
-    moviles_totales = MovilXiaomi.objects.using('mongodb').all()
+    moviles_totales = cache_catalogo.moviles()
 
     if request.method == 'POST':
         try:
-            ultima = Categoria.objects.using('mongodb').order_by('-id').first()
-            nuevo_id = (ultima.id + 1) if ultima else 1
-
             cat = Categoria()
-            cat.id = nuevo_id
+            cat.id = ids.siguiente_id(Categoria)
             cat.name = request.POST.get('name')
             cat.description = request.POST.get('description')
 
             moviles_seleccionados = request.POST.getlist('moviles')
             cat.moviles = [int(m) for m in moviles_seleccionados]
+            cat.num_moviles = indice_categorias.num_moviles(cat.moviles)
             cat.save(using='mongodb')
+            indice_categorias.actualizar_categoria(cat.id, [], cat.moviles)
+            cache_catalogo.invalidar()
 
             messages.success(request, "Categoría creada con éxito.")
             return redirect('admin_categorias')
@@ -517,15 +710,19 @@ def editar_categoria(request, cat_id):
     except Categoria.DoesNotExist:
         return redirect('admin_categorias')
 
-    moviles_totales = MovilXiaomi.objects.using('mongodb').all()
+    moviles_totales = cache_catalogo.moviles()
 
     if request.method == 'POST':
         try:
             cat.name = request.POST.get('name')
             cat.description = request.POST.get('description')
+            anteriores = list(cat.moviles)
             moviles_seleccionados = request.POST.getlist('moviles')
             cat.moviles = [int(m) for m in moviles_seleccionados]
+            cat.num_moviles = indice_categorias.num_moviles(cat.moviles)
             cat.save(using='mongodb')
+            indice_categorias.actualizar_categoria(cat.id, anteriores, cat.moviles)
+            cache_catalogo.invalidar()
 
             messages.success(request, "Categoría actualizada correctamente.")
             return redirect('admin_categorias')
@@ -540,6 +737,8 @@ def editar_categoria(request, cat_id):
 def borrar_categoria(request, cat_id):
     if request.user.rol == 'admin':
         Categoria.objects.using('mongodb').filter(id=cat_id).delete()
+        indice_categorias.quitar_categoria(cat_id)
+        cache_catalogo.invalidar()
         messages.success(request, "Categoría eliminada.")
     return redirect('admin_categorias')
 
@@ -551,51 +750,21 @@ def estadisticas_globales(request):
 
     total_valoraciones = Valoracion.objects.using('mongodb').count()
 
+    #top 5 por media bayesiana, ya precalculado
+    top_moviles = clasificacion.top(n=5)
 
-    valoraciones = list(Valoracion.objects.using('mongodb').all())
-    moviles = {m.id: m for m in MovilXiaomi.objects.using('mongodb').all()}
-    categorias = list(Categoria.objects.using('mongodb').all())
+    ttl = settings.SAFARANK_CACHE_STATS_TTL
+    stats_cat = cache_catalogo.obtener('stats:categorias', servicio_estadisticas.stats_categorias, ttl)
+    tops = clasificacion.tops_categorias([c['cat_id'] for c in stats_cat])
+    for c in stats_cat:
+        mejores = tops.get(clasificacion.clave_categoria(c['cat_id']))
+        c['mejor'] = mejores[0]['nombre'] if mejores else None
 
+    #solo recuentos: la lista de usuarios va paginada en admin_usuarios
+    usuarios = cache_catalogo.obtener('stats:usuarios', actividad.stats_usuarios, ttl) if request.user.rol == 'admin' else None
 
-    stats_m = {}
-    for v in valoraciones:
-        if v.movil_id not in stats_m:
-            stats_m[v.movil_id] = {'votos': 0, 'suma': 0}
-        stats_m[v.movil_id]['votos'] += 1
-        stats_m[v.movil_id]['suma'] += v.puntuacion
-
-
-    top_moviles = []
-    for mid, data in stats_m.items():
-        if mid in moviles:
-            top_moviles.append({
-                'nombre': moviles[mid].name,
-                'media': round(data['suma'] / data['votos'], 1),
-                'votos': data['votos']
-            })
-    top_moviles.sort(key=lambda x: x['media'], reverse=True)
-    top_moviles = top_moviles[:5]
-
-
-    stats_cat = []
-    for cat in categorias:
-        c_votos, c_suma = 0, 0
-        for mid in cat.moviles:
-            if mid in stats_m:
-                c_votos += stats_m[mid]['votos']
-                c_suma += stats_m[mid]['suma']
-        media = round(c_suma / c_votos, 1) if c_votos > 0 else 0
-        stats_cat.append({'nombre': cat.name, 'media': media, 'votos': c_votos})
-
-
-    from django.contrib.auth import get_user_model
-    User = get_user_model()
-    usuarios = User.objects.all()
-    v_recientes = Valoracion.objects.using('mongodb').order_by('-fecha')[:5]
-
-    # Adjuntamos el nombre del móvil a las valoraciones recientes para que se vea bonito
-    for v in v_recientes:
-        v.nombre_movil = moviles[v.movil_id].name if v.movil_id in moviles else "Móvil Borrado"
+    # las valoraciones recientes ya vienen con el nombre del móvil para que se vea bonito
+    v_recientes = servicio_estadisticas.valoraciones_recientes(5)
 
     return render(request, 'estadisticas.html', {
         'total': total_valoraciones,
@@ -603,4 +772,47 @@ def estadisticas_globales(request):
         'stats_cat': stats_cat,
         'usuarios': usuarios,
         'v_recientes': v_recientes
-    })
\ No newline at end of file
+    })
+
+
+@login_required
+def admin_usuarios(request):
+    if request.user.rol != 'admin': return redirect('dashboard')
+
+    #?q= busca en email y nombre; paginado por id con ?despues=<último id visto>
+    q = request.GET.get('q', '').strip()
+    usuarios = Usuario.objects.only('id', 'email', 'nombre', 'rol', 'is_active')
+    if q:
+        usuarios = usuarios.filter(Q(email__icontains=q) | Q(nombre__icontains=q))
+    try:
+        despues = int(request.GET['despues']) if request.GET.get('despues') else None
+    except ValueError:
+        despues = None
+    usuarios, siguiente = pagina_keyset(usuarios, 'id', despues, tam_pagina(request))
+
+    act = actividad.de_usuarios(u.email for u in usuarios)
+    for u in usuarios:
+        u.actividad = act.get(u.email, {'valoraciones': 0, 'rankings': 0})
+
+    params = request.GET.copy()
+    if siguiente is not None:
+        params['despues'] = siguiente
+    return render(request, 'admin_usuarios.html', {
+        'usuarios': usuarios,
+        'q': q,
+        'url_siguiente': f"?{params.urlencode()}" if siguiente is not None else None,
+    })
+
+
+def miniatura(request, nombre):
+    #las miniaturas no cambian nunca (el nombre es el hash del contenido)
+    partes = miniaturas.NOMBRE.match(nombre)
+    if not partes:
+        raise Http404
+    try:
+        fichero = open(miniaturas.ruta(partes['hash'], partes['tam'], partes['formato']), 'rb')
+    except FileNotFoundError:
+        raise Http404
+    respuesta = FileResponse(fichero, content_type='image/webp' if partes['formato'] == 'webp' else 'image/jpeg')
+    respuesta['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return respuesta
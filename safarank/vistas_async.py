@@ -0,0 +1,85 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.contrib import messages
+from django.contrib.auth.decorators import login_required
+from django.shortcuts import render, redirect
+from pymongo import DESCENDING
+
+from . import agregados, cache_catalogo, resenas, tierlist, views
+from .models import Valoracion, RankingPersonal
+from .mongo import coleccion_async, columna_pk, instancia
+
+#versiones async de las vistas de solo lectura más pesadas. Las consultas que
+#no dependen unas de otras se lanzan a la vez con asyncio.gather usando el
+#cliente async de pymongo. Los POST siguen yendo por la vista de siempre
+
+
+async def _lista(cursor):
+    return [doc async for doc in cursor]
+
+
+async def _mi_valoracion(email, movil_id):
+    doc = await coleccion_async(Valoracion).find_one(
+        {'user_email': email, 'movil_id': movil_id}, sort=[('fecha', DESCENDING)]
+    )
+    return instancia(Valoracion, doc) if doc else None
+
+
+async def _mis_listas(email):
+    docs = await _lista(coleccion_async(RankingPersonal).find(
+        {'user_email': email}, {'elementos': 0}
+    ))
+    return [instancia(RankingPersonal, d) for d in docs]
+
+
+@login_required(login_url='login')
+async def detalle_movil(request, movil_id):
+    if request.method == 'POST':
+        return await sync_to_async(views.detalle_movil)(request, movil_id)
+
+    if request.GET.get('parcial'):
+        valoraciones, siguiente = await resenas.pagina_async(movil_id, views.cursor_resenas(request))
+        return await sync_to_async(views.pagina_resenas)(request, valoraciones, siguiente)
+
+    user = await request.auser()
+    movil, mi_valoracion, mis_listas, (valoraciones, siguiente), resumen, parecidos, mas_baratos = await asyncio.gather(
+        sync_to_async(cache_catalogo.movil)(movil_id),
+        _mi_valoracion(user.email, movil_id),
+        _mis_listas(user.email),
+        resenas.pagina_async(movil_id),
+        sync_to_async(agregados.resumen_movil)(movil_id),
+        sync_to_async(views.parecidos)(movil_id),
+        sync_to_async(views.mas_baratos)(movil_id),
+    )
+    if movil is None:
+        await sync_to_async(messages.error)(request, "El móvil no existe.")
+        return redirect('catalogo')
+
+    return await sync_to_async(render)(request, 'detalle_movil.html', views.contexto_detalle(
+        movil, mi_valoracion, mis_listas, valoraciones, siguiente, resumen, parecidos, mas_baratos
+    ))
+
+
+@login_required
+async def ver_ranking(request, ranking_id):
+    if request.method == 'POST':
+        return await sync_to_async(views.ver_ranking)(request, ranking_id)
+
+    user = await request.auser()
+    doc = await coleccion_async(RankingPersonal).find_one({columna_pk(RankingPersonal): ranking_id})
+    if doc is None:
+        return redirect('mis_rankings')
+    ranking = instancia(RankingPersonal, doc)
+    if ranking.user_email != user.email:
+        return redirect('dashboard')
+
+    all_ids = [i for movil_ids in ranking.elementos.values() for i in movil_ids]
+    moviles_db = await sync_to_async(cache_catalogo.moviles_por_id)(all_ids)
+    tiers_data = {tier: [moviles_db[i] for i in ranking.elementos.get(tier, []) if i in moviles_db]
+                  for tier in tierlist.TIERS}
+
+    return await sync_to_async(render)(request, 'ver_ranking.html', {
+        'ranking': ranking,
+        'tiers_data': tiers_data
+    })